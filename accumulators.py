@@ -0,0 +1,172 @@
+import numpy as np
+from metrics import MetricKernel
+
+# Running statistics stored per slot; means and centred moments follow Welford/Chan
+STATE = ('weight', 'mean_f', 'mean_o', 'm2_f', 'm2_o', 'c_fo', 'mean_abs')
+
+
+class MetricAccumulator:
+    """
+    Array-backed running statistics of forecast/reference pairs, one slot per cell of `shape`.
+
+    Each slot holds the total weight, the means of forecast and reference, their centred
+    second moments and cross-moment, and the mean absolute error. Slots update from
+    batches of fields and merge pairwise with Chan's formulas, so partial results from
+    different workers or runs combine without keeping the data.
+    """
+
+    def __init__(self, shape):
+        """
+        Parameters:
+        - shape: tuple of int, slot layout (e.g. (model, lead) or (model, lead, init))
+        """
+        self.shape = tuple(shape)
+        for name in STATE:
+            setattr(self, name, np.zeros(self.shape))
+
+    @staticmethod
+    def batch_state(forecasts, actual, weights=None):
+        """
+        Statistics of a stack of fields, one entry per field.
+
+        Parameters:
+        - forecasts: numpy.ndarray, shape (n, ...) stacked forecast fields
+        - actual: numpy.ndarray, reference field (or stack) broadcastable to `forecasts`
+        - weights: numpy.ndarray, optional per-point weights broadcastable to one field
+
+        Returns:
+        - dict, one (n,) array per entry of STATE; pairs with a NaN on either side are ignored
+        """
+        weights = np.ones(forecasts.shape[1:]) if weights is None else np.broadcast_to(weights, forecasts.shape[1:])
+        return MetricKernel(weights).moments(forecasts, actual)
+
+    @staticmethod
+    def _combine(a, b):
+        """Chan's pairwise merge of two state dicts (arrays of equal shape)."""
+        weight = a['weight'] + b['weight']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share_b = np.where(weight > 0, b['weight'] / weight, 0.0)
+            cross = np.where(weight > 0, a['weight'] * b['weight'] / weight, 0.0)
+        delta_f = b['mean_f'] - a['mean_f']
+        delta_o = b['mean_o'] - a['mean_o']
+        return {
+            'weight': weight,
+            'mean_f': a['mean_f'] + delta_f * share_b,
+            'mean_o': a['mean_o'] + delta_o * share_b,
+            'm2_f': a['m2_f'] + b['m2_f'] + delta_f * delta_f * cross,
+            'm2_o': a['m2_o'] + b['m2_o'] + delta_o * delta_o * cross,
+            'c_fo': a['c_fo'] + b['c_fo'] + delta_f * delta_o * cross,
+            'mean_abs': a['mean_abs'] + (b['mean_abs'] - a['mean_abs']) * share_b
+        }
+
+    def state(self, index=Ellipsis):
+        """State arrays of the selected slots as a dict."""
+        return {name: getattr(self, name)[index] for name in STATE}
+
+    def update(self, index, forecasts, actual, weights=None):
+        """
+        Fold a stack of fields into the given slots.
+
+        Parameters:
+        - index: tuple of index arrays (one per axis of `shape`) selecting one distinct
+          slot per field in `forecasts`
+        - forecasts, actual, weights: as in batch_state
+        """
+        self.fold(index, self.batch_state(forecasts, actual, weights))
+
+    def fold(self, index, state):
+        """
+        Merge precomputed statistics (e.g. from batch_state or a results store) into slots.
+
+        Parameters:
+        - index: tuple of index arrays selecting one distinct slot per entry of `state`
+        - state: dict, arrays per entry of STATE
+        """
+        merged = self._combine(self.state(index), {name: np.asarray(state[name], dtype=np.float64) for name in STATE})
+        for name in STATE:
+            getattr(self, name)[index] = merged[name]
+
+    def merge(self, other):
+        """
+        Merge another accumulator of the same shape into this one, slot by slot.
+
+        Returns:
+        - self
+        """
+        merged = self._combine(self.state(), other.state())
+        for name in STATE:
+            setattr(self, name, merged[name])
+        return self
+
+    def reduce(self, axis):
+        """
+        Pool the slots along one axis.
+
+        Parameters:
+        - axis: int, axis of `shape` to merge away
+
+        Returns:
+        - MetricAccumulator, with that axis removed
+        """
+        shape = self.shape[:axis] + self.shape[axis + 1:]
+        pooled = MetricAccumulator(shape)
+        for k in range(self.shape[axis]):
+            index = (slice(None),) * axis + (k,)
+            pooled.merge(MetricAccumulator.from_state(shape, self.state(index)))
+        return pooled
+
+    @classmethod
+    def from_state(cls, shape, state):
+        """Build an accumulator from a dict of state arrays."""
+        accumulator = cls(shape)
+        for name in STATE:
+            setattr(accumulator, name, np.array(state[name], dtype=np.float64).reshape(shape))
+        return accumulator
+
+    def save(self, path):
+        """Write the state arrays to an .npz file."""
+        np.savez(path, **self.state())
+
+    @classmethod
+    def load(cls, path):
+        """Read an accumulator written by save()."""
+        with np.load(path) as data:
+            return cls.from_state(data['weight'].shape, data)
+
+    def _per_weight(self, total):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.weight > 0, total / self.weight, np.nan)
+
+    def bias(self):
+        """Mean error (forecast minus reference)."""
+        return np.where(self.weight > 0, self.mean_f - self.mean_o, np.nan)
+
+    def mae(self):
+        """Mean absolute error."""
+        return np.where(self.weight > 0, self.mean_abs, np.nan)
+
+    def mse(self):
+        """Mean squared error, from the error variance plus the squared bias."""
+        error_variance = np.clip(self._per_weight(self.m2_f + self.m2_o - 2 * self.c_fo), 0.0, None)
+        return error_variance + self.bias() ** 2
+
+    def rmse(self):
+        """Root mean squared error."""
+        return np.sqrt(self.mse())
+
+    def variance_f(self):
+        """Forecast variance."""
+        return self._per_weight(self.m2_f)
+
+    def variance_o(self):
+        """Reference variance."""
+        return self._per_weight(self.m2_o)
+
+    def covariance(self):
+        """Forecast/reference covariance."""
+        return self._per_weight(self.c_fo)
+
+    def correlation(self):
+        """Pearson correlation from the pooled moments."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.weight > 0, self.c_fo / np.sqrt(self.m2_f * self.m2_o), np.nan)
@@ -0,0 +1,203 @@
+import os
+import numpy as np
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import config
+from catalog import scan_model, DAILY_FILE
+from data_io import reference_file_path, init_dates
+from repack import open_store, parse_model_path
+
+
+def allowed(model_name, parameter, lead, limits=None):
+    """
+    Whether a model can have a forecast at all, from the `availability` limits in config.py.
+
+    Parameters:
+    - model_name, parameter: str
+    - lead: int, lead time in days
+    - limits: dict, availability config (defaults to config.availability)
+
+    Returns:
+    - bool, False beyond the model's max_horizon or for a predictor it does not provide
+    """
+    limits = config.availability if limits is None else limits
+    model_limits = limits.get(model_name, {})
+    if lead > model_limits.get('max_horizon', lead):
+        return False
+    return parameter in model_limits.get('available_predictors', [parameter])
+
+
+def within_limits(tasks, parameter, limits=None):
+    """Planned tasks that the availability limits do not rule out."""
+    return [task for task in tasks if allowed(task['model'], parameter, task['lead'], limits)]
+
+
+def scan_reference(reference_name, parameter, reference_data=None):
+    """
+    Valid dates of the daily files of a reference dataset, from one directory listing.
+
+    Returns:
+    - set of datetime
+    """
+    reference_data = config.reference_data if reference_data is None else reference_data
+    daily_dir = os.path.dirname(reference_file_path(reference_name, parameter, datetime(2000, 1, 1), reference_data))
+    try:
+        entries = list(os.scandir(daily_dir))
+    except FileNotFoundError:
+        return set()
+    return {datetime.strptime(match.group(1), "%Y%j") for match in (DAILY_FILE.match(entry.name) for entry in entries) if match}
+
+
+class AvailabilityIndex:
+    """
+    What the DATA_PROCESSED tree holds, built from directory listings alone.
+
+    For every (model, parameter) a presence bitmap over (init, member, lead) is kept,
+    together with the valid dates of every (reference, parameter); lookups never
+    touch the file system. Fields held by a repacked store (see repack.py) count as
+    present, as their daily files may have been deleted after repacking.
+    """
+
+    def __init__(self, catalogs, reference_dates, limits=None, stores=None, models=None):
+        """
+        Parameters:
+        - catalogs: dict, (model, parameter) -> catalog.ModelCatalog
+        - reference_dates: dict, (reference, parameter) -> set of valid dates
+        - limits: dict, availability config (defaults to config.availability)
+        - stores: dict, (model, parameter) -> repack.RepackedStore or None
+        - models: dict, model config used to parse forecast paths (defaults to config.models)
+        """
+        self.catalogs = catalogs
+        self.reference_dates = reference_dates
+        self.limits = config.availability if limits is None else limits
+        self.models = config.models if models is None else models
+        self.paths = {key: {os.path.normpath(path) for path in catalog.files.values()} for key, catalog in catalogs.items()}
+        stores = {} if stores is None else stores
+        # (init, lead, member) of every field, whether in a daily file or a store
+        self.fields = {key: set(catalog.files) | (stores[key].fields() if stores.get(key) is not None else set())
+                       for key, catalog in catalogs.items()}
+
+    def bitmap(self, model_name, parameter):
+        """
+        Presence of every file of one model and parameter.
+
+        Returns:
+        - xarray.DataArray, bool (init, member, lead) with the valid date as a coordinate
+        """
+        fields = self.fields[(model_name, parameter)]
+        init_list = sorted({key[0] for key in fields})
+        leads = sorted({key[1] for key in fields})
+        members = sorted({key[2] for key in fields})
+        present = np.zeros((len(init_list), len(members), len(leads)), dtype=bool)
+        init_index = {init: i for i, init in enumerate(init_list)}
+        member_index = {member: i for i, member in enumerate(members)}
+        lead_index = {lead: i for i, lead in enumerate(leads)}
+        for init_date, lead, member in fields:
+            present[init_index[init_date], member_index[member], lead_index[lead]] = True
+        inits = np.array(init_list, dtype='datetime64[ns]')
+        return xr.DataArray(present, dims=('init', 'member', 'lead'),
+                            coords={'init': inits, 'member': members, 'lead': leads,
+                                    'valid': (('init', 'lead'), inits[:, None] + np.array(leads, dtype='timedelta64[D]'))},
+                            name=f"{model_name}_{parameter}")
+
+    def has_forecast(self, task, parameter):
+        """Whether the field of a planned task is on disk or in a store and the model can provide it."""
+        key = (task['model'], parameter)
+        if not (allowed(task['model'], parameter, task['lead'], self.limits) and key in self.paths):
+            return False
+        path = os.path.normpath(task['model_path'])
+        if path in self.paths[key]:
+            return True
+        parsed = parse_model_path(path, self.models)
+        return parsed is not None and (parsed[2], parsed[4], parsed[3]) in self.fields[key]
+
+    def has_reference(self, reference_name, parameter, valid_date):
+        return valid_date in self.reference_dates.get((reference_name, parameter), ())
+
+    def filter_tasks(self, tasks, parameter, reference_name):
+        """
+        Split planned tasks into those worth reading and those that cannot be scored.
+
+        Returns:
+        - kept: list of tasks whose forecast field (daily file or store) and reference file exist
+        - missing: list of paths (forecast or reference) that rule out the other tasks;
+          tasks beyond the availability limits are dropped without being listed
+        """
+        kept, missing = [], []
+        for task in tasks:
+            if not allowed(task['model'], parameter, task['lead'], self.limits):
+                continue
+            if not self.has_reference(reference_name, parameter, task['valid']):
+                missing.append(task['reference_path'])
+            elif not self.has_forecast(task, parameter):
+                missing.append(task['model_path'])
+            else:
+                kept.append(task)
+        return kept, list(dict.fromkeys(missing))
+
+    def coverage(self, parameter, start_date, end_date, forecast_horizons, reference_name=None):
+        """
+        Share of init dates with a forecast field, per model and lead (first member).
+
+        Returns:
+        - xarray.DataArray, (model, lead) fraction, NaN where the availability limits rule
+          the lead out; with a reference, a `reference` row gives the share of valid dates present
+        """
+        inits = init_dates(start_date, end_date)
+        rows, names = [], []
+        for (model_name, model_parameter), fields in self.fields.items():
+            if model_parameter != parameter:
+                continue
+            members = sorted({key[2] for key in fields})
+            member = members[0] if members else None
+            row = [np.mean([(init_date, lead, member) in fields for init_date in inits])
+                   if allowed(model_name, parameter, lead, self.limits) else np.nan for lead in forecast_horizons]
+            rows.append(row)
+            names.append(model_name)
+        if reference_name is not None:
+            rows.append([np.mean([self.has_reference(reference_name, parameter, init_date + timedelta(days=lead)) for init_date in inits])
+                         for lead in forecast_horizons])
+            names.append(reference_name)
+        return xr.DataArray(np.array(rows, dtype=float).reshape(len(names), len(forecast_horizons)), dims=('model', 'lead'),
+                            coords={'model': names, 'lead': list(forecast_horizons)})
+
+    def report(self, parameter, start_date, end_date, forecast_horizons, reference_name=None):
+        """Print the coverage as a compact table of percentages ('-' beyond the limits)."""
+        table = self.coverage(parameter, start_date, end_date, forecast_horizons, reference_name)
+        print(f"\nCoverage of {parameter}, inits {start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')} (% of init dates with a file)")
+        print(f"{'lead':<12}" + ''.join(f"{lead:>5}" for lead in table['lead'].values))
+        for name in table['model'].values:
+            cells = ['    -' if np.isnan(value) else f"{100 * value:>5.0f}" for value in table.sel(model=name).values]
+            print(f"{name:<12}" + ''.join(cells))
+
+
+def scan_availability(parameters, models=None, reference_data=None, limits=None, threads=None):
+    """
+    Walk the DATA_PROCESSED tree once, one thread per model and reference directory.
+
+    Parameters:
+    - parameters: list of str, parameter names
+    - models, reference_data, limits: dict, config overrides (default: config)
+    - threads: int, directory scanning threads (defaults to one per directory, at most 16)
+
+    Returns:
+    - AvailabilityIndex
+    """
+    models = config.models if models is None else models
+    reference_data = config.reference_data if reference_data is None else reference_data
+    limits = config.availability if limits is None else limits
+    model_jobs = [(model_name, parameter) for parameter in parameters for model_name, details in models.items()
+                  if parameter in details['predictors'] and parameter in limits.get(model_name, {}).get('available_predictors', [parameter])]
+    reference_jobs = [(reference_name, parameter) for parameter in parameters for reference_name, details in reference_data.items()
+                      if 'file_path' in details and parameter in details['variable_names']]
+    threads = min(16, len(model_jobs) + len(reference_jobs)) if threads is None else threads
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        catalogs = executor.map(lambda job: scan_model(job[0], job[1], models), model_jobs)
+        references = executor.map(lambda job: scan_reference(job[0], job[1], reference_data), reference_jobs)
+        stores = {job: open_store(*job) for job in model_jobs}
+        index = AvailabilityIndex(dict(zip(model_jobs, catalogs)), dict(zip(reference_jobs, references)), limits, stores, models)
+    print(f"Scanned {sum(len(catalog) for catalog in index.catalogs.values())} forecast files, "
+          f"{sum(len(fields) for fields in index.fields.values())} forecast fields with the repacked stores and "
+          f"{sum(len(dates) for dates in index.reference_dates.values())} reference files")
+    return index
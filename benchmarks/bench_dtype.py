@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_io import decode_field
+from handle_pool import DatasetPool
+from metrics import MetricKernel
+
+# Benchmark inputs
+variable_name = 'air_temperature'
+grids = [(181, 360), (361, 720), (721, 1440)]  # 1, 0.5 and 0.25 degree GWPM grids
+n_fields = 12
+storages = {
+    'float32': {'dtype': 'float32', '_FillValue': np.float32(np.nan)},
+    'int16': {'dtype': 'int16', 'scale_factor': 0.01, 'add_offset': 273.15, '_FillValue': np.int16(-32768)}
+}
+policies = {
+    'float64': {'dtype': 'float64', 'mask': True, 'packed': None},
+    'float32': {'dtype': 'float32', 'mask': True, 'packed': None}
+}
+
+
+def write_fields(root, grid, storage, seed=0):
+    """Daily temperature fields with a few missing cells, stored as float32 or packed int16."""
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(90, -90, grid[0])
+    lon = np.linspace(0, 360, grid[1], endpoint=False)
+    base = 288 - 40 * np.sin(np.deg2rad(lat))[:, None] ** 2 + np.zeros(grid)
+    paths = []
+    for i in range(n_fields):
+        values = base + rng.normal(0, 2, grid)
+        values[rng.random(grid) < 0.01] = np.nan
+        path = os.path.join(root, f"{storage}_{grid[0]}x{grid[1]}_{i:02d}.nc")
+        xr.Dataset({variable_name: (('time', 'lat', 'lon'), values[None])},
+                   coords={'time': [np.datetime64('2024-08-15') + i], 'lat': lat, 'lon': lon}
+                   ).to_netcdf(path, encoding={variable_name: storages[storage]})
+        paths.append(path)
+    return paths, lat, lon
+
+
+def load_stack(paths, method):
+    """Read the fields the way the pipeline did before load policies ('xarray') or under a policy."""
+    pool = DatasetPool(max_open=1)
+    fields = []
+    for path in paths:
+        if method == 'xarray':
+            with pool.dataset(path) as dataset:
+                fields.append(dataset[variable_name].squeeze().values)
+        else:
+            with pool.dataset(path, mask_and_scale=False) as dataset:
+                fields.append(decode_field(dataset[variable_name].squeeze(), policies[method]).values)
+    pool.close_all()
+    return np.stack(fields)
+
+
+def measure(function):
+    """Run a function and return its result, seconds and peak traced allocation in MB."""
+    tracemalloc.start()
+    tic = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - tic
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+print(f"{'grid':>9} {'storage':>8} {'method':>8} {'dtype':>8} {'stack MB':>9} {'load s':>7} {'fields/s':>9} "
+      f"{'load peak':>10} {'score s':>8} {'score peak':>11} {'max |d rmse|':>13}")
+with tempfile.TemporaryDirectory() as root:
+    for grid in grids:
+        kernel = None
+        for storage in storages:
+            paths, lat, lon = write_fields(root, grid, storage)
+            kernel = MetricKernel.for_grid(lat, lon) if kernel is None else kernel
+            baseline = None
+            for method in ['xarray'] + list(policies):
+                load_stack(paths[:1], method)  # Warm up imports and the file cache
+                stack, load_seconds, load_peak = measure(lambda: load_stack(paths, method))
+                kernel.scores(stack[1:], stack[0])  # Allocate the kernel's float64 buffers
+                scores, score_seconds, score_peak = measure(lambda: kernel.scores(stack[1:], stack[0]))
+                rmse = scores['rmse']
+                baseline = rmse if baseline is None else baseline
+                print(f"{grid[0]:>4}x{grid[1]:<4} {storage:>8} {method:>8} {str(stack.dtype):>8} {stack.nbytes / 1024 ** 2:>9.1f} "
+                      f"{load_seconds:>7.2f} {n_fields / load_seconds:>9.1f} {load_peak:>10.1f} {score_seconds:>8.2f} "
+                      f"{score_peak:>11.1f} {np.nanmax(np.abs(rmse - baseline)):>13.2e}")
+                del stack
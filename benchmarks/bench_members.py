@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_archive import generate_members
+from ensemble import stream_member_statistics, list_members, member_file_path
+from handle_pool import DatasetPool, peak_rss_mb
+
+# Benchmark inputs
+param = 'Temp'
+model_name = 'ECMWF_IFS'
+init_date = datetime(2024, 8, 15)
+member_counts = [10, 25, 50]
+forecast_horizons = [1, 2, 3]
+grid = (181, 360)
+quantiles = (0.1, 0.5, 0.9)
+band_fields = 16  # Latitude band budget of the streaming path, in fields
+
+
+def full_array_statistics(models):
+    """Reference result from every member held in memory at once, in float64."""
+    pool = DatasetPool()
+    variable_name = models[model_name]['variable_names'][param]
+    members = list_members(model_name, param, init_date, models)
+    results = []
+    for lead in forecast_horizons:
+        valid_date = init_date + np.timedelta64(lead, 'D').astype(object)
+        stack = []
+        for member in members:
+            with pool.dataset(member_file_path(model_name, param, init_date, valid_date, member, models)) as dataset:
+                stack.append(dataset[variable_name].squeeze().values)
+        stack = np.array(stack, dtype=np.float64)
+        results.append({'mean': stack.mean(axis=0), 'std': stack.std(axis=0, ddof=1),
+                        'quantiles': np.quantile(stack, quantiles, axis=0)})
+    pool.close_all()
+    return results
+
+
+def measure(function):
+    """Run a function and return its result, seconds and peak traced allocation in MB."""
+    tracemalloc.start()
+    tic = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - tic
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+print(f"{'members':>8} {'method':>10} {'seconds':>8} {'fields/s':>9} {'MB/s':>7} {'peak MB':>8} {'peak fields':>12} "
+      f"{'max |mean|':>11} {'max |std|':>10} {'max |q|':>10}")
+for n_members in member_counts:
+    with tempfile.TemporaryDirectory() as root:
+        models, _ = generate_members(root, model_name, param, init_date, n_members, forecast_horizons, *grid)
+        n_fields = n_members * len(forecast_horizons)
+        field_mb = grid[0] * grid[1] * 4 / 1024 ** 2
+
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            streamed, stream_seconds, stream_peak = measure(
+                lambda: stream_member_statistics(model_name, param, init_date, forecast_horizons, quantiles, models,
+                                                 max_mb=band_fields * field_mb))
+        full, full_seconds, full_peak = measure(lambda: full_array_statistics(models))
+
+        mean_error = max(np.abs(streamed['mean'].values[i] - full[i]['mean']).max() for i in range(len(forecast_horizons)))
+        std_error = max(np.abs(streamed['std'].values[i] - full[i]['std']).max() for i in range(len(forecast_horizons)))
+        quantile_error = max(np.abs(streamed['quantile_values'].values[i] - full[i]['quantiles']).max() for i in range(len(forecast_horizons)))
+        for method, seconds, peak in (('streaming', stream_seconds, stream_peak), ('full', full_seconds, full_peak)):
+            print(f"{n_members:>8} {method:>10} {seconds:>8.2f} {n_fields / seconds:>9.1f} {n_fields * field_mb / seconds:>7.1f} "
+                  f"{peak:>8.1f} {peak / field_mb:>12.1f} {mean_error:>11.2e} {std_error:>10.2e} {quantile_error:>10.2e}")
+
+print(f"\nStreaming peak is bounded by the {band_fields}-field band, its float64 reducer state and "
+      f"{5 + len(quantiles)} output fields per lead ({(5 + len(quantiles)) * len(forecast_horizons)} here); "
+      f"the full stack grows with the member count.")
+print(f"\nProcess peak RSS: {peak_rss_mb():.0f} MB")
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import tempfile
+import contextlib
+import numpy as np
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_archive import generate_archive
+from verification import run_verification
+from reference_cache import ReferenceCache
+
+# Benchmark inputs
+param = 'Temp'
+reference_name = 'GDAS'
+start_date = datetime(2024, 8, 15)
+n_inits = 16
+forecast_horizons = list(range(1, 8))
+grid = (181, 360)
+worker_counts = [w for w in (1, 2, 4, 8, 16, 32, 64) if w <= os.cpu_count()]
+
+with tempfile.TemporaryDirectory() as root:
+    print(f"Generating synthetic archive in {root} ...")
+    models, reference_data = generate_archive(root, param, start_date, n_inits, forecast_horizons, reference_name,
+                                              n_lat=grid[0], n_lon=grid[1])
+    end_date = start_date + timedelta(days=n_inits - 1)
+
+    timings = {}
+    baseline = None
+    for workers in worker_counts:
+        cache = ReferenceCache(reference_data=reference_data)
+        tic = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            results = run_verification(param, reference_name, start_date, end_date, forecast_horizons,
+                                       models=models, reference_data=reference_data,
+                                       reference_cache=cache, workers=workers)
+        timings[workers] = time.perf_counter() - tic
+
+        if baseline is None:
+            baseline = results
+        else:
+            identical = all(np.array_equal(results[name].values, baseline[name].values, equal_nan=True)
+                            for name in ('rmse', 'correlation', 'weight'))
+            print(f"  {workers} workers match serial result: {identical}")
+
+    n_fields = int((baseline['weight'] > 0).sum())
+    print(f"\n{'workers':>8} {'seconds':>9} {'speed-up':>9} {'fields/s':>9}")
+    for workers, seconds in timings.items():
+        print(f"{workers:>8} {seconds:>9.2f} {timings[worker_counts[0]] / seconds:>9.2f} {n_fields / seconds:>9.1f}")
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_archive import generate_gwpm_archive
+from data_io import model_file_path, reference_file_path
+from handle_pool import peak_rss_mb
+
+# Benchmark inputs
+parameters = ['Temp', 'P']
+param = 'Temp'  # Parameter scored by the workflows
+reference_name = 'GDAS'
+start_date = datetime(2024, 8, 15)
+n_inits = 6
+forecast_horizons = list(range(1, 8))
+n_members = 3
+grid = (91, 180)
+workers = 1
+regions = {'box': ((35, 36), (140, 141)), 'sahel': ((10, 20), (-15, 30))}
+history_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_history.json')
+regression_threshold = 1.2  # Flag workflows or stages this much slower than the last comparable run
+
+end_date = start_date + timedelta(days=n_inits - 1)
+
+
+def input_files(models, reference_data):
+    """Model files (first member) and reference files a deterministic run of `param` reads."""
+    files = []
+    valid_dates = set()
+    for model_name, details in models.items():
+        if param not in details['predictors']:
+            continue
+        for i in range(n_inits):
+            init_date = start_date + timedelta(days=i)
+            for lead in forecast_horizons:
+                valid_date = init_date + timedelta(days=lead)
+                path = model_file_path(model_name, param, init_date, valid_date, models)
+                if os.path.exists(path):
+                    files.append(path)
+                    valid_dates.add(valid_date)
+    files += [reference_file_path(reference_name, param, valid_date, reference_data) for valid_date in sorted(valid_dates)]
+    return files
+
+
+def run_calc(models, reference_data, output_dir):
+    from verification import run_verification
+    from results_io import write_results
+    results = run_verification(param, reference_name, start_date, end_date, forecast_horizons,
+                               models=models, reference_data=reference_data, workers=workers)
+    write_results(results, os.path.join(output_dir, 'results.nc'))
+
+
+def run_map(models, reference_data, output_dir):
+    from best_model import accumulate_cell_scores, best_model_maps
+    accumulator, model_names, lat, lon = accumulate_cell_scores(param, reference_name, start_date, end_date, forecast_horizons,
+                                                                models=models, reference_data=reference_data)
+    best_model_maps(accumulator, model_names, forecast_horizons, lat, lon).to_netcdf(os.path.join(output_dir, 'best_model.nc'))
+
+
+def run_grid(models, reference_data, output_dir):
+    from roi import RegionReader
+    reader = RegionReader(regions)
+    reference_means = {}
+    errors = []
+    for i in range(n_inits):
+        init_date = start_date + timedelta(days=i)
+        for lead in forecast_horizons:
+            valid_date = init_date + timedelta(days=lead)
+            if valid_date not in reference_means:
+                reference_means[valid_date] = reader.means(reference_file_path(reference_name, param, valid_date, reference_data),
+                                                           reference_data[reference_name]['variable_names'][param])
+            for model_name, details in models.items():
+                if param not in details['predictors']:
+                    continue
+                try:
+                    forecast = reader.means(model_file_path(model_name, param, init_date, valid_date, models),
+                                            details['variable_names'][param])
+                except FileNotFoundError:
+                    continue
+                errors.append(forecast - reference_means[valid_date])
+    np.sqrt(np.mean(np.square(errors), axis=0))
+
+
+def run_ensemble(models, reference_data, output_dir):
+    from ensemble import run_ensemble_verification
+    run_ensemble_verification(param, reference_name, start_date, end_date, forecast_horizons,
+                              models=models, reference_data=reference_data)
+
+
+workflows = {
+    'gwpm_calc': run_calc,
+    'gwpm_map': run_map,
+    'gwpm_grid': run_grid,
+    'ensemble': run_ensemble
+}
+
+
+def time_workflow(name, models, reference_data, output_dir):
+    """Run one workflow; executed in a fresh process so its peak RSS is its own."""
+    tic = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        workflows[name](models, reference_data, output_dir)
+    return time.perf_counter() - tic, peak_rss_mb()
+
+
+def time_stages(models, reference_data):
+    """Time the building blocks separately on the deterministic inputs of `param`."""
+    from regrid import regrid_stack
+    from metrics import MetricKernel
+
+    files = input_files(models, reference_data)
+    timings = {}
+
+    tic = time.perf_counter()
+    datasets = [xr.open_dataset(path) for path in files]
+    timings['open'] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    fields = {}
+    for path, dataset in zip(files, datasets):
+        variable_name = next(iter(dataset.data_vars))
+        fields[path] = (dataset[variable_name].squeeze().values.astype(np.float32), dataset['lat'].values, dataset['lon'].values)
+    timings['decode'] = time.perf_counter() - tic
+    for dataset in datasets:
+        dataset.close()
+
+    reference_files = [path for path in files if path.startswith(reference_data[reference_name]['data_path'])]
+    reference = {os.path.basename(path): fields[path] for path in reference_files}
+    _, target_lat, target_lon = next(iter(reference.values()))
+    icon = [fields[path] for path in files if path.startswith(models['ICON']['data_path'])]
+    tic = time.perf_counter()
+    if icon:
+        regrid_stack(np.array([values for values, _, _ in icon]), icon[0][1], icon[0][2], target_lat, target_lon)
+    timings['regrid'] = time.perf_counter() - tic
+
+    kernel = MetricKernel.for_grid(target_lat, target_lon)
+    on_grid = [(os.path.basename(path), fields[path][0]) for path in files
+               if path not in reference_files and fields[path][0].shape == (len(target_lat), len(target_lon))]
+    tic = time.perf_counter()
+    for day_file, actual in reference.items():
+        stack = [values for file_name, values in on_grid if file_name == day_file]
+        if stack:
+            kernel.moments(np.array(stack), actual[0])
+    timings['reduce'] = time.perf_counter() - tic
+
+    counts = {'open': len(files), 'decode': len(files), 'regrid': len(icon), 'reduce': len(on_grid)}
+    sizes = {'open': sum(os.path.getsize(path) for path in files), 'decode': sum(values.nbytes for values, _, _ in fields.values()),
+             'regrid': sum(values.nbytes for values, _, _ in icon), 'reduce': sum(values.nbytes for _, values in on_grid)}
+    return {stage: throughput(seconds, counts[stage], sizes[stage], peak_rss_mb())
+            for stage, seconds in timings.items()}
+
+
+def throughput(seconds, n_files, n_bytes, peak_rss):
+    return {'seconds': round(seconds, 4), 'files': n_files, 'mb': round(n_bytes / 1024 ** 2, 2),
+            'files_per_s': round(n_files / seconds, 1) if seconds else None,
+            'mb_per_s': round(n_bytes / 1024 ** 2 / seconds, 1) if seconds else None,
+            'peak_rss_mb': round(peak_rss, 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+settings = {'parameters': parameters, 'param': param, 'reference': reference_name, 'n_inits': n_inits,
+            'forecast_horizons': forecast_horizons, 'n_members': n_members, 'grid': list(grid), 'workers': workers}
+
+with tempfile.TemporaryDirectory() as root:
+    print(f"Generating synthetic archive in {root} ...")
+    tic = time.perf_counter()
+    models, reference_data = generate_gwpm_archive(root, parameters, start_date, n_inits, forecast_horizons, n_members, *grid)
+    tree_files = sum(len(names) for _, _, names in os.walk(root))
+    print(f"  {tree_files} files in {time.perf_counter() - tic:.1f} s")
+    files = input_files(models, reference_data)
+    input_mb = sum(os.path.getsize(path) for path in files)
+
+    results = {}
+    for name in workflows:
+        output_dir = os.path.join(root, 'OUTPUT', name)
+        os.makedirs(output_dir)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            seconds, peak = executor.submit(time_workflow, name, models, reference_data, output_dir).result()
+        results[name] = throughput(seconds, len(files), input_mb, peak)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        results.update(executor.submit(time_stages, models, reference_data).result())
+
+print(f"\n{'step':>10} {'seconds':>8} {'files':>6} {'files/s':>8} {'MB/s':>7} {'peak MB':>8} {'vs last':>8}")
+history = []
+if os.path.exists(history_path):
+    with open(history_path) as file:
+        history = json.load(file)
+previous = next((run['results'] for run in reversed(history) if run['settings'] == settings), {})
+regressions = []
+for name, result in results.items():
+    ratio = result['seconds'] / previous[name]['seconds'] if previous.get(name, {}).get('seconds') else None
+    if ratio is not None and ratio > regression_threshold:
+        regressions.append(name)
+    print(f"{name:>10} {result['seconds']:>8.2f} {result['files']:>6} {result['files_per_s'] or 0:>8.1f} "
+          f"{result['mb_per_s'] or 0:>7.1f} {result['peak_rss_mb']:>8.0f} {f'{ratio:.2f}x' if ratio else '-':>8}")
+
+history.append({'timestamp': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(), 'host': platform.node(),
+                'python': platform.python_version(), 'settings': settings, 'results': results})
+with open(history_path, 'w') as file:
+    json.dump(history, file, indent=1)
+print(f"\nAppended run to {history_path}")
+if regressions:
+    print(f"Slower than {regression_threshold}x the last comparable run: {', '.join(regressions)}")
@@ -0,0 +1,192 @@
+import os
+import sys
+import copy
+import numpy as np
+import xarray as xr
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from data_io import model_file_path, reference_file_path
+
+
+def synthetic_config(root):
+    """
+    Copies of `models` and `reference_data` with DATA_PROCESSED moved under `root`.
+
+    Returns:
+    - models, reference_data: dict, same layout as config.py
+    """
+    archive_root = config.config['dir_data_processed'].rstrip('/')
+    models = copy.deepcopy(config.models)
+    reference_data = copy.deepcopy(config.reference_data)
+    for details in list(models.values()) + list(reference_data.values()):
+        for key in ('data_path', 'file_path'):
+            if key in details:
+                details[key] = details[key].replace(archive_root, root.rstrip('/'))
+    return models, reference_data
+
+
+def _write_field(path, variable_name, values, lat, lon, date):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dataset = xr.Dataset({variable_name: (('time', 'lat', 'lon'), values[None].astype(np.float32))},
+                         coords={'time': [np.datetime64(date, 'ns')], 'lat': lat, 'lon': lon})
+    dataset.to_netcdf(path)
+
+
+def generate_archive(root, parameter, start_date, n_inits, forecast_horizons, reference_name='GDAS',
+                     n_lat=181, n_lon=360, seed=0):
+    """
+    Write a small GWPM-like archive of daily NetCDF files under `root`.
+
+    Forecasts are the reference plus noise that grows with lead time; ICON is written
+    on a finer latitude grid so the regridding path is exercised.
+
+    Parameters:
+    - root: str, directory standing in for DATA_PROCESSED
+    - parameter: str, parameter name
+    - start_date: datetime, first init date
+    - n_inits: int, number of daily init dates
+    - forecast_horizons: list of int, lead times in days
+    - reference_name: str, reference dataset to write
+    - n_lat, n_lon: int, grid size of the reference and most models
+    - seed: int, random seed
+
+    Returns:
+    - models, reference_data: dict, config pointing at the synthetic archive
+    """
+    rng = np.random.default_rng(seed)
+    models, reference_data = synthetic_config(root)
+    lat = np.linspace(-90, 90, n_lat)
+    lon = np.linspace(-180, 180, n_lon, endpoint=False)
+    fine_lat = np.linspace(-90, 90, 2 * n_lat - 1)
+
+    truth = {}
+    for day in range(n_inits + max(forecast_horizons)):
+        valid_date = start_date + timedelta(days=day + 1)
+        truth[valid_date] = 280 + 10 * np.cos(np.deg2rad(lat))[:, None] + rng.normal(size=(n_lat, n_lon))
+        _write_field(reference_file_path(reference_name, parameter, valid_date, reference_data),
+                     reference_data[reference_name]['variable_names'][parameter], truth[valid_date], lat, lon, valid_date)
+
+    for i in range(n_inits):
+        init_date = start_date + timedelta(days=i)
+        for lead in forecast_horizons:
+            valid_date = init_date + timedelta(days=lead)
+            for model_name, details in models.items():
+                if parameter not in details['predictors']:
+                    continue
+                values = truth[valid_date] + 0.2 * lead * rng.normal(size=(n_lat, n_lon))
+                model_lat = lat
+                if model_name == 'ICON':
+                    values = xr.DataArray(values, dims=('lat', 'lon'), coords={'lat': lat, 'lon': lon}).interp(lat=fine_lat).values
+                    model_lat = fine_lat
+                _write_field(model_file_path(model_name, parameter, init_date, valid_date, models),
+                             details['variable_names'][parameter], values, model_lat, lon, init_date)
+    return models, reference_data
+
+
+def generate_members(root, model_name, parameter, init_date, n_members, forecast_horizons, n_lat=181, n_lon=360, seed=0):
+    """
+    Write one ensemble run of `n_members` member folders under `root`.
+
+    Parameters:
+    - root: str, directory standing in for DATA_PROCESSED
+    - model_name: str, ensemble model (its file_path must contain a member folder)
+    - parameter: str, parameter name
+    - init_date: datetime, init date of the run
+    - n_members: int, number of members
+    - forecast_horizons: list of int, lead times in days
+    - n_lat, n_lon: int, grid size
+    - seed: int, random seed
+
+    Returns:
+    - models, reference_data: dict, config pointing at the synthetic archive
+    """
+    from ensemble import member_file_path
+    from catalog import model_layout
+
+    rng = np.random.default_rng(seed)
+    models, reference_data = synthetic_config(root)
+    width = model_layout(model_name, models)['member_width']
+    lat = np.linspace(-90, 90, n_lat)
+    lon = np.linspace(-180, 180, n_lon, endpoint=False)
+    for lead in forecast_horizons:
+        valid_date = init_date + timedelta(days=lead)
+        centre = 280 + 10 * np.cos(np.deg2rad(lat))[:, None] + rng.normal(size=(n_lat, n_lon))
+        for member in range(1, n_members + 1):
+            path = member_file_path(model_name, parameter, init_date, valid_date, f"{member:0{width}d}", models)
+            _write_field(path, models[model_name]['variable_names'][parameter],
+                         centre + 0.3 * lead * rng.normal(size=(n_lat, n_lon)), lat, lon, init_date)
+    return models, reference_data
+
+
+def generate_gwpm_archive(root, parameters, start_date, n_inits, forecast_horizons, n_members=1,
+                          n_lat=181, n_lon=360, seed=0):
+    """
+    Write a complete GWPM-like DATA_PROCESSED tree under `root`.
+
+    Every reference of config.reference_data with a daily file layout (ERA5, GDAS,
+    MSWEP) and every model of config.models is written for the parameters it provides,
+    following config.availability (maximum horizon and available predictors). Ensemble
+    models get `n_members` member folders, the first of which is the member the
+    deterministic scripts read; ICON is written on a finer latitude grid.
+
+    Parameters:
+    - root: str, directory standing in for DATA_PROCESSED
+    - parameters: list of str, parameter names
+    - start_date: datetime, first init date
+    - n_inits: int, number of daily init dates
+    - forecast_horizons: list of int, lead times in days
+    - n_members: int, members per ensemble run
+    - n_lat, n_lon: int, grid size of the references and most models
+    - seed: int, random seed
+
+    Returns:
+    - models, reference_data: dict, config pointing at the synthetic archive
+    """
+    from catalog import model_layout
+    from ensemble import member_file_path
+
+    rng = np.random.default_rng(seed)
+    models, reference_data = synthetic_config(root)
+    lat = np.linspace(-90, 90, n_lat)
+    lon = np.linspace(-180, 180, n_lon, endpoint=False)
+    fine_lat = np.linspace(-90, 90, 2 * n_lat - 1)
+    climate = 280 + 10 * np.cos(np.deg2rad(lat))[:, None]
+
+    for parameter in parameters:
+        truth = {}
+        for day in range(n_inits + max(forecast_horizons)):
+            valid_date = start_date + timedelta(days=day + 1)
+            truth[valid_date] = climate + rng.normal(size=(n_lat, n_lon))
+            for reference_name, details in reference_data.items():
+                if 'file_path' not in details or parameter not in details['variable_names']:
+                    continue
+                _write_field(reference_file_path(reference_name, parameter, valid_date, reference_data),
+                             details['variable_names'][parameter],
+                             truth[valid_date] + 0.1 * rng.normal(size=(n_lat, n_lon)), lat, lon, valid_date)
+
+        for model_name, details in models.items():
+            limits = config.availability.get(model_name, {})
+            if parameter not in details['predictors'] or parameter not in limits.get('available_predictors', details['predictors']):
+                continue
+            width = model_layout(model_name, models)['member_width']
+            members = [f"{member:0{width}d}" for member in range(1, n_members + 1)] if width else [None]
+            for i in range(n_inits):
+                init_date = start_date + timedelta(days=i)
+                for lead in forecast_horizons:
+                    if lead > limits.get('max_horizon', max(forecast_horizons)):
+                        continue
+                    valid_date = init_date + timedelta(days=lead)
+                    for member in members:
+                        values = truth[valid_date] + 0.2 * lead * rng.normal(size=(n_lat, n_lon))
+                        model_lat = lat
+                        if model_name == 'ICON':
+                            values = xr.DataArray(values, dims=('lat', 'lon'), coords={'lat': lat, 'lon': lon}).interp(lat=fine_lat).values
+                            model_lat = fine_lat
+                        if member is None:
+                            path = model_file_path(model_name, parameter, init_date, valid_date, models)
+                        else:
+                            path = member_file_path(model_name, parameter, init_date, valid_date, member, models)
+                        _write_field(path, details['variable_names'][parameter], values, model_lat, lon, init_date)
+    return models, reference_data
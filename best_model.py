@@ -0,0 +1,283 @@
+import numpy as np
+import xarray as xr
+import config
+import instrument
+from verification import plan_verification, group_by_valid_date
+from reference_cache import default_reference_cache
+from regrid import regrid_stack
+from handle_pool import default_pool
+from prefetch import Prefetcher, field_schedule
+
+# Per-cell metrics and whether a lower value is better
+CELL_METRICS = {'rmse': True, 'mae': True, 'bias': True, 'correlation': False}
+
+# Flag values of select_best
+FLAG_OK, FLAG_TIE, FLAG_ALL_NAN = 0, 1, 2
+
+
+class CellScores:
+    """
+    Running per-cell error sums of every (lead, model), in preallocated float32 cubes.
+
+    Each field is added in place (`np.add(..., out=)`) into the (lead, model, lat, lon)
+    cubes of the sums its metrics need, next to an int32 count of valid pairs; no other
+    per-field state is kept. Correlation sums are taken about a fixed per-cell shift
+    (the first reference field) so float32 keeps their precision.
+    """
+
+    # Running sums each metric needs, besides the count
+    SUMS = {'bias': ('error',), 'mae': ('abs_error',), 'rmse': ('squared_error',),
+            'correlation': ('f', 'o', 'ff', 'oo', 'fo')}
+
+    def __init__(self, shape, metrics=None, shift=None):
+        """
+        Parameters:
+        - shape: tuple of int, (lead, model, lat, lon)
+        - metrics: list of str, keys of CELL_METRICS to support (default: all)
+        - shift: numpy.ndarray, (lat, lon) values subtracted before the correlation sums
+        """
+        self.shape = tuple(shape)
+        self.metrics = list(CELL_METRICS) if metrics is None else list(metrics)
+        self.count = np.zeros(self.shape, dtype=np.int32)
+        names = dict.fromkeys(name for metric in self.metrics for name in self.SUMS[metric])
+        self.sums = {name: np.zeros(self.shape, dtype=np.float32) for name in names}
+        self.shift = np.zeros(self.shape[2:], dtype=np.float32) if shift is None else np.nan_to_num(np.asarray(shift, dtype=np.float32))
+        self._buffers = [np.empty(self.shape[2:], dtype=np.float32) for _ in range(3)]
+
+    def add(self, lead_index, model_index, forecast, actual, valid):
+        """
+        Fold one forecast field and its reference into the slot of a lead and model.
+
+        Parameters:
+        - forecast, actual: numpy.ndarray, (lat, lon) fields on the reference grid
+        - valid: numpy.ndarray bool, cells where both are finite
+        """
+        slot = (lead_index, model_index)
+        sums = self.sums
+        error, f, o = self._buffers
+        self.count[slot] += valid
+        np.subtract(forecast, actual, out=error)
+        if 'error' in sums:
+            np.add(sums['error'][slot], error, out=sums['error'][slot], where=valid)
+        if 'squared_error' in sums:
+            np.multiply(error, error, out=f)
+            np.add(sums['squared_error'][slot], f, out=sums['squared_error'][slot], where=valid)
+        if 'abs_error' in sums:
+            np.abs(error, out=error)
+            np.add(sums['abs_error'][slot], error, out=sums['abs_error'][slot], where=valid)
+        if 'fo' in sums:
+            np.subtract(forecast, self.shift, out=f)
+            np.subtract(actual, self.shift, out=o)
+            np.add(sums['f'][slot], f, out=sums['f'][slot], where=valid)
+            np.add(sums['o'][slot], o, out=sums['o'][slot], where=valid)
+            for name, a, b in (('ff', f, f), ('oo', o, o), ('fo', f, o)):
+                np.multiply(a, b, out=error)
+                np.add(sums[name][slot], error, out=sums[name][slot], where=valid)
+
+    def metric(self, name, lead_index):
+        """
+        Per-cell score of one lead.
+
+        Returns:
+        - numpy.ndarray, float32 (model, lat, lon); NaN where no pair (or, for
+          correlation, fewer than two pairs or no variance) was seen
+        """
+        count = self.count[lead_index]
+        sums = {key: values[lead_index] for key, values in self.sums.items()}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n = np.where(count > 0, count, np.nan).astype(np.float32)
+            if name == 'bias':
+                return sums['error'] / n
+            if name == 'mae':
+                return sums['abs_error'] / n
+            if name == 'rmse':
+                return np.sqrt(sums['squared_error'] / n)
+            if name == 'correlation':
+                # Finished in float64, one lead at a time
+                n = n.astype(np.float64)
+                mean_f, mean_o = sums['f'] / n, sums['o'] / n
+                covariance = sums['fo'] / n - mean_f * mean_o
+                variance_f = sums['ff'] / n - mean_f ** 2
+                variance_o = sums['oo'] / n - mean_o ** 2
+                scored = (count > 1) & (variance_f > 0) & (variance_o > 0)
+                return np.where(scored, covariance / np.sqrt(variance_f * variance_o), np.nan).astype(np.float32)
+        raise ValueError(f"Unknown cell metric: {name}")
+
+
+def accumulate_cell_scores(parameter, reference_name, start_date, end_date, forecast_horizons, models=None,
+                           reference_data=None, reference_cache=None, missing_files=None, availability=None,
+                           metrics=None):
+    """
+    Stream every forecast field of a period into per-grid-cell running error sums.
+
+    Fields are grouped by valid date so each reference field is read once, regridded
+    to the reference grid when needed, and added in place into preallocated float32
+    (lead, model, lat, lon) cubes; nothing but the running sums is kept in memory.
+
+    Parameters:
+    - parameter: str, parameter name
+    - reference_name: str, reference dataset
+    - start_date, end_date: datetime, first and last init date
+    - forecast_horizons: list of int, lead times in days
+    - models, reference_data: dict, config overrides (default: config)
+    - reference_cache: ReferenceCache, optional shared cache of reference fields
+    - missing_files: list, optional; paths that could not be read are appended to it
+    - availability: AvailabilityIndex, optional scan of the archive; missing files are
+      listed from it and never opened
+    - metrics: list of str, keys of CELL_METRICS to accumulate (default: all); only their
+      sums are allocated
+
+    Returns:
+    - accumulator: CellScores, shape (lead, model, lat, lon), or None if no field was scored
+    - model_names: list of str
+    - lat, lon: numpy.ndarray, reference grid coordinates (None without data)
+    """
+    models = config.models if models is None else models
+    reference_data = config.reference_data if reference_data is None else reference_data
+    if reference_cache is None:
+        reference_cache = default_reference_cache(reference_data)
+    missing_files = [] if missing_files is None else missing_files
+    model_names = [name for name, details in models.items() if parameter in details['predictors']]
+    lead_index = {lead: i for i, lead in enumerate(forecast_horizons)}
+    regrid_method = config.variables[parameter].get('regrid_method', 'linear')
+    tasks = plan_verification(parameter, reference_name, start_date, end_date, forecast_horizons, models, reference_data)
+    if availability is not None:
+        tasks, missing = availability.filter_tasks(tasks, parameter, reference_name)
+        missing_files.extend(missing)
+    accumulator, lat, lon = None, None, None
+    instrument.watch('reference_cache', reference_cache.stats)
+    instrument.watch('dataset_pool', default_pool().stats)
+    groups = group_by_valid_date(tasks)
+
+    # Forecast files are read ahead in the order they are accumulated below
+    prefetcher = Prefetcher(field_schedule([task for group in groups.values() for task in group], models, parameter)).start()
+    instrument.watch('prefetch', prefetcher.stats)
+    for valid_date, group in groups.items():
+        print(f"\nAccumulating forecasts valid on: {valid_date.strftime('%Y%m%d')}")
+        try:
+            with instrument.stage('reference', parameter=parameter):
+                actual = reference_cache.get(reference_name, parameter, valid_date)
+        except FileNotFoundError:
+            print(f"Reference data not found at path: {group[0]['reference_path']}. Skipping this date.")
+            missing_files.append(group[0]['reference_path'])
+            instrument.count('missing_reference', parameter=parameter)
+            continue
+        if accumulator is None:
+            lat, lon = actual['lat'].values, actual['lon'].values
+            accumulator = CellScores((len(forecast_horizons), len(model_names)) + actual.shape, metrics, shift=actual.values)
+        actual_values = actual.values
+        valid_reference = np.isfinite(actual_values)
+
+        for task in group:
+            model_index = model_names.index(task['model'])
+            tags = {'model': task['model'], 'parameter': parameter, 'lead': task['lead']}
+            try:
+                with instrument.stage('read', **tags):
+                    forecast = prefetcher.get(task['model_path'])
+            except FileNotFoundError:
+                print(f"File not found: {task['model_path']} for model '{task['model']}' on date {task['init'].strftime('%Y%m%d')}.")
+                missing_files.append(task['model_path'])
+                instrument.count('missing_forecast', **tags)
+                continue
+            values = forecast.values
+            if forecast.dims != actual.dims or forecast.shape != actual.shape:
+                with instrument.stage('regrid', **tags):
+                    values = regrid_stack(values[None], forecast['lat'].values, forecast['lon'].values, lat, lon, regrid_method)[0]
+
+            with instrument.stage('score', **tags):
+                accumulator.add(lead_index[task['lead']], model_index, values, actual_values, valid_reference & np.isfinite(values))
+
+    prefetcher.close()
+    prefetcher.report()
+    reference_cache.report()
+    default_pool().report()
+    return accumulator, model_names, lat, lon
+
+
+def cell_metric_cube(accumulator, metrics=None):
+    """
+    Per-cell scores of an accumulator in one preallocated float32 cube, filled lead by lead.
+
+    Parameters:
+    - accumulator: CellScores, shape (lead, model, lat, lon)
+    - metrics: list of str, keys of CELL_METRICS (default: those of the accumulator)
+
+    Returns:
+    - numpy.ndarray, float32 (metric, lead, model, lat, lon)
+    """
+    metrics = accumulator.metrics if metrics is None else metrics
+    cube = np.empty((len(metrics),) + accumulator.shape, dtype=np.float32)
+    for i, metric in enumerate(metrics):
+        for lead_index in range(accumulator.shape[0]):
+            cube[i, lead_index] = accumulator.metric(metric, lead_index)
+    return cube
+
+
+def select_best(cube, lower_is_better=True, tie_tolerance=0.0, model_axis=0):
+    """
+    Best model, runner-up margin and a quality flag per cell, for any leading dimensions.
+
+    Parameters:
+    - cube: numpy.ndarray, scores with one entry per model along `model_axis`
+    - lower_is_better: bool, False for skill scores such as correlation
+    - tie_tolerance: float, margins at or below this count as ties
+    - model_axis: int, axis enumerating the models
+
+    Returns:
+    - best: numpy.ndarray int16, index of the best model, -1 where every model is NaN
+    - margin: numpy.ndarray float32, distance of the runner-up (NaN if fewer than two models scored)
+    - flag: numpy.ndarray int8, FLAG_OK, FLAG_TIE or FLAG_ALL_NAN
+    """
+    ranked = np.moveaxis(np.asarray(cube, dtype=np.float32), model_axis, 0)
+    ranked = ranked.copy() if lower_is_better else -ranked
+    np.copyto(ranked, np.inf, where=np.isnan(ranked))
+
+    best = ranked.argmin(axis=0).astype(np.int16)
+    if ranked.shape[0] > 1:
+        two_smallest = np.partition(ranked, 1, axis=0)[:2]
+        with np.errstate(invalid='ignore'):
+            margin = (two_smallest[1] - two_smallest[0]).astype(np.float32)
+        margin[~np.isfinite(margin)] = np.nan
+    else:
+        two_smallest = ranked[:1]
+        margin = np.full(best.shape, np.nan, dtype=np.float32)
+
+    all_nan = np.isinf(two_smallest[0]) & (two_smallest[0] > 0)
+    best[all_nan] = -1
+    flag = np.full(best.shape, FLAG_OK, dtype=np.int8)
+    flag[margin <= tie_tolerance] = FLAG_TIE
+    flag[all_nan] = FLAG_ALL_NAN
+    return best, margin, flag
+
+
+def best_model_maps(accumulator, model_names, forecast_horizons, lat, lon, metrics=None, tie_tolerance=0.0):
+    """
+    Best-model maps for every metric and lead of an accumulator in one run.
+
+    Bias is ranked by its absolute value, correlation from high to low.
+
+    Returns:
+    - xarray.Dataset, `best_model` (-1 where no model scored), `margin` to the runner-up
+      and `flag` (0 ok, 1 tie, 2 all NaN), each (metric, lead, lat, lon), plus the
+      float32 `score` cube (metric, lead, model, lat, lon)
+    """
+    metrics = accumulator.metrics if metrics is None else metrics
+    cube = cell_metric_cube(accumulator, metrics)
+    shape = (len(metrics), len(forecast_horizons)) + cube.shape[3:]
+    best = np.empty(shape, dtype=np.int16)
+    margin = np.empty(shape, dtype=np.float32)
+    flag = np.empty(shape, dtype=np.int8)
+    for i, metric in enumerate(metrics):
+        scores = np.abs(cube[i]) if metric == 'bias' else cube[i]
+        best[i], margin[i], flag[i] = select_best(scores, CELL_METRICS[metric], tie_tolerance, model_axis=1)
+
+    map_dims = ('metric', 'lead', 'lat', 'lon')
+    return xr.Dataset(
+        {
+            'best_model': (map_dims, best),
+            'margin': (map_dims, margin),
+            'flag': (map_dims, flag),
+            'score': (('metric', 'lead', 'model', 'lat', 'lon'), cube)
+        },
+        coords={'metric': metrics, 'lead': list(forecast_horizons), 'model': list(model_names), 'lat': lat, 'lon': lon}
+    )
@@ -0,0 +1,210 @@
+import os
+import re
+import numpy as np
+import xarray as xr
+import dask
+import dask.array as da
+from datetime import datetime
+import config
+from data_io import TEMPLATE_INIT_DATE, load_policy, decode_field
+from handle_pool import default_pool
+
+DAILY_FILE = re.compile(r'^(\d{7})\.nc$')
+# Label of the single member of deterministic models (e.g. ICON)
+DETERMINISTIC_MEMBER = 'deterministic'
+
+
+def model_layout(model_name, models=None):
+    """
+    Describe a model's directory layout from its `file_path` template.
+
+    Parameters:
+    - model_name: str, key in the `models` config
+    - models: dict, model config (defaults to config.models)
+
+    Returns:
+    - dict, with the directory parts above the init folder ('prefix'), the init folder
+      suffix (e.g. '_00'), the member folder width (None without members) and the
+      folders between member and file ('suffix', e.g. ['Daily'])
+    """
+    models = config.models if models is None else models
+    details = models[model_name]
+    parts = os.path.relpath(details['file_path'], details['data_path']).split(os.sep)
+    init_level = next(i for i, part in enumerate(parts) if TEMPLATE_INIT_DATE in part)
+    between = parts[init_level + 1:-1]
+    member_level = next((i for i, part in enumerate(between) if part.isdigit()), None)
+    return {
+        'prefix': parts[:init_level],
+        'init_suffix': parts[init_level].replace(TEMPLATE_INIT_DATE, ''),
+        'member_width': len(between[member_level]) if member_level is not None else None,
+        'suffix': between[member_level + 1:] if member_level is not None else between
+    }
+
+
+class ModelCatalog:
+    """
+    Index of the daily files of one model and parameter, by (init, lead, member).
+    """
+
+    def __init__(self, model_name, parameter, variable_name, files):
+        """
+        Parameters:
+        - model_name, parameter, variable_name: str, what the files hold
+        - files: dict, (init datetime, lead days, member label) -> file path
+        """
+        self.model_name = model_name
+        self.parameter = parameter
+        self.variable_name = variable_name
+        self.files = files
+        self.inits = sorted({key[0] for key in files})
+        self.leads = sorted({key[1] for key in files})
+        self.members = sorted({key[2] for key in files})
+
+    def path(self, init_date, lead, member=None):
+        """Path of one file, or None if it is not in the archive."""
+        member = self.members[0] if member is None else member
+        return self.files.get((init_date, lead, member))
+
+    def __len__(self):
+        return len(self.files)
+
+    def summary(self):
+        """One-line description of what was found."""
+        if not self.files:
+            return f"{self.model_name} {self.parameter}: no files"
+        return (f"{self.model_name} {self.parameter}: {len(self.files)} files, {len(self.inits)} inits "
+                f"({self.inits[0].strftime('%Y%m%d')}-{self.inits[-1].strftime('%Y%m%d')}), "
+                f"leads {self.leads[0]}-{self.leads[-1]}, {len(self.members)} members")
+
+
+def scan_model(model_name, parameter, models=None):
+    """
+    Walk a model's data_path once with os.scandir and index its daily files.
+
+    Parameters:
+    - model_name: str, key in the `models` config
+    - parameter: str, parameter name
+    - models: dict, model config (defaults to config.models)
+
+    Returns:
+    - ModelCatalog
+    """
+    models = config.models if models is None else models
+    details = models[model_name]
+    layout = model_layout(model_name, models)
+    parameter_dir = os.path.join(details['data_path'], *[part.format(parameter=parameter) for part in layout['prefix']])
+    files = {}
+
+    def scan_daily(daily_dir, init_date, member):
+        try:
+            entries = list(os.scandir(daily_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            match = DAILY_FILE.match(entry.name)
+            if match:
+                valid_date = datetime.strptime(match.group(1), "%Y%j")
+                files[(init_date, (valid_date - init_date).days, member)] = entry.path
+
+    try:
+        init_entries = list(os.scandir(parameter_dir))
+    except FileNotFoundError:
+        init_entries = []
+    for init_entry in init_entries:
+        name = init_entry.name
+        if not (init_entry.is_dir() and name.endswith(layout['init_suffix'])):
+            continue
+        try:
+            init_date = datetime.strptime(name[:len(name) - len(layout['init_suffix'])], "%Y%m%d")
+        except ValueError:
+            continue
+        if layout['member_width'] is None:
+            scan_daily(os.path.join(init_entry.path, *layout['suffix']), init_date, DETERMINISTIC_MEMBER)
+            continue
+        for member_entry in os.scandir(init_entry.path):
+            if member_entry.is_dir() and member_entry.name.isdigit() and len(member_entry.name) == layout['member_width']:
+                scan_daily(os.path.join(member_entry.path, *layout['suffix']), init_date, member_entry.name)
+
+    return ModelCatalog(model_name, parameter, details['variable_names'][parameter], files)
+
+
+def scan_catalog(parameter, models=None):
+    """
+    Index every model that predicts a parameter.
+
+    Returns:
+    - dict, model name -> ModelCatalog
+    """
+    models = config.models if models is None else models
+    return {name: scan_model(name, parameter, models) for name, details in models.items() if parameter in details['predictors']}
+
+
+def _read_block(path, variable_name, lat_slice, lon_slice, shape, dtype):
+    """Read one hyperslab of one file; missing files become NaN blocks."""
+    try:
+        with default_pool().dataset(path, mask_and_scale=False) as dataset:
+            values = decode_field(dataset[variable_name].squeeze().isel(lat=lat_slice, lon=lon_slice), load_policy(variable_name)).values
+    except FileNotFoundError:
+        return np.full(shape, np.nan, dtype=dtype)
+    return values.astype(dtype, copy=False).reshape(shape)
+
+
+def open_model_cube(catalog, inits=None, leads=None, members=None, spatial_chunks=None):
+    """
+    Expose a model's files as one lazily loaded (init, lead, member, lat, lon) array.
+
+    Each chunk is one file (or one lat/lon tile of it); nothing is read until the
+    array, or a selection of it, is computed, and only the touched chunks are read.
+
+    Parameters:
+    - catalog: ModelCatalog, from scan_model
+    - inits, leads, members: lists restricting the cube (default: everything indexed)
+    - spatial_chunks: tuple of int, (lat, lon) tile size; default is one tile per file
+
+    Returns:
+    - xarray.DataArray, dask-backed, NaN where a file is missing
+    """
+    inits = catalog.inits if inits is None else list(inits)
+    leads = catalog.leads if leads is None else list(leads)
+    members = catalog.members if members is None else list(members)
+    if not catalog.files:
+        raise FileNotFoundError(f"No files indexed for {catalog.model_name} {catalog.parameter}")
+
+    with default_pool().dataset(next(iter(catalog.files.values())), mask_and_scale=False) as sample:
+        template = sample[catalog.variable_name].squeeze()
+        lat, lon = template['lat'].values, template['lon'].values
+    dtype = np.dtype(load_policy(catalog.variable_name)['dtype'])
+
+    lat_chunk, lon_chunk = spatial_chunks if spatial_chunks is not None else (len(lat), len(lon))
+    lat_slices = [slice(i, min(i + lat_chunk, len(lat))) for i in range(0, len(lat), lat_chunk)]
+    lon_slices = [slice(j, min(j + lon_chunk, len(lon))) for j in range(0, len(lon), lon_chunk)]
+
+    def file_blocks(path):
+        rows = []
+        for lat_slice in lat_slices:
+            row = []
+            for lon_slice in lon_slices:
+                shape = (1, 1, 1, lat_slice.stop - lat_slice.start, lon_slice.stop - lon_slice.start)
+                if path is None:
+                    row.append(da.full(shape, np.nan, dtype=dtype))
+                else:
+                    block = dask.delayed(_read_block)(path, catalog.variable_name, lat_slice, lon_slice, shape, dtype)
+                    row.append(da.from_delayed(block, shape, dtype=dtype))
+            rows.append(row)
+        return rows
+
+    blocks = [[[file_blocks(catalog.path(init_date, lead, member)) for member in members] for lead in leads] for init_date in inits]
+    return xr.DataArray(
+        da.block(blocks),
+        dims=('init', 'lead', 'member', 'lat', 'lon'),
+        coords={'init': np.array(inits, dtype='datetime64[ns]'), 'lead': leads, 'member': members, 'lat': lat, 'lon': lon},
+        name=catalog.variable_name,
+        attrs={'model': catalog.model_name, 'parameter': catalog.parameter}
+    )
+
+
+if __name__ == '__main__':
+    # Print what the archive holds for every configured parameter
+    for parameter in config.config['parameters']:
+        for model_catalog in scan_catalog(parameter).values():
+            print(model_catalog.summary())
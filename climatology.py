@@ -0,0 +1,220 @@
+import os
+import tempfile
+import numpy as np
+import xarray as xr
+from datetime import datetime
+import config
+from data_io import reference_file_path, load_field
+from results_store import file_signature
+
+DAYS_IN_CLIMATOLOGY = 366
+
+
+def climatology_path(reference_name, parameter, years, smoothing=None, output_dir=None):
+    """
+    Path of the .npy store holding a day-of-year climatology.
+
+    Parameters:
+    - reference_name: str, key in the `reference_data` config
+    - parameter: str, parameter name
+    - years: tuple of int, first and last year averaged
+    - smoothing: str, None, 'harmonicN' or 'windowN'
+    - output_dir: str, store directory (defaults to config['dir_climatology'])
+
+    Returns:
+    - str, path to the .npy file; coordinates sit next to it in a .coords.npz file
+    """
+    output_dir = config.config['dir_climatology'] if output_dir is None else output_dir
+    name = f"{reference_name}_{parameter}_{years[0]}_{years[1]}"
+    if smoothing:
+        name += f"_{smoothing}"
+    return os.path.join(output_dir, name + '.npy')
+
+
+def _temp_path(path):
+    """A new empty file next to `path`, to be renamed onto it once complete."""
+    handle, temp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=os.path.dirname(path))
+    os.close(handle)
+    os.chmod(temp_path, 0o644)  # mkstemp files are private; the stores are read like any other output
+    return temp_path
+
+
+def _save_coords(path, lat, lon):
+    """Write the .coords.npz file of a store through a temporary file."""
+    coords_path = path.replace('.npy', '.coords.npz')
+    temp_path = _temp_path(coords_path)
+    np.savez(temp_path, lat=lat, lon=lon)
+    os.replace(temp_path, coords_path)
+
+
+def build_climatology(reference_name, parameter, years, output_dir=None, reference_data=None):
+    """
+    Stream the daily reference archive once and write a 366 x lat x lon climatology.
+
+    Days are processed one day of year at a time so only one running sum is held in
+    memory; each row is written straight into a memory-mapped temporary .npy file, which
+    is renamed onto the store once complete, so an interrupted build leaves no store.
+
+    Parameters:
+    - reference_name: str, key in the `reference_data` config
+    - parameter: str, parameter name
+    - years: tuple of int, first and last year to average (inclusive)
+    - output_dir: str, store directory (defaults to config['dir_climatology'])
+    - reference_data: dict, reference config (defaults to config.reference_data)
+
+    Returns:
+    - str, path to the written store
+    """
+    path = climatology_path(reference_name, parameter, years, output_dir=output_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    reference_data = config.reference_data if reference_data is None else reference_data
+    variable_name = reference_data[reference_name]['variable_names'][parameter]
+
+    store, temp_path, coords = None, None, None
+    filled = np.zeros(DAYS_IN_CLIMATOLOGY, dtype=bool)
+    try:
+        for day_of_year in range(1, DAYS_IN_CLIMATOLOGY + 1):
+            total, count = None, None
+            for year in range(years[0], years[1] + 1):
+                try:
+                    date = datetime.strptime(f"{year}{day_of_year:03d}", "%Y%j")
+                except ValueError:
+                    continue
+                if date.year != year:
+                    continue  # Day 366 of a non-leap year
+                try:
+                    field = load_field(reference_file_path(reference_name, parameter, date, reference_data), variable_name)
+                except FileNotFoundError:
+                    print(f"Reference data not found for {date.strftime('%Y%m%d')}. Skipping.")
+                    continue
+
+                if store is None:
+                    temp_path = _temp_path(path)
+                    store = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32,
+                                                      shape=(DAYS_IN_CLIMATOLOGY,) + field.shape)
+                    coords = (field['lat'].values, field['lon'].values)
+                values = field.values.astype(np.float64)
+                valid = np.isfinite(values)
+                if total is None:
+                    total = np.zeros(values.shape)
+                    count = np.zeros(values.shape, dtype=np.int32)
+                total += np.where(valid, values, 0.0)
+                count += valid
+
+            if total is not None:
+                with np.errstate(invalid='ignore'):
+                    store[day_of_year - 1] = total / count
+                filled[day_of_year - 1] = True
+            print(f"Climatology day {day_of_year:03d} done.")
+
+        if store is None:
+            raise FileNotFoundError(f"No {reference_name} {parameter} files found for {years[0]}-{years[1]}")
+
+        # Day 366 only exists in leap years; fall back to the neighbouring day elsewhere
+        for day_index in np.flatnonzero(~filled):
+            neighbour = day_index - 1 if day_index > 0 else np.flatnonzero(filled)[0]
+            store[day_index] = store[neighbour]
+        store.flush()
+        del store
+        # The coordinates go first: a store on disk always has them
+        _save_coords(path, *coords)
+        os.replace(temp_path, path)
+    except BaseException:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    print(f"Climatology saved to {path}")
+    return path
+
+
+def smooth_climatology(raw_path, smoothing, rows_per_chunk=64):
+    """
+    Write a smoothed copy of a climatology store, through a temporary file renamed onto
+    the smoothed store once complete.
+
+    Parameters:
+    - raw_path: str, path to the unsmoothed .npy store
+    - smoothing: str, 'harmonicN' keeps the mean and first N annual harmonics,
+      'windowN' applies a circular N-day running mean
+    - rows_per_chunk: int, latitude rows processed at a time
+
+    Returns:
+    - str, path to the smoothed store
+    """
+    raw = np.load(raw_path, mmap_mode='r')
+    smoothed_path = raw_path.replace('.npy', f'_{smoothing}.npy')
+
+    if smoothing.startswith('harmonic'):
+        n_harmonics = int(smoothing[len('harmonic'):])
+    elif smoothing.startswith('window'):
+        window = int(smoothing[len('window'):])
+        kernel = np.fft.rfft(np.roll(np.r_[np.ones(window), np.zeros(raw.shape[0] - window)], -(window // 2)) / window)
+    else:
+        raise ValueError(f"Unknown climatology smoothing: {smoothing}")
+
+    temp_path = _temp_path(smoothed_path)
+    try:
+        smoothed = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32, shape=raw.shape)
+        for start in range(0, raw.shape[1], rows_per_chunk):
+            chunk = np.asarray(raw[:, start:start + rows_per_chunk], dtype=np.float64)
+            spectrum = np.fft.rfft(chunk, axis=0)
+            if smoothing.startswith('harmonic'):
+                spectrum[n_harmonics + 1:] = 0
+            else:
+                spectrum *= kernel[:, None, None]
+            smoothed[:, start:start + rows_per_chunk] = np.fft.irfft(spectrum, n=raw.shape[0], axis=0)
+        smoothed.flush()
+        del smoothed
+        coords = np.load(raw_path.replace('.npy', '.coords.npz'))
+        _save_coords(smoothed_path, coords['lat'], coords['lon'])
+        os.replace(temp_path, smoothed_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    print(f"Smoothed climatology saved to {smoothed_path}")
+    return smoothed_path
+
+
+def load_climatology(reference_name, parameter, years=None, smoothing=None, output_dir=None, build=True, reference_data=None):
+    """
+    Memory-map a climatology store, building it first if it does not exist yet.
+
+    Parameters:
+    - reference_name: str, key in the `reference_data` config
+    - parameter: str, parameter name
+    - years: tuple of int, first and last year (defaults to config.climatology_years)
+    - smoothing: str, None, 'harmonicN' or 'windowN'
+    - output_dir: str, store directory (defaults to config['dir_climatology'])
+    - build: bool, build missing stores instead of returning None
+    - reference_data: dict, reference config used when building (defaults to config.reference_data)
+
+    Returns:
+    - xarray.DataArray, (dayofyear, lat, lon) backed by the memory map, or None; its
+      `signature` attribute (store path, hence years and smoothing, and mtime) identifies
+      this build of the climatology
+    """
+    years = config.climatology_years if years is None else years
+    path = climatology_path(reference_name, parameter, years, smoothing, output_dir)
+    if not os.path.exists(path):
+        if not build:
+            return None
+        raw_path = climatology_path(reference_name, parameter, years, output_dir=output_dir)
+        if not os.path.exists(raw_path):
+            build_climatology(reference_name, parameter, years, output_dir, reference_data)
+        if smoothing:
+            smooth_climatology(raw_path, smoothing)
+
+    values = np.load(path, mmap_mode='r')
+    coords = np.load(path.replace('.npy', '.coords.npz'))
+    return xr.DataArray(values, dims=('dayofyear', 'lat', 'lon'),
+                        coords={'dayofyear': np.arange(1, DAYS_IN_CLIMATOLOGY + 1), 'lat': coords['lat'], 'lon': coords['lon']},
+                        attrs={'signature': file_signature(path)})
+
+
+if __name__ == '__main__':
+    # Build the stores for every parameter verified against the configured reference
+    for parameter in config.config['parameters']:
+        reference_name = config.variables[parameter]['reference_dataset']
+        if parameter in config.reference_data[reference_name]['variable_names']:
+            load_climatology(reference_name, parameter, smoothing=config.climatology_smoothing)
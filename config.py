@@ -8,15 +8,33 @@ end_date_str = '20241130'    # End date
 param = 'Wind'  # Options: 'Temp', 'P', 'RelHum', 'Wind'
 forecast_horizons = list(range(1, 15))  # Forecast horizons from 1 to 15 days
 reference_choice = 'GDAS'  # Options: 'ERA5', 'GDAS', 'Station'
+climatology_years = (2015, 2023)  # Years averaged into the day-of-year climatology
+climatology_smoothing = 'harmonic3'  # Options: None, 'harmonicN', 'windowN'
 
 config = {
     'dir_data_processed': '/mnt/datawaha/hyex/beckhe/DATA_PROCESSED/',
     'dir_data_raw': '/mnt/datawaha/hyex/msn/GWPM/DATA_RAW',
     'dir_output': '/mnt/datawaha/hyex/msn/GWPM/OUTPUT',
     'dir_temp': '/tmp',
+    'dir_climatology': '/mnt/datawaha/hyex/msn/GWPM/CLIMATOLOGY',
     'parameters': ['Temp', 'P', 'RelHum', 'Wind'],  # List of parameters
     'forecast_dates': ['20240816_00'],  # Default date
-    'dir_station_data': '/mnt/datawaha/hyex/beckhe/DATA_PROCESSED/station_data'
+    'dir_station_data': '/mnt/datawaha/hyex/beckhe/DATA_PROCESSED/station_data',
+    'reference_cache_mb': 2048,  # Memory budget for cached reference fields
+    'reference_cache_spill': False,  # Spill evicted reference fields to dir_temp
+    'workers': 1,  # Worker processes for scoring; 1 runs serially
+    'max_open_files': 64,  # Idle NetCDF datasets kept open by the handle pool
+    'dir_repacked': '/mnt/datawaha/hyex/msn/GWPM/REPACKED',  # Chunked per model/parameter stores written by repack.py
+    # Field-oriented: one field is 36 chunks of 128 KB at 0.25 degree, but a point series reads one chunk per
+    # (init, lead, member). Point-series work is better served by e.g. init 8, lead 8, lat 32, lon 32, at the
+    # cost of reading 64 fields' worth of chunks per field
+    'repack_chunks': {'init': 1, 'lead': 1, 'member': 1, 'lat': 128, 'lon': 256},
+    'prefetch_depth': 8,  # Forecast files read ahead of scoring; 0 reads each file on demand
+    'prefetch_mb': 1024,  # Memory budget for read-ahead fields not yet scored
+    'prefetch_threads': 4,  # Reader threads of the read-ahead
+    'member_block_mb': 128,  # Budget for the latitude band of every member read at once by ensemble.stream_member_statistics
+    'instrument': False,  # Time stages and count I/O per model/parameter/lead; report saved under dir_output/run_reports
+    'profile': None  # Options: None, 'cprofile', 'pyinstrument' (needs instrument=True)
 }
 
 # Data availability constraints
@@ -105,37 +123,53 @@ reference_data = {
     },
     'Station': {
         'data_path': config['dir_station_data'],
+        # (station, time) NetCDF store written by sd_data; opened memory-mapped
+        'store_path': '/mnt/datawaha/hyex/msn/GWPM/processed_station_data/stations.nc',
         'variable_names': {
             'Temp': 'temperature', 
-            'P': 'precipitation'
-            # Assuming these are typical variable names in station data
+            'P': 'precipitation',
+            'RelHum': 'relative_humidity',
+            'Wind': 'wind_speed'
         }
     }
 }
 
+# `load`: how fields are decoded when read (see data_io.load_policy)
+# - dtype: in-memory dtype; scale/offset are applied in it rather than in float64
+# - mask: whether _FillValue/missing_value become NaN
+# - packed: optional integer storage of the repacked stores, e.g.
+#   {'dtype': 'int16', 'scale_factor': 0.01, 'add_offset': 273.15}; None keeps float32
 variables = {
     'Temp': {
         'name': 'Temperature',
         'units': 'K',
         'description': 'Air temperature at 2 meters above ground',
-        'reference_dataset': reference_choice  # Dynamically choose based on user input
+        'reference_dataset': reference_choice,  # Dynamically choose based on user input
+        'regrid_method': 'linear',
+        'load': {'dtype': 'float32', 'mask': True, 'packed': None}
     },
     'P': {
         'name': 'Precipitation',
         'units': 'mm',
         'description': 'Total precipitation accumulation',
-        'reference_dataset': 'MSWEP'
+        'reference_dataset': 'MSWEP',
+        'regrid_method': 'conservative',  # Preserve area totals when remapping precipitation
+        'load': {'dtype': 'float32', 'mask': True, 'packed': None}
     },
     'RelHum': {
         'name': 'Relative Humidity',
         'units': '%',
         'description': 'Relative humidity at 2 meters above ground',
-        'reference_dataset': reference_choice  # Dynamically choose based on user input
+        'reference_dataset': reference_choice,  # Dynamically choose based on user input
+        'regrid_method': 'linear',
+        'load': {'dtype': 'float32', 'mask': True, 'packed': None}
     },
     'Wind': {
         'name': 'Wind Speed',
         'units': 'm/s',
                 'description': 'Wind speed at 10 meters above ground',
-        'reference_dataset': reference_choice  # Dynamically choose based on user input
+        'reference_dataset': reference_choice,  # Dynamically choose based on user input
+        'regrid_method': 'linear',
+        'load': {'dtype': 'float32', 'mask': True, 'packed': None}
     }
 }
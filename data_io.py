@@ -0,0 +1,163 @@
+import hashlib
+from datetime import timedelta
+import numpy as np
+import config
+import instrument
+from handle_pool import default_pool
+
+# Placeholders used by the path templates in config.py
+TEMPLATE_INIT_DATE = "20240816"
+TEMPLATE_VALID_DAY = "2024230"
+
+# Load policy of variables whose parameter has no `load` entry in config.variables
+DEFAULT_LOAD_POLICY = {'dtype': 'float64', 'mask': True, 'packed': None}
+
+_policies = {}
+
+
+def julian_day_str(date):
+    """
+    Format a date the way the DATA_PROCESSED daily files are named (YYYYDDD).
+
+    Parameters:
+    - date: datetime, date to format
+
+    Returns:
+    - str, year followed by the zero-padded day of year
+    """
+    return date.strftime("%Y") + f"{date.timetuple().tm_yday:03d}"
+
+
+def model_file_path(model_name, parameter, init_date, valid_date, models=None):
+    """
+    Build the daily forecast file path of a model for one init date and valid date.
+
+    Parameters:
+    - model_name: str, key in the `models` config
+    - parameter: str, parameter name (e.g. 'Temp')
+    - init_date: datetime, forecast initialisation date
+    - valid_date: datetime, day the forecast verifies on
+    - models: dict, model config (defaults to config.models)
+
+    Returns:
+    - str, path to the NetCDF file
+    """
+    models = config.models if models is None else models
+    template = models[model_name]['file_path']
+    return template.replace(TEMPLATE_INIT_DATE, init_date.strftime("%Y%m%d")).format(parameter=parameter).replace(TEMPLATE_VALID_DAY, julian_day_str(valid_date))
+
+
+def reference_file_path(reference_name, parameter, valid_date, reference_data=None):
+    """
+    Build the daily reference file path for one valid date.
+
+    Parameters:
+    - reference_name: str, key in the `reference_data` config (e.g. 'GDAS')
+    - parameter: str, parameter name
+    - valid_date: datetime, day to verify against
+    - reference_data: dict, reference config (defaults to config.reference_data)
+
+    Returns:
+    - str, path to the NetCDF file
+    """
+    reference_data = config.reference_data if reference_data is None else reference_data
+    template = reference_data[reference_name]['file_path']
+    return template.replace(TEMPLATE_INIT_DATE, valid_date.strftime("%Y%m%d")).format(parameter=parameter).replace(TEMPLATE_VALID_DAY, julian_day_str(valid_date))
+
+
+def init_dates(start_date, end_date):
+    """
+    List the daily init dates between two dates (inclusive).
+    """
+    return [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+
+def load_policy(variable_name):
+    """
+    Load policy of a file variable, from the `load` entry of its parameter in config.variables.
+
+    The parameter is found through the `variable_names` of config.models and
+    config.reference_data; unknown variables get DEFAULT_LOAD_POLICY.
+
+    Returns:
+    - dict, 'dtype', 'mask' and 'packed'
+    """
+    if variable_name not in _policies:
+        sources = list(config.models.values()) + list(config.reference_data.values())
+        parameter = next((parameter for details in sources for parameter, name in details['variable_names'].items()
+                          if name == variable_name), None)
+        _policies[variable_name] = dict(DEFAULT_LOAD_POLICY, **config.variables.get(parameter, {}).get('load', {}))
+    return _policies[variable_name]
+
+
+def policy_digest(*policies):
+    """
+    Short digest of load policies, for cache keys and file names that must change with them.
+
+    Returns:
+    - str, 8 hex characters
+    """
+    return hashlib.sha1(repr([sorted(policy.items()) for policy in policies]).encode()).hexdigest()[:8]
+
+
+def decode_field(variable, policy):
+    """
+    Decode a variable read with `mask_and_scale=False` under a load policy.
+
+    Packed values are converted straight to the policy dtype and scaled there, so a
+    float32 policy never builds a float64 copy; fill and missing values become NaN
+    when the policy masks them.
+
+    Parameters:
+    - variable: xarray.DataArray, raw variable (or a selection of it)
+    - policy: dict, from load_policy
+
+    Returns:
+    - xarray.DataArray, in memory, without the packing attributes
+    """
+    dtype = np.dtype(policy['dtype'])
+    attrs = dict(variable.attrs)
+    scale_factor = attrs.pop('scale_factor', None)
+    add_offset = attrs.pop('add_offset', None)
+    fill_values = [attrs.pop(key) for key in ('_FillValue', 'missing_value') if key in attrs]
+    raw = variable.values
+    values = raw.astype(dtype)
+    if scale_factor is not None:
+        values *= dtype.type(scale_factor)
+    if add_offset is not None:
+        values += dtype.type(add_offset)
+    if policy['mask']:
+        for fill_value in fill_values:
+            # NaN fill values of float data are NaN already
+            if not (raw.dtype.kind == 'f' and np.isnan(fill_value).all()):
+                values[np.isin(raw, fill_value)] = np.nan
+    field = variable.copy(deep=False, data=values)  # The values are new; the coordinates are shared
+    field.attrs = attrs
+    field.encoding = {}
+    return field
+
+
+def load_field(file_path, variable_name, policy=None):
+    """
+    Read one field into memory through the shared dataset pool.
+
+    Parameters:
+    - file_path: str, path to the NetCDF file
+    - variable_name: str, variable to read
+    - policy: dict, load policy (defaults to load_policy(variable_name))
+
+    Returns:
+    - xarray.DataArray, squeezed field, independent of the file handle
+    """
+    policy = load_policy(variable_name) if policy is None else policy
+    # Fields of repacked models come from their chunked store (see repack.py)
+    from repack import load_repacked
+    field = load_repacked(file_path, variable_name, policy=policy)
+    if field is not None:
+        instrument.count('store_reads')
+        return field
+    with default_pool().dataset(file_path, mask_and_scale=False) as dataset:
+        with instrument.stage('decode'):
+            field = decode_field(dataset[variable_name].squeeze(), policy)
+    instrument.count('bytes_decoded', field.nbytes)
+    return field
@@ -0,0 +1,487 @@
+import os
+import numpy as np
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import config
+from data_io import model_file_path, load_policy, decode_field
+from catalog import model_layout
+from verification import plan_verification, group_by_valid_date
+from reference_cache import default_reference_cache
+from regrid import regrid_stack
+from metrics import latitude_weights
+from handle_pool import default_pool
+from repack import open_store, field_source
+
+
+def ensemble_models(parameter, models=None):
+    """Names of the models that predict a parameter and store members in separate folders."""
+    models = config.models if models is None else models
+    return [name for name, details in models.items()
+            if parameter in details['predictors'] and model_layout(name, models)['member_width'] is not None]
+
+
+def list_members(model_name, parameter, init_date, models=None):
+    """
+    Members of one model run: those in its repacked store (see repack.py) and the member
+    folders found with a single directory listing, as daily files may be deleted after
+    repacking.
+
+    Returns:
+    - list of str, member labels (e.g. ['001', '002', ...]); empty if the run is missing
+    """
+    models = config.models if models is None else models
+    store = open_store(model_name, parameter)
+    stored = store.members_at(init_date) if store is not None else []
+    layout = model_layout(model_name, models)
+    init_dir = os.path.join(models[model_name]['data_path'], *[part.format(parameter=parameter) for part in layout['prefix']],
+                            init_date.strftime("%Y%m%d") + layout['init_suffix'])
+    try:
+        entries = list(os.scandir(init_dir))
+    except FileNotFoundError:
+        entries = []
+    return sorted(set(stored) | {entry.name for entry in entries
+                                 if entry.is_dir() and entry.name.isdigit() and len(entry.name) == layout['member_width']})
+
+
+def member_file_path(model_name, parameter, init_date, valid_date, member, models=None):
+    """
+    Daily file of one ensemble member; the member folder of the config template is swapped.
+
+    Returns:
+    - str, path to the NetCDF file
+    """
+    models = config.models if models is None else models
+    details = models[model_name]
+    layout = model_layout(model_name, models)
+    path = model_file_path(model_name, parameter, init_date, valid_date, models)
+    base = os.path.normpath(details['data_path']).split(os.sep)
+    parts = os.path.normpath(path).split(os.sep)
+    parts[len(base) + len(layout['prefix']) + 1] = member
+    return os.sep.join(parts)
+
+
+def member_grid(file_path, models=None):
+    """
+    Grid of one member field, from its repacked store or its daily file.
+
+    Returns:
+    - lat, lon: numpy.ndarray
+
+    Raises:
+    - FileNotFoundError, if the field is neither in a store nor on disk
+    """
+    source = field_source(file_path, models)
+    if source is not None:
+        return source[0].lat, source[0].lon
+    with default_pool().dataset(file_path, mask_and_scale=False) as dataset:
+        return dataset['lat'].values, dataset['lon'].values
+
+
+def read_member(file_path, variable_name, policy=None, models=None, rows=None):
+    """
+    Read one member field, or some of its latitude rows, from its repacked store and
+    from its daily file only when no store holds it.
+
+    Parameters:
+    - file_path: str, daily file of the member
+    - variable_name: str, variable to read
+    - policy: dict, load policy (defaults to data_io.load_policy(variable_name))
+    - models: dict, model config used to find the store (defaults to config.models)
+    - rows: slice, optional latitude rows
+
+    Returns:
+    - xarray.DataArray, decoded (lat, lon) field
+
+    Raises:
+    - FileNotFoundError, if the field is neither in a store nor on disk
+    """
+    policy = load_policy(variable_name) if policy is None else policy
+    source = field_source(file_path, models)
+    if source is not None:
+        store, position = source
+        return store.read(variable_name, position, policy, rows)
+    with default_pool().dataset(file_path, mask_and_scale=False) as dataset:
+        variable = dataset[variable_name].squeeze()
+        return decode_field(variable if rows is None else variable.isel(lat=rows), policy)
+
+
+def _load_member(job):
+    """Read one member as float32 on its own grid; None if it is missing."""
+    file_path, variable_name, models = job
+    try:
+        field = read_member(file_path, variable_name, models=models)
+        return field.values.astype(np.float32, copy=False), field['lat'].values, field['lon'].values
+    except FileNotFoundError:
+        return None
+
+
+def load_members(file_paths, variable_name, executor=None, models=None):
+    """
+    Read every member of one forecast into a stacked float32 array.
+
+    Parameters:
+    - file_paths: list of str, one daily file path per member (read from the repacked
+      store when it holds the member)
+    - variable_name: str, variable to read
+    - executor: concurrent.futures.Executor, optional pool to read members in parallel
+    - models: dict, model config (defaults to config.models)
+
+    Returns:
+    - members: numpy.ndarray, float32 (member, lat, lon), missing members left out (None if all are missing)
+    - lat, lon: numpy.ndarray, grid of the members
+    """
+    jobs = [(file_path, variable_name, models) for file_path in file_paths]
+    results = list(executor.map(_load_member, jobs)) if executor is not None else [_load_member(job) for job in jobs]
+    results = [result for result in results if result is not None]
+    if not results:
+        return None, None, None
+    members = np.empty((len(results),) + results[0][0].shape, dtype=np.float32)
+    for i, (values, _, _) in enumerate(results):
+        members[i] = values
+    return members, results[0][1], results[0][2]
+
+
+def fair_crps(members, observation):
+    """
+    Fair (ensemble-size adjusted) CRPS per grid point from sorted members, O(m log m).
+
+    Uses CRPS = mean|x_i - y| - sum_i (2i - m - 1) x_(i) / (m (m - 1)) with x_(i) the
+    members in ascending order.
+
+    Parameters:
+    - members: numpy.ndarray, (member, ...) ensemble
+    - observation: numpy.ndarray, (...) verifying values
+
+    Returns:
+    - numpy.ndarray, (...) CRPS; NaN where the observation or any member is NaN
+    """
+    m = members.shape[0]
+    ordered = np.sort(members, axis=0)
+    rank_weights = (2 * np.arange(1, m + 1) - m - 1).astype(np.float32).reshape((m,) + (1,) * (members.ndim - 1))
+    skill = np.abs(members - observation).mean(axis=0)
+    if m < 2:
+        return skill
+    return skill - (rank_weights * ordered).sum(axis=0) / (m * (m - 1))
+
+
+def rank_histogram(members, observation):
+    """
+    Counts of the observation's rank among the members over all valid grid points.
+
+    Ties between observation and members are split evenly by taking the mid rank.
+
+    Returns:
+    - numpy.ndarray, int64 (member + 1,) counts
+    """
+    m = members.shape[0]
+    valid = np.isfinite(observation) & np.isfinite(members).all(axis=0)
+    below = (members < observation).sum(axis=0)
+    equal = (members == observation).sum(axis=0)
+    ranks = below + equal // 2
+    return np.bincount(ranks[valid].ravel(), minlength=m + 1)
+
+
+def ensemble_scores(members, observation, weights):
+    """
+    Area-weighted ensemble scores of one forecast.
+
+    Parameters:
+    - members: numpy.ndarray, (member, lat, lon) ensemble on the observation grid
+    - observation: numpy.ndarray, (lat, lon) reference field
+    - weights: numpy.ndarray, (lat, lon) area weights
+
+    Returns:
+    - dict, 'crps', 'ensemble_mean_mse', 'variance' (weighted means over valid points),
+      'weight' (sum of weights used) and 'rank_histogram' (counts)
+    """
+    ensemble_mean = members.mean(axis=0)
+    variance = members.var(axis=0, ddof=1) if members.shape[0] > 1 else np.zeros_like(ensemble_mean)
+    crps = fair_crps(members, observation)
+    valid = np.isfinite(crps) & np.isfinite(ensemble_mean) & np.isfinite(variance)
+    w = np.where(valid, weights, 0.0)
+    total = w.sum()
+
+    def weighted_mean(values):
+        return float(np.where(valid, values, 0.0).astype(np.float64).ravel() @ w.ravel() / total) if total > 0 else np.nan
+
+    return {
+        'crps': weighted_mean(crps),
+        'ensemble_mean_mse': weighted_mean((ensemble_mean - observation) ** 2),
+        'variance': weighted_mean(variance),
+        'weight': float(total),
+        'rank_histogram': rank_histogram(members, observation)
+    }
+
+
+def run_ensemble_verification(parameter, reference_name, start_date, end_date, forecast_horizons, model_names=None,
+                              models=None, reference_data=None, reference_cache=None, threads=None):
+    """
+    Verify every member of the ensemble models over a period.
+
+    All members of a (model, init, lead) are read as one stacked float32 array, by a
+    thread pool when threads > 1 (reads are I/O bound and a process pool would pickle
+    every field back), regridded together to the reference grid and scored
+    with vectorised fair CRPS, ensemble-mean RMSE, spread and rank histograms.
+
+    Parameters:
+    - parameter, reference_name, start_date, end_date, forecast_horizons: as in verification.run_verification
+    - model_names: list of str, models to verify (default: every ensemble model of the parameter)
+    - threads: int, threads reading members (defaults to config['prefetch_threads'])
+
+    Returns:
+    - xarray.Dataset, per-forecast `crps`, `ensemble_mean_rmse`, `spread` and `members`
+      (model, lead, init); pooled `*_pooled` and `spread_skill` (model, lead); and
+      `rank_histogram` (model, lead, rank)
+    """
+    models = config.models if models is None else models
+    reference_data = config.reference_data if reference_data is None else reference_data
+    if reference_cache is None:
+        reference_cache = default_reference_cache(reference_data)
+    threads = config.config['prefetch_threads'] if threads is None else threads
+    model_names = ensemble_models(parameter, models) if model_names is None else list(model_names)
+    regrid_method = config.variables[parameter].get('regrid_method', 'linear')
+    tasks = [task for task in plan_verification(parameter, reference_name, start_date, end_date, forecast_horizons, models, reference_data)
+             if task['model'] in model_names]
+    inits = sorted({task['init'] for task in tasks})
+    shape = (len(model_names), len(forecast_horizons), len(inits))
+    crps, mse, variance, weight = (np.full(shape, np.nan) for _ in range(4))
+    member_count = np.zeros(shape, dtype=np.int32)
+    histograms = {}
+    weights_by_grid = {}
+    members_by_run = {}
+
+    executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    try:
+        for valid_date, group in group_by_valid_date(tasks).items():
+            print(f"\nVerifying ensembles valid on: {valid_date.strftime('%Y%m%d')}")
+            try:
+                actual = reference_cache.get(reference_name, parameter, valid_date)
+            except FileNotFoundError:
+                print(f"Reference data not found at path: {group[0]['reference_path']}. Skipping this date.")
+                continue
+            lat, lon = actual['lat'].values, actual['lon'].values
+            grid = (lat.tobytes(), lon.tobytes())
+            if grid not in weights_by_grid:
+                weights_by_grid[grid] = np.array(latitude_weights(lat, lon))
+
+            for task in group:
+                run = (task['model'], task['init'])
+                if run not in members_by_run:
+                    members_by_run[run] = list_members(task['model'], parameter, task['init'], models)
+                paths = [member_file_path(task['model'], parameter, task['init'], valid_date, member, models) for member in members_by_run[run]]
+                members, member_lat, member_lon = load_members(paths, models[task['model']]['variable_names'][parameter], executor, models)
+                if members is None:
+                    print(f"No members found for model '{task['model']}' on date {task['init'].strftime('%Y%m%d')}, lead {task['lead']}.")
+                    continue
+                if members.shape[1:] != actual.shape or not (np.array_equal(member_lat, lat) and np.array_equal(member_lon, lon)):
+                    members = regrid_stack(members, member_lat, member_lon, lat, lon, regrid_method).astype(np.float32)
+
+                print(f"    Scoring model: {task['model']} lead {task['lead']} ({members.shape[0]} members)")
+                scores = ensemble_scores(members, actual.values.astype(np.float32), weights_by_grid[grid])
+                index = (model_names.index(task['model']), forecast_horizons.index(task['lead']), inits.index(task['init']))
+                crps[index], mse[index], variance[index], weight[index] = scores['crps'], scores['ensemble_mean_mse'], scores['variance'], scores['weight']
+                member_count[index] = members.shape[0]
+                key = index[:2]
+                counts = scores['rank_histogram']
+                previous = histograms.get(key, np.zeros(0, dtype=np.int64))
+                size = max(len(previous), len(counts))
+                histograms[key] = np.pad(previous, (0, size - len(previous))) + np.pad(counts, (0, size - len(counts)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    reference_cache.report()
+    default_pool().report()
+
+    n_ranks = max([len(counts) for counts in histograms.values()], default=1)
+    rank_counts = np.zeros(shape[:2] + (n_ranks,), dtype=np.int64)
+    for (i, j), counts in histograms.items():
+        rank_counts[i, j, :len(counts)] = counts
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled_weight = np.nansum(weight, axis=2)
+        crps_pooled = np.nansum(crps * weight, axis=2) / pooled_weight
+        mse_pooled = np.nansum(mse * weight, axis=2) / pooled_weight
+        variance_pooled = np.nansum(variance * weight, axis=2) / pooled_weight
+    field_dims, pooled_dims = ('model', 'lead', 'init'), ('model', 'lead')
+    return xr.Dataset(
+        {
+            'crps': (field_dims, crps),
+            'ensemble_mean_rmse': (field_dims, np.sqrt(mse)),
+            'spread': (field_dims, np.sqrt(variance)),
+            'members': (field_dims, member_count),
+            'crps_pooled': (pooled_dims, crps_pooled),
+            'ensemble_mean_rmse_pooled': (pooled_dims, np.sqrt(mse_pooled)),
+            'spread_pooled': (pooled_dims, np.sqrt(variance_pooled)),
+            'spread_skill': (pooled_dims, np.sqrt(variance_pooled / mse_pooled)),
+            'rank_histogram': (('model', 'lead', 'rank'), rank_counts)
+        },
+        coords={'model': model_names, 'lead': list(forecast_horizons), 'init': np.array(inits, dtype='datetime64[ns]'), 'rank': np.arange(n_ranks)},
+        attrs={'parameter': parameter, 'reference': reference_name, 'weighting': 'cos(latitude)'}
+    )
+
+
+class MemberReducer:
+    """
+    Running per-cell mean and variance of ensemble members (Welford), one field at a time.
+
+    Only an int32 count and the float64 mean and M2 are kept, so the state is five
+    float32 fields' worth of memory whatever the ensemble size. NaNs are skipped cell
+    by cell.
+    """
+
+    def __init__(self, shape):
+        """
+        Parameters:
+        - shape: tuple of int, field shape (e.g. (lat, lon))
+        """
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape, dtype=np.int32)
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+
+    def update(self, field):
+        """Fold one member field into the statistics."""
+        field = np.asarray(field, dtype=np.float32)
+        valid = np.isfinite(field)
+        self.count += valid
+        with np.errstate(invalid='ignore'):
+            delta = np.where(valid, field - self.mean, 0)
+            self.mean += delta / np.maximum(self.count, 1)
+            self.m2 += np.where(valid, delta * (field - self.mean), 0)
+
+    def variance(self):
+        """Unbiased member variance (NaN with fewer than two members)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan).astype(np.float32)
+
+    def result(self):
+        """
+        Statistics collected so far.
+
+        Returns:
+        - dict, 'count', 'mean' and 'std' arrays
+        """
+        return {
+            'count': self.count.copy(),
+            'mean': np.where(self.count == 0, np.nan, self.mean).astype(np.float32),
+            'std': np.sqrt(self.variance())
+        }
+
+
+def sorted_quantiles(block, count, quantiles):
+    """
+    Exact quantiles (linear interpolation, as numpy.quantile) of members sorted along axis 0.
+
+    Parameters:
+    - block: numpy.ndarray, (member, ...) values sorted along the member axis, NaNs last
+    - count: numpy.ndarray, valid members per cell
+    - quantiles: sequence of float in [0, 1]
+
+    Returns:
+    - numpy.ndarray, float32 (quantile, ...), NaN where no member is valid
+    """
+    last = np.maximum(count - 1, 0)
+    values = np.empty((len(quantiles),) + block.shape[1:], dtype=np.float32)
+    for k, quantile in enumerate(quantiles):
+        position = last * quantile
+        below = np.floor(position).astype(np.intp)
+        above = np.minimum(below + 1, last)
+        low = np.take_along_axis(block, below[None], axis=0)[0]
+        high = np.take_along_axis(block, above[None], axis=0)[0]
+        values[k] = low + (position - below) * (high - low)
+    values[:, count == 0] = np.nan
+    return values
+
+
+def stream_member_statistics(model_name, parameter, init_date, forecast_horizons, quantiles=(0.1, 0.5, 0.9), models=None,
+                             max_mb=None):
+    """
+    Ensemble mean, spread, range and exact quantiles of one run, a band of latitude rows at a time.
+
+    Each band holds the rows of every member within `max_mb`; the mean and spread are
+    folded member by member (MemberReducer) and the band is then sorted in place for
+    the range and quantiles. Peak memory is the band, the band's float64 mean and M2,
+    and eight float32 output fields per lead (mean, std, min, max, count and three
+    quantiles), whatever the ensemble size.
+
+    Parameters:
+    - model_name, parameter: str, ensemble model and parameter
+    - init_date: datetime, forecast initialisation date
+    - forecast_horizons: list of int, lead times in days
+    - quantiles: sequence of float, quantiles to compute
+    - models: dict, model config (defaults to config.models)
+    - max_mb: float, memory budget of one band (defaults to config['member_block_mb'])
+
+    Returns:
+    - xarray.Dataset, float32 `mean`, `std`, `min`, `max` (lead, lat, lon), `quantile_values`
+      (lead, quantile, lat, lon) and `members` counts; leads without any member are left out
+    """
+    models = config.models if models is None else models
+    max_mb = config.config['member_block_mb'] if max_mb is None else max_mb
+    variable_name = models[model_name]['variable_names'][parameter]
+    policy = load_policy(variable_name)
+    members = list_members(model_name, parameter, init_date, models)
+    result, leads, coords = None, [], None
+    for lead_index, lead in enumerate(forecast_horizons):
+        valid_date = init_date + timedelta(days=lead)
+        file_paths = []
+        for member in members:
+            file_path = member_file_path(model_name, parameter, init_date, valid_date, member, models)
+            try:
+                lat, lon = member_grid(file_path, models)
+            except FileNotFoundError:
+                print(f"File not found: {file_path} for model '{model_name}' on date {init_date.strftime('%Y%m%d')}.")
+                continue
+            shape = (len(lat), len(lon))
+            if coords is None:
+                coords = {'lat': lat, 'lon': lon}
+            file_paths.append(file_path)
+        if not file_paths:
+            continue
+
+        n_lat, n_lon = shape
+        rows = max(1, int(max_mb * 1024 ** 2 // (len(file_paths) * n_lon * 4)))
+        if result is None:
+            # Outputs of every lead, filled in place band by band
+            result = {name: np.full((len(forecast_horizons),) + shape, np.nan, dtype=np.float32) for name in ('mean', 'std', 'min', 'max')}
+            result['count'] = np.zeros((len(forecast_horizons),) + shape, dtype=np.int32)
+            result['quantiles'] = np.full((len(forecast_horizons), len(quantiles)) + shape, np.nan, dtype=np.float32)
+        for start in range(0, n_lat, rows):
+            band = slice(start, min(start + rows, n_lat))
+            block = np.empty((len(file_paths), band.stop - band.start, n_lon), dtype=np.float32)
+            reducer = MemberReducer(block.shape[1:])
+            for i, file_path in enumerate(file_paths):
+                block[i] = read_member(file_path, variable_name, policy, models, band).values
+                reducer.update(block[i])
+            statistics = reducer.result()
+            block.sort(axis=0)  # NaNs sort last
+            count = statistics['count']
+            result['count'][lead_index, band] = count
+            result['mean'][lead_index, band] = statistics['mean']
+            result['std'][lead_index, band] = statistics['std']
+            result['min'][lead_index, band] = np.where(count > 0, block[0], np.nan)
+            result['max'][lead_index, band] = np.where(count > 0, np.take_along_axis(block, np.maximum(count - 1, 0)[None], axis=0)[0], np.nan)
+            result['quantiles'][lead_index, :, band] = sorted_quantiles(block, count, quantiles)
+            del block
+        leads.append(lead)
+
+    if not leads:
+        raise FileNotFoundError(f"No member files of {model_name} {parameter} for init {init_date.strftime('%Y%m%d')}")
+    field_dims = ('lead', 'lat', 'lon')
+    # Leads without any member are dropped (a copy only in that case)
+    kept = [i for i, lead in enumerate(forecast_horizons) if lead in leads]
+    stack = result if len(kept) == len(forecast_horizons) else {name: values[kept] for name, values in result.items()}
+    return xr.Dataset(
+        {
+            'mean': (field_dims, stack['mean']),
+            'std': (field_dims, stack['std']),
+            'min': (field_dims, stack['min']),
+            'max': (field_dims, stack['max']),
+            'members': (field_dims, stack['count']),
+            'quantile_values': (('lead', 'quantile', 'lat', 'lon'), stack['quantiles'])
+        },
+        coords=dict(coords, lead=leads, quantile=list(quantiles)),
+        attrs={'model': model_name, 'parameter': parameter, 'init': init_date.strftime('%Y%m%d')}
+    )
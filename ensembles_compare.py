@@ -1,6 +1,7 @@
-import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
+from handle_pool import DatasetPool
+from points import PointExtractor
 
 # File path template for ECMWF IFS ensemble members' daily temperature forecasts
 ensemble_temp_path_template = '/mnt/datawaha/hyex/beckhe/DATA_PROCESSED/ECMWF_IFS_open_ensemble_forecasts/Temp/20240917_00/{ensemble:03d}/Daily/2024{day_of_year:03d}.nc'
@@ -15,6 +16,12 @@ forecast_days = range(1, 16)
 ensemble_temp_forecasts = []
 times = [f'Day {day}' for day in forecast_days]
 
+# Bounded pool of open files; everything is closed when the loop finishes
+pool = DatasetPool()
+
+# Grid indices of the point are computed once; each file read touches only that grid cell
+extractor = PointExtractor([lat_mumbai], [lon_mumbai], names=['Mumbai'], pool=pool)
+
 # Loop through each ensemble member (1 to 10)
 for ensemble in range(1, 11):
     member_forecasts = []
@@ -27,17 +34,9 @@ for ensemble in range(1, 11):
         forecast_file = ensemble_temp_path_template.format(ensemble=ensemble, day_of_year=day_of_year)
         
         try:
-            # Load the forecast data
-            forecast_data = xr.open_dataset(forecast_file)
-            
-            # Extract temperature data for Mumbai, ensuring we get a scalar value
-            temp_mumbai = forecast_data['air_temperature'].sel(lat=lat_mumbai, lon=lon_mumbai, method='nearest').values
-            
-            # Handle the case where temp_mumbai might be an array
-            if np.isscalar(temp_mumbai):
-                member_forecasts.append(temp_mumbai)
-            else:
-                member_forecasts.append(temp_mumbai.item())  # Convert to a single value if it's a one-element array
+            # Extract the temperature for Mumbai (nearest grid point)
+            temp_mumbai = extractor.extract(forecast_file, 'air_temperature')
+            member_forecasts.append(temp_mumbai.item())
         
         except (FileNotFoundError, IndexError, KeyError):
             print(f"File not found or data issue for Ensemble {ensemble}, Day {day}. Skipping...")
@@ -50,6 +49,9 @@ for ensemble in range(1, 11):
     # Append the forecasts for this ensemble member
     ensemble_temp_forecasts.append(member_forecasts)
 
+pool.report()
+pool.close_all()
+
 # Convert to a numpy array to handle any potential inconsistencies
 ensemble_temp_forecasts = np.array(ensemble_temp_forecasts, dtype=np.float64)
 
@@ -2,46 +2,36 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 from config import models, start_date_str, end_date_str, param, reference_choice, variables  # Import variables explicitly
-import subprocess
+from results_io import results_path, load_scores
 
 # Define plot directory
 plot_dir = '/mnt/datawaha/hyex/msn/GWPM/plots'
 os.makedirs(plot_dir, exist_ok=True)  # Ensure the directory exists
 
-# Load the saved data
-data_file = f"forecast_analysis_{param}_{reference_choice}_{start_date_str}_{end_date_str}.npz"
+# Locate the results cube written by gwpm_calc.py
+data_file = results_path(param, reference_choice, start_date_str, end_date_str)
 
 if not os.path.exists(data_file):
-    print(f"Data file {data_file} not found. Running calculation script...")
-    # Run the calculation script
-    result = subprocess.run(['python3', 'gwpm_calc.py'], capture_output=True, text=True)
-    print(result.stdout)  # Print the output of the calc script
-    
-    if not os.path.exists(data_file):
-        print("Calculation script failed or data file was not generated.")
-        exit(1)
+    print(f"Results file {data_file} not found. Run gwpm_calc.py first (it only scores fields missing from its results store).")
+    exit(1)
 
-# Load the saved data
-data = np.load(data_file, allow_pickle=True)
-
-# Extract the data
-rmse_aggregated = data['rmse_aggregated'].item()
-correlation_aggregated = data['correlation_aggregated'].item()
-forecasts_count = data['forecasts_count'].item()
+# Load only the pooled scores the plot needs
+rmse_aggregated = load_scores(data_file, 'rmse')
+correlation_aggregated = load_scores(data_file, 'correlation')
 
 # Plotting RMSE and Temporal Correlation
 fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 8))
 
 # Set positions and width for the bars
-forecast_horizons = list(rmse_aggregated.keys())
+forecast_horizons = list(rmse_aggregated['lead'].values)
 x_labels = [f'{h}-Day' for h in forecast_horizons]
 x = np.arange(len(x_labels))
 width = 0.2  # Width of each bar
 
 # Plot RMSE
 for idx, model_name in enumerate([m for m in models.keys() if param in models[m]['predictors']]):
-    rmse_values = [rmse_aggregated[horizon][model_name] for horizon in forecast_horizons]
-    rmse_values = [rmse for rmse in rmse_values if rmse is not None]  # Filter out None values
+    rmse_values = rmse_aggregated.sel(model=model_name).values
+    rmse_values = [rmse for rmse in rmse_values if np.isfinite(rmse)]  # Filter out missing values
     if rmse_values:  # Only plot if there are valid RMSE values
         ax1.bar(x[:len(rmse_values)] + idx * width, rmse_values, width, label=model_name)
         # Add RMSE values on top of each bar
@@ -50,8 +40,8 @@ for idx, model_name in enumerate([m for m in models.keys() if param in models[m]
 
 # Plot Temporal Correlation
 for idx, model_name in enumerate([m for m in models.keys() if param in models[m]['predictors']]):
-    corr_values = [correlation_aggregated[horizon][model_name] for horizon in forecast_horizons]
-    corr_values = [corr for corr in corr_values if corr is not None and corr > 0]  # Filter out None or zero values
+    corr_values = correlation_aggregated.sel(model=model_name).values
+    corr_values = [corr for corr in corr_values if np.isfinite(corr) and corr > 0]  # Filter out missing or zero values
     if corr_values:  # Only plot if there are valid correlation values
         ax2.bar(x[:len(corr_values)] + idx * width, corr_values, width, label=model_name)
         # Add correlation values on top of each bar
@@ -90,10 +80,3 @@ plt.tight_layout()
 plot_file = os.path.join(plot_dir, f'{param}_{reference_choice}_{start_date_str}_{end_date_str}_RMSE_Corr.png')
 plt.savefig(plot_file)
 plt.show()
-
-# Delete the calculation results file
-try:
-    os.remove(data_file)
-    print(f"Deleted calculation results file: {data_file}")
-except OSError as e:
-    print(f"Error deleting file {data_file}: {e}")
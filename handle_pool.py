@@ -0,0 +1,180 @@
+import os
+import resource
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import xarray as xr
+import config
+import instrument
+
+
+def current_rss_mb():
+    """
+    Resident memory of this process in MB, or None where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB (ru_maxrss is in KB on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class DatasetPool:
+    """
+    Bounded LRU pool of open NetCDF datasets.
+
+    Datasets are closed as soon as they are evicted, and never while a caller is still
+    inside a `with pool.dataset(path)` block. Using the pool itself as a context
+    manager closes everything on exit.
+    """
+
+    def __init__(self, max_open=None):
+        """
+        Parameters:
+        - max_open: int, maximum number of idle open datasets (defaults to config['max_open_files'])
+        """
+        self.max_open = config.config['max_open_files'] if max_open is None else max_open
+        self.handles = OrderedDict()
+        self.in_use = {}
+        self.lock = threading.RLock()
+        self.opens = 0
+        self.reuses = 0
+        self.evictions = 0
+        self.peak_open = 0
+
+    @contextmanager
+    def dataset(self, file_path, mask_and_scale=True):
+        """
+        Borrow an open dataset.
+
+        Parameters:
+        - file_path: str, path to the NetCDF file
+        - mask_and_scale: bool, False for raw values (decoded later by data_io.decode_field);
+          each mode keeps its own handle
+
+        Yields:
+        - xarray.Dataset, valid until the block exits; load what you need inside it
+
+        Raises:
+        - FileNotFoundError, if the file does not exist
+        """
+        key = (file_path, mask_and_scale)
+        with self.lock:
+            dataset = self.handles.get(key)
+        opened = None
+        if dataset is None:
+            # Opened outside the lock so threads reading different files do not queue behind each other
+            with instrument.stage('open'):
+                opened = xr.open_dataset(file_path, mask_and_scale=mask_and_scale)
+        with self.lock:
+            if key in self.handles:
+                self.reuses += 1
+                self.handles.move_to_end(key)
+                dataset = self.handles[key]
+                if opened is not None:
+                    opened.close()  # Another thread opened the same file meanwhile
+            else:
+                dataset = opened if opened is not None else xr.open_dataset(file_path, mask_and_scale=mask_and_scale)
+                self.opens += 1
+                instrument.count('files_opened')
+                if instrument.enabled():
+                    instrument.count('bytes_on_disk', os.path.getsize(file_path))
+                self.handles[key] = dataset
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+            self.peak_open = max(self.peak_open, len(self.handles))
+        try:
+            yield dataset
+        finally:
+            with self.lock:
+                self.in_use[key] -= 1
+                if self.in_use[key] == 0:
+                    del self.in_use[key]
+                self._evict()
+
+    def _evict(self):
+        """Close least recently used idle datasets beyond the limit."""
+        for key in list(self.handles):
+            if len(self.handles) <= self.max_open:
+                break
+            if key not in self.in_use:
+                self.handles.pop(key).close()
+                self.evictions += 1
+
+    def forget(self, file_path):
+        """
+        Drop the handles of a file that was rewritten, so the next borrow reopens it.
+
+        Idle handles are closed; borrowed ones are left to their borrower and closed
+        when released and collected.
+        """
+        with self.lock:
+            for key in [key for key in self.handles if key[0] == file_path]:
+                dataset = self.handles.pop(key)
+                if key not in self.in_use:
+                    dataset.close()
+
+    def close_all(self):
+        """Close every idle dataset."""
+        with self.lock:
+            for key in list(self.handles):
+                if key not in self.in_use:
+                    self.handles.pop(key).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_all()
+
+    def stats(self):
+        """
+        Handle and memory counters.
+
+        Returns:
+        - dict, open handles now and at peak, opens, reuses, evictions, current and peak RSS in MB
+        """
+        return {
+            'open_handles': len(self.handles),
+            'peak_open_handles': self.peak_open,
+            'opens': self.opens,
+            'reuses': self.reuses,
+            'evictions': self.evictions,
+            'rss_mb': current_rss_mb(),
+            'peak_rss_mb': peak_rss_mb()
+        }
+
+    def report(self):
+        """Print the handle and memory counters."""
+        stats = self.stats()
+        rss = f"{stats['rss_mb']:.0f} MB" if stats['rss_mb'] is not None else "n/a"
+        print(f"Dataset pool: {stats['open_handles']} open (peak {stats['peak_open_handles']}), {stats['opens']} opens, "
+              f"{stats['reuses']} reuses, {stats['evictions']} evictions, RSS {rss} (peak {stats['peak_rss_mb']:.0f} MB)")
+
+
+_default_pool = None
+
+
+def default_pool():
+    """
+    The process-wide pool every loader goes through.
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = DatasetPool()
+    return _default_pool
+
+
+def _forget_pool_after_fork():
+    # HDF5 handles must not be shared with a forked worker; it starts with an empty pool
+    global _default_pool
+    _default_pool = None
+
+
+os.register_at_fork(after_in_child=_forget_pool_after_fork)
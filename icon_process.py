@@ -1,9 +1,17 @@
 import os
+import glob
+import mmap
+import numpy as np
+import xarray as xr
 import pygrib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+import config
+from data_io import model_file_path
 
 # File paths and base directory for repositories
-input_file = '/mnt/datawaha/hyex/msn/GWPM/pamore/igfrf01000000' #change according to the file downloaded
+input_pattern = '/mnt/datawaha/hyex/msn/GWPM/pamore/igfrf*'  # Every downloaded step file matching this is split
 base_dir = '/mnt/datawaha/hyex/msn/GWPM/pamore/data_processed/'
 
 # Define parameters and their corresponding GRIB names
@@ -14,49 +22,276 @@ parameters = {
     'relative_humidity': 'Relative humidity',
     'cloud_cover': 'Cloud cover',
     'pressure': 'Pressure',
-    'specific_humidity': 'Specific humidity'
+    'specific_humidity': 'Specific humidity',
+    'total_precipitation': 'Total Precipitation'  # TOT_PREC, accumulated since the run start (kg m-2)
 }
 
-# Open the GRIB2 file
-grbs = pygrib.open(input_file)
-
-# Extract forecast production date
-forecast_date = None
-for grb in grbs:
-    forecast_date = grb.analDate  # Assuming all records share the same forecast production date
-    break
-if not forecast_date:
-    raise ValueError("Unable to extract forecast production date from the file.")
-
-forecast_date_str = datetime.strftime(forecast_date, '%Y%m%d')
-
-# Process each parameter
-for param, grib_name in parameters.items():
-    try:
-        # Select records for the parameter
-        records = grbs.select(name=grib_name)
-        
-        # Create a base directory for the parameter
-        param_dir = os.path.join(base_dir, param)
-        os.makedirs(param_dir, exist_ok=True)
-        
-        # Create a directory for the forecast production date inside the parameter folder
-        forecast_dir = os.path.join(param_dir, forecast_date_str)
-        os.makedirs(forecast_dir, exist_ok=True)
-        
+# Daily NetCDF files written into the ICON layout of config.models from the split GRIB days:
+# scored parameter -> source parameters, GRIB level and how hourly steps are combined
+# ('accumulation': the 00-00 UTC difference of a field accumulated since the run start)
+daily_outputs = {
+    'Temp': {'sources': ['temperature'], 'level': ('heightAboveGround', 2), 'combine': 'mean'},
+    'P': {'sources': ['total_precipitation'], 'level': ('surface', 0), 'combine': 'accumulation'},
+    'RelHum': {'sources': ['relative_humidity'], 'level': ('heightAboveGround', 2), 'combine': 'mean'},
+    'Wind': {'sources': ['u_wind', 'v_wind'], 'level': ('heightAboveGround', 10), 'combine': 'speed'}
+}
+
+
+def valid_time(grb):
+    """Valid time of a GRIB message; the end of the period for accumulated (statistical) fields."""
+    if grb.valid_key('lengthOfTimeRange'):
+        return grb.analDate + timedelta(hours=int(grb['endStep']))
+    return grb.validDate
+
+
+def message_offsets(file_path):
+    """
+    Byte offset and length of every GRIB message in a file, from the section 0 headers alone.
+
+    Returns:
+    - list of (offset, length) tuples in file order
+    """
+    offsets = []
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return offsets
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = data.find(b'GRIB')
+            while position != -1 and position + 16 <= len(data):
+                edition = data[position + 7]
+                if edition == 2:
+                    length = int.from_bytes(data[position + 8:position + 16], 'big')
+                else:
+                    length = int.from_bytes(data[position + 4:position + 7], 'big')
+                offsets.append((position, length))
+                position = data.find(b'GRIB', position + length)
+    return offsets
+
+
+def index_file(file_path, grib_names=None):
+    """
+    Index the messages of one GRIB file in a single pass.
+
+    Parameters:
+    - file_path: str, GRIB file
+    - grib_names: dict, parameter -> GRIB name to keep (defaults to `parameters`)
+
+    Returns:
+    - list of dict, per kept message: parameter, offset, length, level type and value,
+      initialisation and valid date
+    """
+    grib_names = parameters if grib_names is None else grib_names
+    wanted = {grib_name: param for param, grib_name in grib_names.items()}
+    offsets = message_offsets(file_path)
+    records = []
+    with pygrib.open(file_path) as grbs:
+        for (offset, length), grb in zip(offsets, grbs):
+            param = wanted.get(grb.name)
+            if param is None:
+                continue
+            records.append({
+                'parameter': param,
+                'offset': offset,
+                'length': length,
+                'level_type': grb.typeOfLevel,
+                'level': grb.level,
+                'init': grb.analDate,
+                'valid': valid_time(grb)
+            })
+    if len(offsets) != grbs.messages:
+        raise ValueError(f"{file_path}: found {len(offsets)} message headers but pygrib reads {grbs.messages} messages")
+    return records
+
+
+def copy_range(source_fd, target_fd, offset, length):
+    """Copy bytes between files, in the kernel where os.copy_file_range is available."""
+    while length > 0:
+        if hasattr(os, 'copy_file_range'):
+            copied = os.copy_file_range(source_fd, target_fd, length, offset)
+        else:
+            chunk = os.pread(source_fd, min(length, 1 << 24), offset)
+            copied = os.write(target_fd, chunk)
+        if copied == 0:
+            raise IOError(f"Unexpected end of file at offset {offset}")
+        offset += copied
+        length -= copied
+
+
+def split_files(input_files, output_dir, grib_names=None, workers=None):
+    """
+    Split GRIB files into one file per parameter and valid day.
+
+    Input files are indexed in parallel (one metadata pass each); the parent then
+    appends every message to `{output_dir}/{parameter}/{init YYYYMMDD}/{valid YYYYMMDD}.grib2`
+    as a byte-range copy, in input order. Outputs touched by the run are rewritten
+    from scratch, so re-running over the same inputs gives the same files.
+
+    Parameters:
+    - input_files: list of str, GRIB files (e.g. the hourly steps of one or more runs)
+    - output_dir: str, root of the split archive
+    - grib_names: dict, parameter -> GRIB name (defaults to `parameters`)
+    - workers: int, indexing processes (defaults to config['workers'])
+
+    Returns:
+    - dict, output path -> list of (parameter, init, valid, level type, level) of its messages
+    """
+    workers = config.config['workers'] if workers is None else workers
+    if workers > 1 and len(input_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            indices = list(executor.map(index_file, input_files, [grib_names] * len(input_files)))
+    else:
+        indices = [index_file(input_file, grib_names) for input_file in input_files]
+
+    outputs = defaultdict(list)
+    for input_file, records in zip(input_files, indices):
         for record in records:
-            # Extract the forecast time (value date) from the record
-            value_date = forecast_date + timedelta(hours=record.forecastTime)
-            value_date_str = datetime.strftime(value_date, '%Y%m%d')
-            
-            # Define output file path
-            output_file = os.path.join(forecast_dir, f"{value_date_str}.grib2")
-            
-            # Save the record
-            with open(output_file, 'wb') as f:
-                f.write(record.tostring())
-        print(f"Saved {param} data.")
-    except ValueError as e:
-        print(f"Error processing {param}: {e}")
-
-print("Data successfully saved into organized folders.")
+            output_file = os.path.join(output_dir, record['parameter'], record['init'].strftime('%Y%m%d'),
+                                       f"{record['valid'].strftime('%Y%m%d')}.grib2")
+            outputs[output_file].append((input_file, record))
+
+    contents = {}
+    for output_file, messages in outputs.items():
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        target_fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            for input_file in dict.fromkeys(input_file for input_file, _ in messages):
+                source_fd = os.open(input_file, os.O_RDONLY)
+                try:
+                    for _, record in (message for message in messages if message[0] == input_file):
+                        copy_range(source_fd, target_fd, record['offset'], record['length'])
+                finally:
+                    os.close(source_fd)
+        finally:
+            os.close(target_fd)
+        contents[output_file] = [(record['parameter'], record['init'], record['valid'], record['level_type'], record['level'])
+                                 for _, record in messages]
+    print(f"Split {len(input_files)} files into {len(outputs)} parameter/day files.")
+    return contents
+
+
+def _read_level(grib_file, level):
+    """Hourly fields of one level in a split GRIB day file, keyed by valid time."""
+    level_type, level_value = level
+    fields, lat, lon = {}, None, None
+    with pygrib.open(grib_file) as grbs:
+        for grb in grbs:
+            if grb.typeOfLevel != level_type or grb.level != level_value:
+                continue
+            if grb.gridType != 'regular_ll':
+                raise ValueError(f"{grib_file}: daily aggregation needs a regular lat/lon grid, found {grb.gridType}")
+            if lat is None:
+                lats, lons = grb.latlons()
+                lat, lon = lats[:, 0], lons[0, :]
+            fields[valid_time(grb)] = np.ma.filled(grb.values.astype(np.float32), np.nan)
+    return fields, lat, lon
+
+
+def aggregate_day(split_dir, parameter, init_date, valid_date, outputs=None, models=None):
+    """
+    Combine the hourly steps of one valid day into a daily NetCDF file of the ICON layout.
+
+    Accumulated sources (daily P from TOT_PREC) give the amount between 00 UTC of the
+    valid day and 00 UTC of the next; the closing step sits in the next day's split
+    file, and nothing has accumulated yet at the run start.
+
+    Parameters:
+    - split_dir: str, root of the split GRIB archive
+    - parameter: str, scored parameter (key of `daily_outputs`)
+    - init_date, valid_date: datetime, run and day to aggregate
+    - outputs: dict, daily output definitions (defaults to `daily_outputs`)
+    - models: dict, model config with the ICON file_path (defaults to config.models)
+
+    Returns:
+    - str, path written, or None if a source day file is missing
+    """
+    outputs = daily_outputs if outputs is None else outputs
+    models = config.models if models is None else models
+    definition = outputs[parameter]
+    sources = []
+    for source in definition['sources']:
+        grib_file = os.path.join(split_dir, source, init_date.strftime('%Y%m%d'), f"{valid_date.strftime('%Y%m%d')}.grib2")
+        if not os.path.exists(grib_file):
+            print(f"File not found: {grib_file}. Skipping {parameter} on {valid_date.strftime('%Y%m%d')}.")
+            return None
+        sources.append(_read_level(grib_file, definition['level']))
+
+    if definition['combine'] == 'accumulation':
+        fields, lat, lon = sources[0]
+        day_end = valid_date + timedelta(days=1)
+        next_file = os.path.join(split_dir, definition['sources'][0], init_date.strftime('%Y%m%d'), f"{day_end.strftime('%Y%m%d')}.grib2")
+        if os.path.exists(next_file):
+            fields.update(_read_level(next_file, definition['level'])[0])
+        if day_end not in fields or (valid_date not in fields and valid_date != init_date):
+            print(f"No 00 UTC accumulations around {valid_date.strftime('%Y%m%d')} for {parameter}. Skipping.")
+            return None
+        steps = [step for step in fields if valid_date < step <= day_end]
+        # GRIB packing can make the difference of two equal totals slightly negative
+        daily = np.maximum(fields[day_end] - fields.get(valid_date, 0.0), 0.0)
+    else:
+        steps = sorted(set.intersection(*[set(fields) for fields, _, _ in sources]))
+        if not steps:
+            print(f"No {definition['level']} steps for {parameter} on {valid_date.strftime('%Y%m%d')}.")
+            return None
+        if definition['combine'] == 'speed':
+            (u_fields, lat, lon), (v_fields, _, _) = sources
+            daily = np.mean([np.hypot(u_fields[step], v_fields[step]) for step in steps], axis=0)
+        else:
+            fields, lat, lon = sources[0]
+            daily = np.mean([fields[step] for step in steps], axis=0)
+
+    order = np.argsort(lat)
+    variable_name = models['ICON']['variable_names'][parameter]
+    dataset = xr.Dataset(
+        {variable_name: (('time', 'lat', 'lon'), daily[order][None].astype(np.float32))},
+        coords={'time': [np.datetime64(valid_date.strftime('%Y-%m-%d'), 'ns')], 'lat': lat[order], 'lon': lon},
+        attrs={'source': 'ICON GRIB2', 'steps': len(steps), 'init': init_date.strftime('%Y%m%d')}
+    )
+    output_file = model_file_path('ICON', parameter, init_date, valid_date, models)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    dataset.to_netcdf(output_file, encoding={variable_name: {'zlib': True, 'complevel': 4}})
+    return output_file
+
+
+def _aggregate_job(job):
+    return aggregate_day(*job)
+
+
+def aggregate_daily(split_contents, split_dir, outputs=None, workers=None):
+    """
+    Write every daily NetCDF file that the split archive can provide, in parallel.
+
+    Parameters:
+    - split_contents: dict, output of split_files
+    - split_dir: str, root of the split GRIB archive
+    - outputs: dict, daily output definitions (defaults to `daily_outputs`)
+    - workers: int, processes (defaults to config['workers'])
+
+    Returns:
+    - list of str, daily files written
+    """
+    outputs = daily_outputs if outputs is None else outputs
+    workers = config.config['workers'] if workers is None else workers
+    days = {}
+    for messages in split_contents.values():
+        for param, init_date, valid_date, _, _ in messages:
+            days.setdefault(param, set()).add((init_date, datetime(valid_date.year, valid_date.month, valid_date.day)))
+    jobs = [(split_dir, parameter, init_date, valid_date, outputs)
+            for parameter, definition in outputs.items()
+            for init_date, valid_date in sorted(days.get(definition['sources'][0], set()))]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            written = list(executor.map(_aggregate_job, jobs))
+    else:
+        written = [_aggregate_job(job) for job in jobs]
+    written = [path for path in written if path is not None]
+    print(f"Wrote {len(written)} daily files.")
+    return written
+
+
+if __name__ == '__main__':
+    input_files = sorted(glob.glob(input_pattern))
+    if not input_files:
+        raise SystemExit(f"No GRIB files match {input_pattern}")
+    contents = split_files(input_files, base_dir)
+    aggregate_daily(contents, base_dir)
+    print("Data successfully saved into organized folders.")
@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import platform
+import threading
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import config
+import handle_pool
+
+# Returned by stage() while instrumentation is off, so a disabled stage costs one call
+_NULL_STAGE = nullcontext()
+
+# Monotonic counters of watched statistics that are summed across workers
+SOURCE_COUNTERS = ('hits', 'misses', 'spill_hits', 'opens', 'reuses', 'evictions', 'waits', 'direct', 'dropped')
+
+_recorder = None
+_local = threading.local()  # Tags of the enclosing stages, per thread
+
+
+class Recorder:
+    """
+    Stage timers, counters and cache statistics of one run.
+
+    Stages and counters are keyed by their name plus tags such as model, parameter and
+    lead. Worker processes record into their own recorder and send a snapshot back,
+    which the parent merges.
+    """
+
+    def __init__(self, name, profile=None):
+        """
+        Parameters:
+        - name: str, run name used in the report file name
+        - profile: str, optional 'cprofile' or 'pyinstrument' capture of the whole run
+        """
+        self.name = name
+        self.started = time.time()
+        self.stages = defaultdict(lambda: [0, 0.0])  # key -> [calls, seconds]
+        self.counters = defaultdict(float)
+        self.sources = {}
+        self.merged_sources = defaultdict(lambda: defaultdict(float))
+        self.worker_peak_rss_mb = None
+        self.lock = threading.Lock()  # Prefetch threads record alongside the main thread
+        self.profile = profile
+        self.profiler = None
+        if profile == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile == 'pyinstrument':
+            from pyinstrument import Profiler
+            self.profiler = Profiler()
+            self.profiler.start()
+        elif profile is not None:
+            raise ValueError(f"Unknown profiler '{profile}'; use 'cprofile' or 'pyinstrument'")
+
+    @contextmanager
+    def stage(self, name, tags):
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - tic
+            with self.lock:
+                entry = self.stages[(name, tags)]
+                entry[0] += 1
+                entry[1] += seconds
+
+    def reset(self):
+        """Forget everything recorded so far (a forked worker starts from the parent's state)."""
+        self.stages.clear()
+        self.counters.clear()
+        self.sources = {}
+        self.merged_sources.clear()
+
+    def snapshot(self):
+        """Picklable copy of the stages, counters and watched statistics."""
+        return {
+            'stages': {key: list(entry) for key, entry in self.stages.items()},
+            'counters': dict(self.counters),
+            'sources': {name: {key: value - baseline.get(key, 0) for key, value in stats().items() if key in SOURCE_COUNTERS}
+                        for name, (stats, baseline) in self.sources.items()},
+            'peak_rss_mb': handle_pool.peak_rss_mb()
+        }
+
+    def merge(self, snapshot):
+        """Add a worker snapshot to this recorder."""
+        for key, (calls, seconds) in snapshot['stages'].items():
+            entry = self.stages[key]
+            entry[0] += calls
+            entry[1] += seconds
+        for key, value in snapshot['counters'].items():
+            self.counters[key] += value
+        for name, stats in snapshot['sources'].items():
+            for key, value in stats.items():
+                self.merged_sources[name][key] += value
+        self.worker_peak_rss_mb = max(self.worker_peak_rss_mb or 0.0, snapshot['peak_rss_mb'])
+
+    def report(self):
+        """
+        Machine-readable summary of the run.
+
+        Returns:
+        - dict, run metadata, per-key stages and counters, watched statistics with hit
+          rates, and peak memory
+        """
+        sources = {}
+        for name in set(self.sources) | set(self.merged_sources):
+            stats = dict(self.sources[name][0]()) if name in self.sources else {}
+            for key, value in self.merged_sources.get(name, {}).items():
+                stats[key] = (stats.get(key) or 0) + value
+            hits = stats.get('hits', stats.get('reuses'))
+            misses = stats.get('misses', stats.get('opens'))
+            if hits is not None and misses is not None and hits + misses:
+                stats['hit_rate'] = hits / (hits + misses)
+            sources[name] = stats
+        return {
+            'run': self.name,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'wall_seconds': time.time() - self.started,
+            'host': platform.node(),
+            'workers': config.config['workers'],
+            'stages': [dict(tags, stage=name, calls=calls, seconds=seconds)
+                       for (name, tags), (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1])],
+            'counters': [dict(tags, counter=name, value=value) for (name, tags), value in sorted(self.counters.items())],
+            'sources': sources,
+            'peak_rss_mb': handle_pool.peak_rss_mb(),
+            'worker_peak_rss_mb': self.worker_peak_rss_mb
+        }
+
+    def stop_profile(self, report_path):
+        """Stop the profiler and save its capture next to the report; returns the capture path."""
+        if self.profiler is None:
+            return None
+        stem = os.path.splitext(report_path)[0]
+        if self.profile == 'cprofile':
+            self.profiler.disable()
+            self.profiler.dump_stats(f"{stem}.prof")
+            return f"{stem}.prof"
+        self.profiler.stop()
+        with open(f"{stem}.html", 'w') as file:
+            file.write(self.profiler.output_html())
+        return f"{stem}.html"
+
+
+def _key(tags):
+    outer = getattr(_local, 'tags', None)
+    if outer:
+        tags = dict(outer, **tags)
+    return tuple(sorted(tags.items()))
+
+
+def enabled():
+    """True while a run is being instrumented."""
+    return _recorder is not None
+
+
+def start_run(name, enable=None, profile=None):
+    """
+    Start instrumenting a run.
+
+    Parameters:
+    - name: str, run name (e.g. 'gwpm_calc_Temp')
+    - enable: bool, defaults to config['instrument']; when off every hook is a no-op
+    - profile: str, 'cprofile' or 'pyinstrument' (defaults to config['profile'])
+
+    Returns:
+    - Recorder, or None when instrumentation is off
+    """
+    global _recorder
+    enable = config.config.get('instrument', False) if enable is None else enable
+    if not enable:
+        _recorder = None
+        return None
+    _recorder = Recorder(name, config.config.get('profile') if profile is None else profile)
+    return _recorder
+
+
+def stage(name, **tags):
+    """
+    Time a block under a stage name and tags (model, parameter, lead, ...).
+
+    Stages and counters recorded inside the block inherit the tags.
+    Usage: `with instrument.stage('read', model=model_name, lead=lead): ...`
+    """
+    if _recorder is None:
+        return _NULL_STAGE
+    return _stage(name, tags)
+
+
+@contextmanager
+def _stage(name, tags):
+    # Stages nested inside (e.g. file opens within a read) inherit the tags
+    outer = getattr(_local, 'tags', {})
+    _local.tags = dict(outer, **tags)
+    try:
+        with _recorder.stage(name, tuple(sorted(_local.tags.items()))):
+            yield
+    finally:
+        _local.tags = outer
+
+
+def count(name, value=1, **tags):
+    """Add to a counter (files opened, bytes read, ...) under the tags of the enclosing stage."""
+    if _recorder is None:
+        return
+    with _recorder.lock:
+        _recorder.counters[(name, _key(tags))] += value
+
+
+def watch(name, stats):
+    """Include a statistics callable (e.g. a cache's `stats`) in the run report."""
+    if _recorder is not None:
+        _recorder.sources[name] = (stats, stats())
+
+
+def worker_reset():
+    """Start a worker's unit of work from an empty recorder."""
+    if _recorder is not None:
+        _recorder.reset()
+
+
+def worker_snapshot():
+    """What a worker sends back for the parent to merge (None when off)."""
+    return None if _recorder is None else _recorder.snapshot()
+
+
+def merge(snapshot):
+    """Merge a worker snapshot into the current run."""
+    if _recorder is not None and snapshot is not None:
+        _recorder.merge(snapshot)
+
+
+def finish_run(report_dir=None):
+    """
+    Write the run report (and profile capture) and stop instrumenting.
+
+    Parameters:
+    - report_dir: str, defaults to `run_reports` under config['dir_output']
+
+    Returns:
+    - str, report path, or None when instrumentation was off
+    """
+    global _recorder
+    if _recorder is None:
+        return None
+    recorder, _recorder = _recorder, None
+    report_dir = os.path.join(config.config['dir_output'], 'run_reports') if report_dir is None else report_dir
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, f"{recorder.name}_{datetime.fromtimestamp(recorder.started).strftime('%Y%m%dT%H%M%S')}.json")
+    capture = recorder.stop_profile(report_path)
+    report = recorder.report()
+    report['profile'] = capture
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=1, default=str)
+
+    totals = defaultdict(float)
+    for entry in report['stages']:
+        totals[entry['stage']] += entry['seconds']
+    summary = ', '.join(f"{name} {seconds:.1f} s" for name, seconds in sorted(totals.items(), key=lambda item: -item[1]))
+    print(f"Run report saved to {report_path} ({summary}; peak RSS {report['peak_rss_mb']:.0f} MB)")
+    return report_path
@@ -0,0 +1,211 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def latitude_weights(lat, lon=None):
+    """
+    Cos-latitude area weights.
+
+    Parameters:
+    - lat: numpy.ndarray, latitudes in degrees
+    - lon: numpy.ndarray, optional longitudes; when given the weights are broadcast to (lat, lon)
+
+    Returns:
+    - numpy.ndarray, weights >= 0 (zero at the poles)
+    """
+    weights = np.clip(np.cos(np.deg2rad(np.asarray(lat, dtype=np.float64))), 0.0, None)
+    if lon is not None:
+        weights = np.broadcast_to(weights[:, None], (len(weights), len(lon)))
+    return weights
+
+
+def area_weights(lat, lon, masks=None):
+    """
+    Area weights of one or more regions on a lat/lon grid.
+
+    Parameters:
+    - lat, lon: numpy.ndarray, grid coordinates
+    - masks: dict, optional region name -> boolean (lat, lon) mask (e.g. land, sea, a box);
+      None gives a single global region
+
+    Returns:
+    - names: list of str, region names
+    - weights: numpy.ndarray, shape (region, lat * lon)
+    """
+    weights = latitude_weights(lat, lon).reshape(-1)
+    if masks is None:
+        return ['global'], weights[None, :].copy()
+    names = list(masks)
+    return names, np.stack([weights * np.asarray(masks[name], dtype=bool).reshape(-1) for name in names])
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _weighted_sums_numba(f, o, weights, shift, out):
+        n, npix = f.shape
+        n_regions = weights.shape[0]
+        for i in range(n):
+            for p in range(npix):
+                fv = f[i, p]
+                ov = o[p]
+                if np.isfinite(fv) and np.isfinite(ov):
+                    fv -= shift
+                    ov -= shift
+                    d = abs(fv - ov)
+                    for r in range(n_regions):
+                        w = weights[r, p]
+                        if w != 0.0:
+                            out[0, i, r] += w
+                            out[1, i, r] += w * fv
+                            out[2, i, r] += w * ov
+                            out[3, i, r] += w * fv * fv
+                            out[4, i, r] += w * ov * ov
+                            out[5, i, r] += w * fv * ov
+                            out[6, i, r] += w * d
+        return out
+
+
+class MetricKernel:
+    """
+    Weighted bias, MAE, RMSE and pattern correlation of stacked fields in one pass.
+
+    All seven weighted sums are gathered together per field and region, reusing
+    preallocated buffers between calls; values are shifted by the reference mean first
+    so the moments keep full precision. Fields may be float32, the sums are float64.
+    NaNs on either side drop the pair.
+    """
+
+    SUMS = ('weight', 'f', 'o', 'ff', 'oo', 'fo', 'abs')
+
+    def __init__(self, weights, regions=False, use_numba=None):
+        """
+        Parameters:
+        - weights: numpy.ndarray, (lat, lon) or flat weights, or (region, npix) from area_weights
+        - regions: bool, the first axis of weights enumerates regions
+        - use_numba: bool, use the compiled loop (defaults to True when numba is installed)
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        self.single_region = not regions
+        self.weights = np.ascontiguousarray(weights.reshape(1, -1) if self.single_region else weights)
+        self.use_numba = (numba is not None) if use_numba is None else (use_numba and numba is not None)
+        self.region_names = None
+        self._buffers = {}
+
+    @classmethod
+    def for_grid(cls, lat, lon, masks=None, use_numba=None):
+        """Kernel with cos-latitude weights for a grid and optional region masks."""
+        names, weights = area_weights(lat, lon, masks)
+        kernel = cls(weights, regions=masks is not None, use_numba=use_numba)
+        kernel.region_names = names
+        return kernel
+
+    def _buffer(self, name, shape, dtype=np.float64):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buffer
+        return buffer
+
+    def sums(self, forecasts, actual):
+        """
+        Weighted sums of a stack of forecasts against one reference field.
+
+        Parameters:
+        - forecasts: numpy.ndarray, shape (n, ...) stacked fields on the kernel's grid
+        - actual: numpy.ndarray, one reference field (or a matching stack)
+
+        Returns:
+        - sums: numpy.ndarray, shape (7, n, region) in the order of SUMS
+        - shift: float, value subtracted from both sides before summing
+        """
+        n = forecasts.shape[0]
+        # float32 stacks are not copied; the sums below run in float64 buffers
+        f = np.ascontiguousarray(forecasts.reshape(n, -1), dtype=np.result_type(forecasts.dtype, np.float32))
+        o = np.asarray(actual, dtype=np.float64)
+        o = o.reshape(o.shape[0] if o.ndim == forecasts.ndim else 1, -1)
+        o = o[0] if o.shape[0] == 1 else o
+        finite_o = np.isfinite(o)
+        shift = float(o[finite_o].mean()) if finite_o.any() else 0.0
+
+        n_regions = self.weights.shape[0]
+        out = np.zeros((len(self.SUMS), n, n_regions))
+        if self.use_numba and o.ndim == 1:
+            return _weighted_sums_numba(f, o, self.weights, shift, out), shift
+
+        valid = self._buffer('valid', f.shape, bool)
+        np.isfinite(f, out=valid)
+        valid &= np.isfinite(o)
+        fs = self._buffer('f', f.shape)
+        os_ = self._buffer('o', f.shape)
+        work = self._buffer('work', f.shape)
+        np.subtract(f, shift, out=fs)
+        np.subtract(np.broadcast_to(o, f.shape), shift, out=os_)
+        fs[~valid] = 0.0
+        os_[~valid] = 0.0
+
+        weights_t = self.weights.T
+        out[0] = valid @ weights_t
+        out[1] = fs @ weights_t
+        out[2] = os_ @ weights_t
+        np.multiply(fs, fs, out=work)
+        out[3] = work @ weights_t
+        np.multiply(os_, os_, out=work)
+        out[4] = work @ weights_t
+        np.multiply(fs, os_, out=work)
+        out[5] = work @ weights_t
+        np.subtract(fs, os_, out=work)
+        np.abs(work, out=work)
+        out[6] = work @ weights_t
+        return out, shift
+
+    def moments(self, forecasts, actual):
+        """
+        Means and centred moments in the layout of accumulators.STATE.
+
+        Returns:
+        - dict, arrays of shape (n,) for a single region or (n, region) otherwise
+        """
+        sums, shift = self.sums(forecasts, actual)
+        weight, sf, so, sff, soo, sfo, sabs = sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_f = np.where(weight > 0, sf / weight, 0.0)
+            mean_o = np.where(weight > 0, so / weight, 0.0)
+            mean_abs = np.where(weight > 0, sabs / weight, 0.0)
+        state = {
+            'weight': weight,
+            'mean_f': mean_f + np.where(weight > 0, shift, 0.0),
+            'mean_o': mean_o + np.where(weight > 0, shift, 0.0),
+            'm2_f': np.clip(sff - mean_f * sf, 0.0, None),
+            'm2_o': np.clip(soo - mean_o * so, 0.0, None),
+            'c_fo': sfo - mean_f * so,
+            'mean_abs': mean_abs
+        }
+        if self.single_region:
+            state = {name: values[:, 0] for name, values in state.items()}
+        return state
+
+    def scores(self, forecasts, actual):
+        """
+        Area-weighted scores of each forecast in a stack.
+
+        Returns:
+        - dict, 'bias', 'mae', 'rmse', 'correlation' and 'weight' arrays of shape (n,)
+          or (n, region)
+        """
+        state = self.moments(forecasts, actual)
+        weight = state['weight']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bias = np.where(weight > 0, state['mean_f'] - state['mean_o'], np.nan)
+            error_variance = np.clip((state['m2_f'] + state['m2_o'] - 2 * state['c_fo']) / weight, 0.0, None)
+            correlation = np.where(weight > 0, state['c_fo'] / np.sqrt(state['m2_f'] * state['m2_o']), np.nan)
+        return {
+            'bias': bias,
+            'mae': np.where(weight > 0, state['mean_abs'], np.nan),
+            'rmse': np.sqrt(error_variance + bias ** 2),
+            'correlation': correlation,
+            'weight': weight
+        }
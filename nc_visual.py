@@ -1,36 +1,31 @@
+import os
 import netCDF4 as nc
-import matplotlib.pyplot as plt
 import numpy as np
-import cartopy.crs as ccrs
-
-# File path
-file_path = file_path = "/mnt/datawaha/hyex/beckhe/DATA_PROCESSED/GEFS/Temp/20240920_00/01/3hourly/2024266.00.nc"
-
-# Open the NetCDF file
-dataset = nc.Dataset(file_path)
-
-# Extract variables (you may need to adjust variable names based on your dataset)
-lats = dataset.variables['lat'][:]  # Assuming 'latitude' as the variable name
-lons = dataset.variables['lon'][:]  # Assuming 'longitude' as the variable name
-temperature = dataset.variables['air_temperature'][0, :, :]  # Adjust based on actual variable name and dimensions
-
-# Create a meshgrid for latitude and longitude
-lon_grid, lat_grid = np.meshgrid(lons, lats)
-
-# Plotting
-plt.figure(figsize=(12, 6))
-ax = plt.axes(projection=ccrs.PlateCarree())
-
-# Plot the temperature data
-plt.contourf(lon_grid, lat_grid, temperature, 60, transform=ccrs.PlateCarree(), cmap='coolwarm')
-plt.colorbar(label='Temperature (Degree Celcius)')
-
-# Adding coastlines and title
-ax.coastlines()
-plt.title('Global Temperature Visualization')
-
-# Show the plot
-plt.show()
-
-# Close the dataset
-dataset.close()
\ No newline at end of file
+from render import render_maps
+
+# Files to visualise; every map of the batch shares one color scale
+file_paths = [
+    "/mnt/datawaha/hyex/beckhe/DATA_PROCESSED/GEFS/Temp/20240920_00/01/3hourly/2024266.00.nc",
+]
+variable_name = 'air_temperature'  # Adjust based on actual variable name
+output_dir = '.'  # Maps are saved here as <file name>.png instead of shown
+
+fields = []
+for file_path in file_paths:
+    # Open the NetCDF file
+    with nc.Dataset(file_path) as dataset:
+        # Extract variables (you may need to adjust variable names based on your dataset)
+        lats = dataset.variables['lat'][:]  # Assuming 'latitude' as the variable name
+        lons = dataset.variables['lon'][:]  # Assuming 'longitude' as the variable name
+        temperature = np.ma.filled(dataset.variables[variable_name][0, :, :].astype(np.float32), np.nan)  # Adjust based on actual dimensions
+    fields.append(temperature)
+
+# 60 discrete color bands over the common range, as the former contourf plot
+renderer_kwargs = dict(lat=np.asarray(lats), lon=np.asarray(lons), cmap='coolwarm',
+                       vmin=float(np.nanmin(fields)), vmax=float(np.nanmax(fields)), levels=60,
+                       colorbar_label='Temperature (Degree Celcius)')
+jobs = [(temperature, 'Global Temperature Visualization', os.path.join(output_dir, os.path.basename(file_path).replace('.nc', '.png')))
+        for file_path, temperature in zip(file_paths, fields)]
+
+for path in render_maps(jobs, renderer_kwargs):
+    print(f"Map saved to {path}")
@@ -0,0 +1,176 @@
+import numpy as np
+import xarray as xr
+from handle_pool import default_pool
+from data_io import load_policy, decode_field
+
+
+def _axis_position(axis, values, periodic=False):
+    """
+    Fractional index of each value along a 1-D coordinate axis.
+
+    Regular axes use direct arithmetic, irregular ones a binary search. Periodic axes
+    (global longitudes) are taken modulo 360 relative to their first value.
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if periodic:
+        values = axis[0] + (values - axis[0]) % 360
+    step = np.diff(axis)
+    if np.allclose(step, step[0]):
+        return (values - axis[0]) / step[0]
+    descending = step[0] < 0
+    search_axis = axis[::-1] if descending else axis
+    upper = np.clip(np.searchsorted(search_axis, values), 1, len(axis) - 1)
+    position = upper - 1 + (values - search_axis[upper - 1]) / (search_axis[upper] - search_axis[upper - 1])
+    return len(axis) - 1 - position if descending else position
+
+
+class PointIndex:
+    """
+    Grid indices and weights of a set of points on one lat/lon grid.
+
+    Attributes:
+    - rows, columns: numpy.ndarray, (point, k) grid indices of each point's neighbours
+    - weights: numpy.ndarray, (point, k) interpolation weights (k = 1 nearest, 4 bilinear)
+    """
+
+    def __init__(self, lat, lon, point_lat, point_lon, method='nearest'):
+        """
+        Parameters:
+        - lat, lon: numpy.ndarray, grid coordinates
+        - point_lat, point_lon: numpy.ndarray, point coordinates in degrees
+        - method: str, 'nearest' or 'bilinear'
+        """
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        spacing = abs(lon[1] - lon[0]) if len(lon) > 1 else 360
+        periodic = len(lon) > 1 and abs(len(lon) * spacing - 360) < 1e-6
+        y = np.clip(_axis_position(lat, point_lat), 0, len(lat) - 1)
+        x = _axis_position(lon, point_lon, periodic)
+        x = x if periodic else np.clip(x, 0, len(lon) - 1)
+
+        if method == 'nearest':
+            self.rows = np.rint(y).astype(np.intp)[:, None]
+            self.columns = (np.rint(x).astype(np.intp) % len(lon))[:, None]
+            self.weights = np.ones(self.rows.shape)
+        elif method == 'bilinear':
+            y0 = np.minimum(np.floor(y).astype(np.intp), max(len(lat) - 2, 0))
+            x0 = np.floor(x).astype(np.intp)
+            if not periodic:
+                x0 = np.minimum(x0, max(len(lon) - 2, 0))
+            dy, dx = y - y0, x - x0
+            y1 = np.minimum(y0 + 1, len(lat) - 1)
+            x1 = (x0 + 1) % len(lon) if periodic else np.minimum(x0 + 1, len(lon) - 1)
+            self.rows = np.stack([y0, y0, y1, y1], axis=1)
+            self.columns = np.stack([x0 % len(lon), x1, x0 % len(lon), x1], axis=1)
+            self.weights = np.stack([(1 - dy) * (1 - dx), (1 - dy) * dx, dy * (1 - dx), dy * dx], axis=1)
+        else:
+            raise ValueError(f"Unknown point extraction method: {method}")
+
+        # One orthogonal read of the touched rows and columns serves every point
+        self.read_rows, row_position = np.unique(self.rows, return_inverse=True)
+        self.read_columns, column_position = np.unique(self.columns, return_inverse=True)
+        self.row_position = row_position.reshape(self.rows.shape)
+        self.column_position = column_position.reshape(self.columns.shape)
+
+    def gather(self, block):
+        """
+        Interpolate points from the block of touched rows and columns.
+
+        Parameters:
+        - block: numpy.ndarray, (..., len(read_rows), len(read_columns)) values
+
+        Returns:
+        - numpy.ndarray, (..., point) values; NaN neighbours are left out and the
+          remaining weights renormalised
+        """
+        neighbours = block[..., self.row_position, self.column_position]
+        valid = np.isfinite(neighbours)
+        weights = np.where(valid, self.weights, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (np.where(valid, neighbours, 0.0) * weights).sum(axis=-1) / weights.sum(axis=-1)
+
+
+class PointExtractor:
+    """
+    Extract values at many lat/lon points (stations, cities) from gridded files.
+
+    The point index is built once per grid; each file is then read once, touching
+    only the grid rows and columns the points need.
+    """
+
+    def __init__(self, point_lat, point_lon, names=None, method='nearest', pool=None):
+        """
+        Parameters:
+        - point_lat, point_lon: sequences of float, point coordinates in degrees
+        - names: sequence of str, optional point labels (default: their positions)
+        - method: str, 'nearest' or 'bilinear'
+        - pool: DatasetPool, pool to open files through (defaults to the shared pool)
+        """
+        self.point_lat = np.atleast_1d(np.asarray(point_lat, dtype=np.float64))
+        self.point_lon = np.atleast_1d(np.asarray(point_lon, dtype=np.float64))
+        self.names = list(range(len(self.point_lat))) if names is None else list(names)
+        self.method = method
+        self.pool = pool
+        self.indices = {}
+
+    def index(self, lat, lon):
+        """PointIndex of the points on a grid (cached per grid)."""
+        key = (lat.size, float(lat[0]), float(lat[-1]), lon.size, float(lon[0]), float(lon[-1]))
+        if key not in self.indices:
+            self.indices[key] = PointIndex(lat, lon, self.point_lat, self.point_lon, self.method)
+        return self.indices[key]
+
+    def extract(self, file_path, variable_name):
+        """
+        Values of every point in one file.
+
+        Parameters:
+        - file_path: str, path to the NetCDF file
+        - variable_name: str, variable to read
+
+        Returns:
+        - numpy.ndarray, (..., point) values
+
+        Raises:
+        - FileNotFoundError, if the file does not exist
+        """
+        pool = default_pool() if self.pool is None else self.pool
+        with pool.dataset(file_path, mask_and_scale=False) as dataset:
+            point_index = self.index(dataset['lat'].values, dataset['lon'].values)
+            block = dataset[variable_name].squeeze().isel(lat=point_index.read_rows, lon=point_index.read_columns)
+            block = decode_field(block, load_policy(variable_name)).values
+        return point_index.gather(block)
+
+    def extract_campaign(self, catalog, inits=None, leads=None, members=None):
+        """
+        Point values of a whole forecast campaign of one model.
+
+        Parameters:
+        - catalog: catalog.ModelCatalog, files of one model and parameter
+        - inits, leads, members: lists restricting the campaign (default: everything indexed)
+
+        Returns:
+        - xarray.DataArray, (point, member, lead, init), NaN where a file is missing
+        """
+        inits = catalog.inits if inits is None else list(inits)
+        leads = catalog.leads if leads is None else list(leads)
+        members = catalog.members if members is None else list(members)
+        values = np.full((len(self.names), len(members), len(leads), len(inits)), np.nan, dtype=np.float32)
+        for k, init_date in enumerate(inits):
+            for j, lead in enumerate(leads):
+                for i, member in enumerate(members):
+                    file_path = catalog.path(init_date, lead, member)
+                    if file_path is None:
+                        continue
+                    try:
+                        values[:, i, j, k] = self.extract(file_path, catalog.variable_name)
+                    except FileNotFoundError:
+                        print(f"File not found: {file_path} for model '{catalog.model_name}'.")
+        return xr.DataArray(
+            values,
+            dims=('point', 'member', 'lead', 'init'),
+            coords={'point': self.names, 'member': members, 'lead': leads, 'init': np.array(inits, dtype='datetime64[ns]'),
+                    'point_lat': ('point', self.point_lat), 'point_lon': ('point', self.point_lon)},
+            name=catalog.variable_name,
+            attrs={'model': catalog.model_name, 'parameter': catalog.parameter, 'method': self.method}
+        )
@@ -0,0 +1,139 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import config
+import instrument
+from data_io import load_field
+
+
+class Prefetcher:
+    """
+    Read the planned files of a run ahead of the code that scores them.
+
+    A small thread pool keeps the next files of the schedule loading while the
+    current fields are scored, bounded by a number of files and by the memory of the
+    fields waiting to be consumed. Files are requested by key; keys the consumer
+    skips (e.g. fields taken from the results store) are dropped from the window, and
+    a key requested again after it was passed is read directly.
+    """
+
+    def __init__(self, schedule=(), load=load_field, depth=None, max_mb=None, threads=None):
+        """
+        Parameters:
+        - schedule: list of (key, args), in the order the keys will be requested;
+          `load(*args)` reads one entry (e.g. (path, (path, variable_name)))
+        - load: callable, reader run in the threads (defaults to data_io.load_field)
+        - depth: int, files read ahead (defaults to config['prefetch_depth']; 0 reads on demand)
+        - max_mb: float, budget for fields loaded or loading but not yet consumed
+          (defaults to config['prefetch_mb'])
+        - threads: int, reader threads (defaults to config['prefetch_threads'])
+        """
+        self.schedule = list(schedule)
+        self.position = {key: i for i, (key, _) in enumerate(self.schedule)}
+        self.load = load
+        self.depth = config.config['prefetch_depth'] if depth is None else depth
+        self.max_bytes = (config.config['prefetch_mb'] if max_mb is None else max_mb) * 1024 ** 2
+        threads = config.config['prefetch_threads'] if threads is None else threads
+        self.executor = ThreadPoolExecutor(max_workers=threads) if self.depth > 0 else None
+        self.window = deque()  # (key, future) of the submitted entries, in schedule order
+        self.next_index = 0
+        self.field_bytes = 0  # Largest field seen so far, the estimate for entries still loading
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.waits = 0
+        self.direct = 0
+        self.dropped = 0
+
+    def _load(self, args):
+        with instrument.stage('prefetch'):
+            result = self.load(*args)
+        with self.lock:
+            self.field_bytes = max(self.field_bytes, getattr(result, 'nbytes', 0))
+        return result
+
+    def _fill(self):
+        """Submit schedule entries until the depth or the memory budget is reached."""
+        while self.next_index < len(self.schedule) and len(self.window) < self.depth:
+            with self.lock:
+                pending_bytes = (len(self.window) + 1) * self.field_bytes
+            if self.window and pending_bytes > self.max_bytes:
+                break
+            key, args = self.schedule[self.next_index]
+            self.window.append((key, self.executor.submit(self._load, args)))
+            self.next_index += 1
+
+    def get(self, key):
+        """
+        Return the loaded entry for a key, waiting for its read if needed.
+
+        Raises:
+        - KeyError, if the key is not in the schedule
+        - whatever the reader raised for this entry (e.g. FileNotFoundError)
+        """
+        index = self.position[key]
+        if self.executor is None or index < self.next_index - len(self.window):
+            self.direct += 1
+            return self.load(*self.schedule[index][1])
+
+        # Entries before the requested one were skipped by the consumer
+        while self.window and self.window[0][0] != key:
+            _, future = self.window.popleft()
+            future.cancel()
+            self.dropped += 1
+        if not self.window:
+            self.dropped += index - self.next_index
+            self.next_index = index
+            self._fill()
+
+        _, future = self.window.popleft()
+        if future.done():
+            self.hits += 1
+        else:
+            self.waits += 1
+        self._fill()
+        return future.result()
+
+    def start(self):
+        """Begin reading ahead before the first request."""
+        if self.executor is not None:
+            self._fill()
+        return self
+
+    def close(self):
+        """Cancel outstanding reads and stop the threads."""
+        if self.executor is not None:
+            for _, future in self.window:
+                future.cancel()
+            self.window.clear()
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        """
+        Counters for judging the read-ahead.
+
+        Returns:
+        - dict, reads already done when requested (hits), reads waited for, direct reads
+          and skipped entries
+        """
+        return {'hits': self.hits, 'waits': self.waits, 'direct': self.direct, 'dropped': self.dropped}
+
+    def report(self):
+        """Print the read-ahead counters."""
+        stats = self.stats()
+        print(f"Prefetch: {stats['hits']} ready, {stats['waits']} waited, {stats['direct']} direct, {stats['dropped']} skipped")
+
+
+def field_schedule(tasks, models, parameter):
+    """
+    Read schedule of the forecast files of planned tasks, in task order.
+
+    Returns:
+    - list of (model path, (model path, variable name))
+    """
+    return [(task['model_path'], (task['model_path'], models[task['model']]['variable_names'][parameter])) for task in tasks]
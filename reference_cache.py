@@ -0,0 +1,139 @@
+import os
+import tempfile
+from collections import OrderedDict
+import xarray as xr
+import config
+from data_io import reference_file_path, load_field, load_policy, policy_digest, julian_day_str
+
+
+class ReferenceCache:
+    """
+    LRU cache of reference fields keyed by (reference dataset, parameter, valid date).
+
+    Fields evicted from memory can optionally be spilled to disk so that a later
+    request reloads the decoded field instead of going back to the archive. Spill
+    files are named after the source file's mtime and the load policy, so a rewritten
+    reference or a changed policy never reuses an old spill.
+    """
+
+    def __init__(self, max_mb=None, spill_dir=None, reference_data=None):
+        """
+        Parameters:
+        - max_mb: float, memory budget in MB (defaults to config['reference_cache_mb'])
+        - spill_dir: str, directory for spilled fields; None disables spilling
+        - reference_data: dict, reference config (defaults to config.reference_data)
+        """
+        max_mb = config.config['reference_cache_mb'] if max_mb is None else max_mb
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.spill_dir = spill_dir
+        self.reference_data = config.reference_data if reference_data is None else reference_data
+        self.fields = OrderedDict()
+        self.missing = set()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.evictions = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        """
+        Spill file of a cached field, or None if its reference file is gone.
+        """
+        reference_name, parameter, valid_date = key
+        try:
+            mtime_ns = os.stat(reference_file_path(reference_name, parameter, valid_date, self.reference_data)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        digest = policy_digest(load_policy(self.reference_data[reference_name]['variable_names'][parameter]))
+        return os.path.join(self.spill_dir, f"{reference_name}_{parameter}_{julian_day_str(valid_date)}_{mtime_ns}_{digest}.nc")
+
+    def get(self, reference_name, parameter, valid_date):
+        """
+        Return the reference field for a valid date, reading it at most once.
+
+        Parameters:
+        - reference_name: str, key in the `reference_data` config
+        - parameter: str, parameter name
+        - valid_date: datetime, day to verify against
+
+        Returns:
+        - xarray.DataArray, reference field loaded in memory
+
+        Raises:
+        - FileNotFoundError, if the reference file does not exist
+        """
+        key = (reference_name, parameter, valid_date)
+        if key in self.fields:
+            self.hits += 1
+            self.fields.move_to_end(key)
+            return self.fields[key]
+
+        reference_path = reference_file_path(reference_name, parameter, valid_date, self.reference_data)
+        if key in self.missing:
+            self.hits += 1
+            raise FileNotFoundError(f"File not found: {reference_path}")
+
+        spill_path = self._spill_path(key) if self.spill_dir is not None else None
+        if spill_path is not None and os.path.exists(spill_path):
+            self.spill_hits += 1
+            with xr.open_dataarray(spill_path) as spilled:
+                field = spilled.load()
+        else:
+            self.misses += 1
+            variable_name = self.reference_data[reference_name]['variable_names'][parameter]
+            try:
+                field = load_field(reference_path, variable_name)
+            except FileNotFoundError:
+                self.missing.add(key)
+                raise
+
+        self.fields[key] = field
+        self.nbytes += field.nbytes
+        self._evict()
+        return field
+
+    def _evict(self):
+        """Drop least recently used fields until the cache fits its budget."""
+        while self.nbytes > self.max_bytes and len(self.fields) > 1:
+            key, field = self.fields.popitem(last=False)
+            self.nbytes -= field.nbytes
+            self.evictions += 1
+            spill_path = self._spill_path(key) if self.spill_dir is not None else None
+            if spill_path is not None and not os.path.exists(spill_path):
+                # Written aside and renamed, so other processes never open a partial file
+                handle, temp_path = tempfile.mkstemp(suffix='.nc', dir=self.spill_dir)
+                os.close(handle)
+                field.to_netcdf(temp_path)
+                os.replace(temp_path, spill_path)
+
+    def stats(self):
+        """
+        Counters for confirming reference I/O.
+
+        Returns:
+        - dict, hits, misses (archive reads), spill hits, evictions and cached size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'spill_hits': self.spill_hits,
+            'evictions': self.evictions,
+            'cached_fields': len(self.fields),
+            'cached_mb': self.nbytes / 1024 ** 2
+        }
+
+    def report(self):
+        """Print the cache counters."""
+        stats = self.stats()
+        print(f"Reference cache: {stats['misses']} reads, {stats['hits']} hits, {stats['spill_hits']} spill hits, "
+              f"{stats['evictions']} evictions, {stats['cached_fields']} fields ({stats['cached_mb']:.1f} MB) cached")
+
+
+def default_reference_cache(reference_data=None):
+    """
+    Build a reference cache from the settings in config.py.
+    """
+    spill_dir = os.path.join(config.config['dir_temp'], 'reference_cache') if config.config['reference_cache_spill'] else None
+    return ReferenceCache(spill_dir=spill_dir, reference_data=reference_data)
@@ -0,0 +1,171 @@
+import os
+import tempfile
+import hashlib
+import numpy as np
+import xarray as xr
+import scipy.sparse as sp
+import config
+
+# Weights already built in this process, keyed like the files on disk
+_weights_cache = {}
+
+
+def _linear_weights_1d(source, target):
+    """
+    Sparse 1-D linear interpolation matrix (target x source); out-of-range rows stay empty.
+    """
+    order = np.argsort(source)
+    sorted_source = source[order]
+    upper = np.clip(np.searchsorted(sorted_source, target, side='right'), 1, len(source) - 1)
+    lower = upper - 1
+    span = sorted_source[upper] - sorted_source[lower]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        alpha = np.where(span > 0, (target - sorted_source[lower]) / span, 0.0)
+    inside = (target >= sorted_source[0]) & (target <= sorted_source[-1])
+
+    rows = np.flatnonzero(inside)
+    rows = np.concatenate([rows, rows])
+    cols = np.concatenate([order[lower[inside]], order[upper[inside]]])
+    values = np.concatenate([1.0 - alpha[inside], alpha[inside]])
+    keep = values != 0
+    return sp.csr_matrix((values[keep], (rows[keep], cols[keep])), shape=(len(target), len(source)))
+
+
+def _cell_edges(centers, lower_bound=None, upper_bound=None):
+    """Cell edges halfway between centres, extended by half a cell at both ends."""
+    order = np.argsort(centers)
+    c = centers[order]
+    edges = np.concatenate([[c[0] - (c[1] - c[0]) / 2], (c[1:] + c[:-1]) / 2, [c[-1] + (c[-1] - c[-2]) / 2]])
+    if lower_bound is not None:
+        edges = np.clip(edges, lower_bound, upper_bound)
+    return order, edges
+
+
+def _conservative_weights_1d(source, target, is_latitude):
+    """
+    Sparse 1-D overlap matrix (target x source), normalised by each target cell's covered size.
+
+    Latitude overlaps are measured in sin(lat) so rows carry their true area share.
+    """
+    bounds = (-90.0, 90.0) if is_latitude else (None, None)
+    source_order, source_edges = _cell_edges(source, *bounds)
+    target_order, target_edges = _cell_edges(target, *bounds)
+    if is_latitude:
+        source_edges = np.sin(np.deg2rad(source_edges))
+        target_edges = np.sin(np.deg2rad(target_edges))
+
+    lo = np.maximum(target_edges[:-1, None], source_edges[None, :-1])
+    hi = np.minimum(target_edges[1:, None], source_edges[None, 1:])
+    overlap = np.clip(hi - lo, 0.0, None)
+    covered = overlap.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overlap = np.where(covered > 0, overlap / covered, 0.0)
+
+    weights = np.zeros((len(target), len(source)))
+    weights[np.ix_(target_order, source_order)] = overlap
+    return sp.csr_matrix(weights)
+
+
+def _weights_key(source_lat, source_lon, target_lat, target_lon, method):
+    digest = hashlib.sha1(method.encode())
+    for axis in (source_lat, source_lon, target_lat, target_lon):
+        digest.update(np.ascontiguousarray(axis, dtype=np.float64).tobytes())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def regrid_weights(source_lat, source_lon, target_lat, target_lon, method='linear', cache_dir=None):
+    """
+    Sparse regridding matrix from a source lat/lon grid to a target grid.
+
+    Weights are built once per (source grid, target grid, method) and persisted, so
+    later runs only load them.
+
+    Parameters:
+    - source_lat, source_lon: numpy.ndarray, 1-D coordinates of the source grid
+    - target_lat, target_lon: numpy.ndarray, 1-D coordinates of the target grid
+    - method: str, 'linear' (bilinear, like interp_like) or 'conservative' (area-weighted)
+    - cache_dir: str, weight directory (defaults to config['dir_temp']/regrid_weights)
+
+    Returns:
+    - scipy.sparse.csr_matrix, shape (target cells, source cells)
+    """
+    key = _weights_key(source_lat, source_lon, target_lat, target_lon, method)
+    if key in _weights_cache:
+        return _weights_cache[key]
+
+    cache_dir = os.path.join(config.config['dir_temp'], 'regrid_weights') if cache_dir is None else cache_dir
+    weights_file = os.path.join(cache_dir, f"{method}_{key}.npz")
+    if os.path.exists(weights_file):
+        weights = sp.load_npz(weights_file).tocsr()
+    else:
+        source_lat, source_lon = np.asarray(source_lat, dtype=np.float64), np.asarray(source_lon, dtype=np.float64)
+        target_lat, target_lon = np.asarray(target_lat, dtype=np.float64), np.asarray(target_lon, dtype=np.float64)
+        if method == 'linear':
+            weights_lat = _linear_weights_1d(source_lat, target_lat)
+            weights_lon = _linear_weights_1d(source_lon, target_lon)
+        elif method == 'conservative':
+            weights_lat = _conservative_weights_1d(source_lat, target_lat, is_latitude=True)
+            weights_lon = _conservative_weights_1d(source_lon, target_lon, is_latitude=False)
+        else:
+            raise ValueError(f"Unknown regridding method: {method}")
+        weights = sp.kron(weights_lat, weights_lon, format='csr')
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written aside and renamed, so workers checking for the file never load a partial one
+        handle, temp_path = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+        os.close(handle)
+        sp.save_npz(temp_path, weights)
+        os.replace(temp_path, weights_file)
+
+    _weights_cache[key] = weights
+    return weights
+
+
+def regrid_stack(fields, source_lat, source_lon, target_lat, target_lon, method='linear'):
+    """
+    Regrid a stack of fields with one sparse matrix multiply.
+
+    Parameters:
+    - fields: numpy.ndarray, shape (n, source lat, source lon)
+    - source_lat, source_lon, target_lat, target_lon: numpy.ndarray, grid coordinates
+    - method: str, 'linear' or 'conservative'
+
+    Returns:
+    - numpy.ndarray, shape (n, target lat, target lon); NaN outside the source grid. The
+      weighted sums run in float64 and float32 fields come back as float32
+    """
+    weights = regrid_weights(source_lat, source_lon, target_lat, target_lon, method)
+    n = fields.shape[0]
+    columns = fields.reshape(n, -1).T
+
+    if method == 'conservative':
+        # Renormalise by the valid source area so missing cells do not poison a target cell
+        valid = np.isfinite(columns)
+        total = weights @ np.where(valid, columns, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = total / (weights @ valid.astype(np.float64))
+    else:
+        out = weights @ columns
+        out[np.asarray(weights.sum(axis=1)).ravel() == 0] = np.nan
+    return out.T.reshape(n, len(target_lat), len(target_lon)).astype(np.result_type(fields.dtype, np.float32), copy=False)
+
+
+def regrid_like(field, target, method='linear'):
+    """
+    Drop-in replacement for `field.interp_like(target)` using cached weights.
+
+    Parameters:
+    - field: xarray.DataArray, with 'lat' and 'lon' as its last two dimensions
+    - target: xarray.DataArray, field on the destination grid
+    - method: str, 'linear' or 'conservative'
+
+    Returns:
+    - xarray.DataArray, field on the target grid
+    """
+    leading = field.dims[:-2]
+    values = field.values.reshape((-1,) + field.shape[-2:])
+    out = regrid_stack(values, field['lat'].values, field['lon'].values, target['lat'].values, target['lon'].values, method)
+    coords = {dim: field[dim] for dim in leading if dim in field.coords}
+    coords.update({'lat': target['lat'], 'lon': target['lon']})
+    return xr.DataArray(out.reshape(field.shape[:-2] + out.shape[1:]), dims=leading + ('lat', 'lon'),
+                        coords=coords, name=field.name, attrs=field.attrs)
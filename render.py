@@ -0,0 +1,144 @@
+import os
+import matplotlib
+matplotlib.use('Agg')  # Batch rendering never needs a display
+import matplotlib.pyplot as plt
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import config
+
+
+class MapRenderer:
+    """
+    Reusable global map figure for rendering many fields on one grid.
+
+    The figure, projection, coastlines, borders and colorbar are built once; each
+    render only swaps the mesh data and the title before saving, so a batch of maps
+    costs one rasterisation each instead of a full figure rebuild.
+    """
+
+    def __init__(self, lat, lon, cmap='viridis', vmin=None, vmax=None, levels=None, colorbar_label=None,
+                 legend_handles=None, legend_title=None, land=False, figsize=(14, 8), dpi=150):
+        """
+        Parameters:
+        - lat, lon: numpy.ndarray, grid coordinates of every field to render
+        - cmap: str or Colormap
+        - vmin, vmax: float, fixed color range (keeps maps of a batch comparable)
+        - levels: int or sequence, optional discrete color levels (like contourf bands)
+        - colorbar_label: str, adds a colorbar when given
+        - legend_handles, legend_title: optional legend (e.g. model color patches)
+        - land: bool, draw land and ocean fills under the data
+        - figsize, dpi: figure size and output resolution
+        """
+        self.dpi = dpi
+        norm = None
+        if levels is not None:
+            boundaries = np.linspace(vmin, vmax, levels + 1) if np.isscalar(levels) else np.asarray(levels)
+            norm = matplotlib.colors.BoundaryNorm(boundaries, plt.get_cmap(cmap).N if isinstance(cmap, str) else cmap.N)
+            vmin = vmax = None
+
+        self.fig = plt.figure(figsize=figsize, dpi=dpi)
+        self.ax = self.fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+        self.ax.set_global()
+        if land:
+            self.ax.add_feature(cfeature.OCEAN, facecolor='aqua', zorder=0)
+            self.ax.add_feature(cfeature.LAND, facecolor='lightgray', zorder=0)
+        self.ax.coastlines(linewidth=0.8)
+        self.ax.add_feature(cfeature.BORDERS, linewidth=0.5)
+        self.mesh = self.ax.pcolormesh(lon, lat, np.full((len(lat), len(lon)), np.nan), transform=ccrs.PlateCarree(),
+                                       cmap=cmap, norm=norm, vmin=vmin, vmax=vmax, shading='auto')
+        if colorbar_label is not None:
+            self.fig.colorbar(self.mesh, ax=self.ax, label=colorbar_label, shrink=0.8)
+        if legend_handles is not None:
+            self.ax.legend(handles=legend_handles, loc='lower left', title=legend_title)
+        self.title = self.ax.set_title('', fontsize=12)
+
+    def render(self, values, title, output_path, tile_size=None):
+        """
+        Draw one field and save it.
+
+        Parameters:
+        - values: numpy.ndarray, (lat, lon) field; NaN or masked cells are left blank
+        - title: str, figure title
+        - output_path: str, image file (format from the extension)
+        - tile_size: int, optional; also cut the image into square tiles of this many pixels
+
+        Returns:
+        - str, path written
+        """
+        self.mesh.set_array(np.ma.masked_invalid(values).ravel())
+        self.title.set_text(title)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        if tile_size is None:
+            self.fig.savefig(output_path, dpi=self.dpi)
+        else:
+            # Rasterise once and cut the tiles from the same pixels
+            self.fig.canvas.draw()
+            image = np.asarray(self.fig.canvas.buffer_rgba())
+            plt.imsave(output_path, image)
+            save_tiles(image, output_path, tile_size)
+        return output_path
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def save_tiles(image, output_path, tile_size):
+    """
+    Cut an RGBA image into square tiles next to the full image.
+
+    Tiles are written to `<output stem>_tiles/<row>_<column>.<ext>` in the format of the
+    full image (e.g. PNG or WebP).
+
+    Returns:
+    - str, tile directory
+    """
+    stem, extension = os.path.splitext(output_path)
+    tile_dir = f"{stem}_tiles"
+    os.makedirs(tile_dir, exist_ok=True)
+    for row in range(0, image.shape[0], tile_size):
+        for column in range(0, image.shape[1], tile_size):
+            tile_path = os.path.join(tile_dir, f"{row // tile_size}_{column // tile_size}{extension}")
+            plt.imsave(tile_path, image[row:row + tile_size, column:column + tile_size])
+    return tile_dir
+
+
+_worker_renderer = None
+
+
+def _start_worker(renderer_kwargs):
+    global _worker_renderer
+    _worker_renderer = MapRenderer(**renderer_kwargs)
+
+
+def _render_job(job):
+    values, title, output_path, tile_size = job
+    return _worker_renderer.render(values, title, output_path, tile_size)
+
+
+def render_maps(jobs, renderer_kwargs, workers=None, tile_size=None):
+    """
+    Render a batch of maps that share a grid and color scheme.
+
+    Each worker process builds one MapRenderer and reuses it for all of its maps.
+
+    Parameters:
+    - jobs: list of (values, title, output_path)
+    - renderer_kwargs: dict, MapRenderer arguments (grid, colors, legend, ...)
+    - workers: int, processes to render with (defaults to config['workers']; 1 renders in this process)
+    - tile_size: int, optional tile size passed to MapRenderer.render
+
+    Returns:
+    - list of str, paths written
+    """
+    workers = config.config['workers'] if workers is None else workers
+    jobs = [(values, title, output_path, tile_size) for values, title, output_path in jobs]
+    if workers <= 1 or len(jobs) <= 1:
+        renderer = MapRenderer(**renderer_kwargs)
+        try:
+            return [renderer.render(*job) for job in jobs]
+        finally:
+            renderer.close()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker, initargs=(renderer_kwargs,)) as executor:
+        return list(executor.map(_render_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
@@ -0,0 +1,375 @@
+import os
+import threading
+import numpy as np
+import xarray as xr
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import config
+from catalog import scan_model, model_layout, DAILY_FILE, DETERMINISTIC_MEMBER
+from data_io import load_policy, decode_field
+from handle_pool import default_pool
+from results_store import file_signature
+
+# Days since this date encode the init coordinate of a store
+TIME_UNITS = 'days since 1970-01-01'
+
+
+def store_path(model_name, parameter, store_dir=None):
+    """
+    Path of the repacked store of one model and parameter.
+
+    Returns:
+    - str, `{store_dir}/{model}/{parameter}.nc` (store_dir defaults to config['dir_repacked'])
+    """
+    store_dir = config.config['dir_repacked'] if store_dir is None else store_dir
+    return os.path.join(store_dir, model_name, f"{parameter}.nc")
+
+
+def parse_model_path(file_path, models=None):
+    """
+    Recover what a daily model file holds from its path.
+
+    Returns:
+    - (model, parameter, init date, member label, lead), or None for paths outside the
+      model layouts of config.py
+    """
+    models = config.models if models is None else models
+    for model_name, details in models.items():
+        data_path = os.path.normpath(details['data_path'])
+        if not file_path.startswith(data_path + os.sep):
+            continue
+        layout = model_layout(model_name, models)
+        parts = os.path.relpath(file_path, data_path).split(os.sep)
+        prefix = len(layout['prefix'])
+        expected = prefix + 1 + (layout['member_width'] is not None) + len(layout['suffix']) + 1
+        match = DAILY_FILE.match(parts[-1])
+        if len(parts) != expected or match is None or '{parameter}' not in ''.join(layout['prefix']):
+            return None
+        parameter = parts[next(i for i, part in enumerate(layout['prefix']) if '{parameter}' in part)]
+        init_date = datetime.strptime(parts[prefix][:8], "%Y%m%d")
+        member = parts[prefix + 1] if layout['member_width'] is not None else DETERMINISTIC_MEMBER
+        valid_date = datetime.strptime(match.group(1), "%Y%j")
+        return model_name, parameter, init_date, member, (valid_date - init_date).days
+    return None
+
+
+def _read_daily(job):
+    """Read one daily field as float32 with the file's mtime_ns; None if the file is missing."""
+    path, variable_name = job
+    if path is None:
+        return None
+    # Each daily file is read once, so it is closed right away instead of kept in the pool
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        with xr.open_dataset(path, mask_and_scale=False) as dataset:
+            field = decode_field(dataset[variable_name].squeeze(), load_policy(variable_name))
+            return field.values.astype(np.float32, copy=False), field['lat'].values, field['lon'].values, mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _create_store(path, variable_name, leads, members, lat, lon, chunks):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    store = netCDF4.Dataset(path, 'w', format='NETCDF4')
+    store.createDimension('init', None)
+    store.createDimension('lead', len(leads))
+    store.createDimension('member', len(members))
+    store.createDimension('lat', len(lat))
+    store.createDimension('lon', len(lon))
+    init = store.createVariable('init', 'i4', ('init',))
+    init.units = TIME_UNITS
+    init.calendar = 'standard'
+    store.createVariable('lead', 'i2', ('lead',))[:] = leads
+    store.createVariable('member', str, ('member',))[:] = np.array(members, dtype=object)
+    store.createVariable('lat', 'f8', ('lat',))[:] = lat
+    store.createVariable('lon', 'f8', ('lon',))[:] = lon
+    chunk_sizes = [chunks.get('init', 1), chunks.get('lead', 1), chunks.get('member', 1),
+                   min(chunks.get('lat', len(lat)), len(lat)), min(chunks.get('lon', len(lon)), len(lon))]
+    dimensions = ('init', 'lead', 'member', 'lat', 'lon')
+    packed = load_policy(variable_name)['packed']
+    if packed:
+        # Integer storage; netCDF4 packs the float blocks on write
+        dtype = np.dtype(packed['dtype'])
+        variable = store.createVariable(variable_name, dtype, dimensions, zlib=True, complevel=1, shuffle=True,
+                                        chunksizes=chunk_sizes, fill_value=np.iinfo(dtype).min)
+        variable.scale_factor = np.float32(packed['scale_factor'])
+        variable.add_offset = np.float32(packed.get('add_offset', 0.0))
+    else:
+        store.createVariable(variable_name, 'f4', dimensions, zlib=True, complevel=1,
+                             shuffle=True, chunksizes=chunk_sizes, fill_value=np.float32(np.nan))
+    # Which slots hold a field (a NaN field and a missing file are told apart)
+    store.createVariable('present', 'i1', ('init', 'lead', 'member'), fill_value=False)
+    # mtime_ns of the daily file each slot was copied from; identifies the field in results-store keys
+    store.createVariable('source_mtime', 'i8', ('init', 'lead', 'member'), fill_value=np.int64(0))
+    return store
+
+
+def repack_model(model_name, parameter, models=None, store_dir=None, chunks=None, threads=None):
+    """
+    Copy the daily files of one model and parameter into its chunked NetCDF4 store.
+
+    The store holds (init, lead, member, lat, lon) float32 fields compressed with zlib
+    (or integers, when the parameter's load policy in config.variables sets `packed`);
+    `init` is unlimited, so a later call only appends the init dates not yet in the
+    store. Leads run from 1 to the model's `availability` max_horizon (or the longest
+    lead found) and the members are those of the first repack. The daily files of an
+    init date are read in a thread pool and written as one block.
+
+    Parameters:
+    - model_name, parameter: str
+    - models: dict, model config (defaults to config.models)
+    - store_dir: str, defaults to config['dir_repacked']
+    - chunks: dict, chunk size per dimension (defaults to config['repack_chunks']; 1 when absent)
+    - threads: int, reader threads (defaults to config['prefetch_threads'])
+
+    Returns:
+    - int, number of init dates appended
+    """
+    models = config.models if models is None else models
+    chunks = config.config['repack_chunks'] if chunks is None else chunks
+    threads = config.config['prefetch_threads'] if threads is None else threads
+    catalog = scan_model(model_name, parameter, models)
+    path = store_path(model_name, parameter, store_dir)
+    if not catalog.files:
+        print(f"{model_name} {parameter}: no daily files to repack")
+        return 0
+
+    if os.path.exists(path):
+        # HDF5 refuses to append to a file this process still holds open for reading
+        default_pool().forget(path)
+        store = netCDF4.Dataset(path, 'a')
+        leads = [int(lead) for lead in store['lead'][:]]
+        members = list(store['member'][:])
+        stored = set(netCDF4.num2date(store['init'][:], TIME_UNITS, only_use_cftime_datetimes=False,
+                                      only_use_python_datetimes=True)) if len(store.dimensions['init']) else set()
+    else:
+        max_lead = config.availability.get(model_name, {}).get('max_horizon', max(catalog.leads))
+        leads = list(range(1, max(max_lead, max(catalog.leads)) + 1))
+        members = catalog.members
+        sample = _read_daily((next(iter(catalog.files.values())), catalog.variable_name))
+        store = _create_store(path, catalog.variable_name, leads, members, sample[1], sample[2], chunks)
+        stored = set()
+
+    new_inits = [init_date for init_date in catalog.inits if init_date not in stored]
+    skipped_members = set(catalog.members) - set(members)
+    if skipped_members:
+        print(f"{model_name} {parameter}: members {sorted(skipped_members)} are not in the store and are skipped")
+    try:
+        variable = store[catalog.variable_name]
+        shape = (len(leads), len(members)) + variable.shape[3:]
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for init_date in new_inits:
+                jobs = [(catalog.path(init_date, lead, member), catalog.variable_name) for lead in leads for member in members]
+                block = np.full(shape, np.nan, dtype=np.float32)
+                present = np.zeros(shape[:2], dtype=np.int8)
+                source_mtime = np.zeros(shape[:2], dtype=np.int64)
+                for k, field in enumerate(executor.map(_read_daily, jobs)):
+                    if field is not None:
+                        block[k // len(members), k % len(members)] = field[0]
+                        present[k // len(members), k % len(members)] = 1
+                        source_mtime[k // len(members), k % len(members)] = field[3]
+                n = len(store.dimensions['init'])
+                store['init'][n] = netCDF4.date2num(init_date, TIME_UNITS)
+                # Masked slots are written as the fill value (NaN is not representable when packed)
+                missing = np.isnan(block)
+                variable[n] = np.ma.masked_array(np.where(missing, 0, block), mask=missing)
+                store['present'][n] = present
+                if 'source_mtime' in store.variables:  # Absent from stores written before it was added
+                    store['source_mtime'][n] = source_mtime
+                store.sync()
+    finally:
+        store.close()
+    print(f"{model_name} {parameter}: appended {len(new_inits)} init dates to {path}")
+    return len(new_inits)
+
+
+def _repack_job(job):
+    return repack_model(*job)
+
+
+def repack_archive(parameters, model_names=None, models=None, store_dir=None, workers=None):
+    """
+    Repack every (model, parameter) store, one process per store.
+
+    Parameters:
+    - parameters: list of str, parameter names
+    - model_names: list of str, models to repack (default: all of config.models)
+    - models: dict, model config (defaults to config.models)
+    - store_dir: str, defaults to config['dir_repacked']
+    - workers: int, processes (defaults to config['workers'])
+
+    Returns:
+    - dict, (model, parameter) -> init dates appended
+    """
+    models = config.models if models is None else models
+    workers = config.config['workers'] if workers is None else workers
+    model_names = list(models) if model_names is None else model_names
+    jobs = [(model_name, parameter, models, store_dir) for parameter in parameters for model_name in model_names
+            if parameter in models[model_name]['predictors']]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            appended = list(executor.map(_repack_job, jobs))
+    else:
+        appended = [_repack_job(job) for job in jobs]
+    return {(job[0], job[1]): count for job, count in zip(jobs, appended)}
+
+
+class RepackedStore:
+    """
+    Index of one repacked store: where each (init, lead, member) field sits.
+
+    `signature` identifies the version of the store file the index was read from, and
+    changes on every append; `field_stamp` identifies one field and does not.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Taken before reading, so a write during the read shows as a newer store
+        self.signature = file_signature(path)
+        # Read through xarray (and its HDF5 lock): prefetch threads may be reading other files
+        with default_pool().dataset(path, mask_and_scale=False) as dataset:
+            inits = dataset['init'].values.astype('datetime64[us]').astype(object)
+            self.inits = {init_date: i for i, init_date in enumerate(inits)}
+            self.leads = {int(lead): i for i, lead in enumerate(dataset['lead'].values)}
+            self.members = {str(member): i for i, member in enumerate(dataset['member'].values)}
+            self.lat, self.lon = dataset['lat'].values, dataset['lon'].values
+            self.present = dataset['present'].values.astype(bool)
+            self.source_mtime = dataset['source_mtime'].values if 'source_mtime' in dataset else None
+
+    def position(self, init_date, lead, member):
+        """Index of a field in the store, or None if the store does not hold it."""
+        i, k = self.inits.get(init_date), self.leads.get(lead)
+        j = self.members.get(member, 0 if member == DETERMINISTIC_MEMBER and len(self.members) == 1 else None)
+        if i is None or j is None or k is None or not self.present[i, k, j]:
+            return None
+        return i, k, j
+
+    def field_stamp(self, position):
+        """
+        Version of one stored field, unchanged when other init dates are appended.
+
+        Returns:
+        - str, the mtime_ns of the daily file the field was copied from; the store
+          signature for stores written without per-field mtimes
+        """
+        if self.source_mtime is None:
+            return self.signature
+        return f"{int(self.source_mtime[position])}@repacked"
+
+    def fields(self):
+        """
+        Every field the store holds.
+
+        Returns:
+        - set of (init datetime, lead, member label)
+        """
+        inits, leads, members = list(self.inits), list(self.leads), list(self.members)
+        return {(inits[i], leads[k], members[j]) for i, k, j in zip(*np.nonzero(self.present))}
+
+    def members_at(self, init_date):
+        """Labels of the members with at least one stored field for an init date."""
+        i = self.inits.get(init_date)
+        if i is None:
+            return []
+        return [member for member, j in self.members.items() if self.present[i, :, j].any()]
+
+    def read(self, variable_name, position, policy=None, rows=None):
+        """
+        Read one field through the shared dataset pool.
+
+        Parameters:
+        - variable_name: str, variable to read
+        - position: tuple, from `position`
+        - policy: dict, load policy (defaults to data_io.load_policy(variable_name))
+        - rows: slice, optional latitude rows to read instead of the whole field
+
+        Returns:
+        - xarray.DataArray, (lat, lon) field in memory
+        """
+        i, k, j = position
+        policy = load_policy(variable_name) if policy is None else policy
+        with default_pool().dataset(self.path, mask_and_scale=False) as dataset:
+            field = dataset[variable_name].isel(init=i, lead=k, member=j).drop_vars(['init', 'lead', 'member'])
+            return decode_field(field if rows is None else field.isel(lat=rows), policy)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(model_name, parameter, store_dir=None):
+    """
+    The index of a repacked store, rebuilt whenever the store file changes.
+
+    Returns:
+    - RepackedStore, or None if the model and parameter have not been repacked
+    """
+    path = store_path(model_name, parameter, store_dir)
+    try:
+        signature = file_signature(path)
+    except FileNotFoundError:
+        return None
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None or store.signature != signature:
+            if store is not None:
+                # Pooled handles predate the append and may not see the new init dates
+                default_pool().forget(path)
+            store = _stores[path] = RepackedStore(path)
+        return store
+
+
+def field_source(file_path, models=None):
+    """
+    Find the repacked copy of a daily model field.
+
+    Returns:
+    - (RepackedStore, position), or None when the field is not in a store
+    """
+    parsed = parse_model_path(os.path.normpath(file_path), models)
+    if parsed is None:
+        return None
+    model_name, parameter, init_date, member, lead = parsed
+    store = open_store(model_name, parameter)
+    position = None if store is None else store.position(init_date, lead, member)
+    return None if position is None else (store, position)
+
+
+def field_signature(file_path, models=None):
+    """
+    Identify the version of a daily model field, wherever it is read from.
+
+    Returns:
+    - str, the file path with the field's RepackedStore.field_stamp for repacked fields
+      (their daily file may be gone), else the path@mtime signature of the daily file
+
+    Raises:
+    - FileNotFoundError, if the field is neither in a store nor on disk
+    """
+    source = field_source(file_path, models)
+    if source is None:
+        return file_signature(file_path)
+    store, position = source
+    return f"{file_path}@{store.field_stamp(position)}"
+
+
+def load_repacked(file_path, variable_name, models=None, policy=None):
+    """
+    Read a daily model field from its repacked store instead of its own file, decoded
+    under `policy` (defaults to data_io.load_policy(variable_name)).
+
+    Returns:
+    - xarray.DataArray, or None when the field is not in a store (the caller then reads
+      the daily file)
+    """
+    source = field_source(file_path, models)
+    if source is None:
+        return None
+    store, position = source
+    return store.read(variable_name, position, policy)
+
+
+if __name__ == '__main__':
+    # Append the init dates added to DATA_PROCESSED since the last run
+    repack_archive(config.config['parameters'])
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import xarray as xr
+import config
+
+METRICS = ['rmse', 'correlation', 'bias', 'mae']
+
+
+def results_path(parameter, reference_name, start_date_str, end_date_str, variant='raw', output_dir=None):
+    """
+    Location of the results cube of one scoring run.
+
+    Parameters:
+    - parameter: str, parameter name
+    - reference_name: str, reference dataset
+    - start_date_str, end_date_str: str, first and last init date (YYYYMMDD)
+    - variant: str, e.g. 'raw' or 'anomaly_harmonic3'
+    - output_dir: str, directory (defaults to config['dir_output']/results)
+
+    Returns:
+    - str, path to the NetCDF file
+    """
+    output_dir = os.path.join(config.config['dir_output'], 'results') if output_dir is None else output_dir
+    return os.path.join(output_dir, f"scores_{parameter}_{reference_name}_{variant}_{start_date_str}_{end_date_str}.nc")
+
+
+def write_results(results, path):
+    """
+    Save verification results as a NetCDF cube with an explicit metric dimension.
+
+    Parameters:
+    - results: xarray.Dataset, output of verification.run_verification
+    - path: str, destination file
+
+    Returns:
+    - str, path written
+    """
+    cube = xr.Dataset(
+        {
+            'score': xr.concat([results[metric] for metric in METRICS], dim='metric'),
+            'pooled_score': xr.concat([results[f'{metric}_pooled'] for metric in METRICS], dim='metric'),
+            'weight': results['weight'],
+            'reference_found': results['reference_found'].astype(np.int8)
+        },
+        attrs=dict(results.attrs)
+    ).assign_coords(metric=METRICS)
+    cube['score'].attrs['description'] = 'Per-field score of one forecast (model, lead, init)'
+    cube['pooled_score'].attrs['description'] = 'Score pooled over all init dates'
+    cube['weight'].attrs['description'] = 'Summed cos(latitude) weight of the valid grid points per field'
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    encoding = {name: {'zlib': True, 'complevel': 4} for name in ('score', 'pooled_score', 'weight')}
+    cube.to_netcdf(path, encoding=encoding)
+    print(f"Results saved to {path}")
+    return path
+
+
+def load_scores(path, metric, pooled=True, models=None, leads=None, inits=None):
+    """
+    Read one metric from a results cube, touching only the requested slice.
+
+    Parameters:
+    - path: str, results cube written by write_results
+    - metric: str, one of METRICS
+    - pooled: bool, pooled scores (model x lead) instead of per-field scores
+    - models, leads, inits: lists to select (default: all); inits ignored when pooled
+
+    Returns:
+    - xarray.DataArray, the selected scores loaded in memory
+    """
+    with xr.open_dataset(path) as cube:
+        scores = cube['pooled_score' if pooled else 'score'].sel(metric=metric)
+        selection = {'model': models, 'lead': leads}
+        if not pooled:
+            selection['init'] = inits
+        scores = scores.sel({dim: values for dim, values in selection.items() if values is not None})
+        return scores.load()
+
+
+def load_counts(path):
+    """
+    Number of init dates with reference data, per lead.
+
+    Returns:
+    - xarray.DataArray, indexed by lead
+    """
+    with xr.open_dataset(path) as cube:
+        return cube['reference_found'].sum('init').load()
@@ -0,0 +1,99 @@
+import os
+import json
+import config
+from accumulators import STATE
+
+
+def file_signature(file_path):
+    """
+    Identify a file version by path and modification time.
+
+    Raises:
+    - FileNotFoundError, if the file does not exist
+    """
+    return f"{file_path}@{os.stat(file_path).st_mtime_ns}"
+
+
+class ResultsStore:
+    """
+    Append-only store of per-field partial statistics.
+
+    Every scored (init, lead, model) field is recorded under a key made of its forecast
+    and reference file signatures, so a re-run only scores fields that are new or whose
+    input files changed. Entries are appended as JSON lines; the last entry for a key wins.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        - path: str, JSON-lines file backing the store (created on first flush)
+        """
+        self.path = path
+        self.entries = {}
+        self.pending = []
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn last line from an interrupted run
+                    self.entries[record['key']] = record['state']
+
+    @classmethod
+    def for_run(cls, parameter, reference_name, variant='raw', output_dir=None):
+        """
+        Store for one parameter, reference dataset and scoring variant.
+
+        Parameters:
+        - parameter: str, parameter name
+        - reference_name: str, reference dataset
+        - variant: str, distinguishes e.g. raw and anomaly scoring
+        - output_dir: str, store directory (defaults to config['dir_output']/results_store)
+        """
+        output_dir = os.path.join(config.config['dir_output'], 'results_store') if output_dir is None else output_dir
+        return cls(os.path.join(output_dir, f"{parameter}_{reference_name}_{variant}.jsonl"))
+
+    @staticmethod
+    def field_key(model_signature, reference_signature, regrid_method, weighting='coslat', climatology=None, policy=None):
+        """
+        Key of one scored field; `climatology` is the signature of the climatology that
+        anomalies were taken from (None for raw scores) and `policy` the data_io.policy_digest
+        of the forecast and reference load policies the fields were decoded under.
+        """
+        key = f"{model_signature}|{reference_signature}|{regrid_method}|{weighting}"
+        if policy is not None:
+            key = f"{key}|{policy}"
+        return key if climatology is None else f"{key}|{climatology}"
+
+    def lookup(self, key):
+        """
+        Cached state of a field.
+
+        Returns:
+        - dict, one float per entry of accumulators.STATE, or None if not stored
+        """
+        return self.entries.get(key)
+
+    def add(self, key, state):
+        """Record the state of a newly scored field (written on the next flush)."""
+        state = {name: float(state[name]) for name in STATE}
+        self.entries[key] = state
+        self.pending.append({'key': key, 'state': state})
+
+    def extend(self, records):
+        """Add records collected elsewhere (e.g. by a worker process)."""
+        for record in records:
+            self.add(record['key'], record['state'])
+
+    def flush(self):
+        """Append pending records to disk."""
+        if not self.pending:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as file:
+            for record in self.pending:
+                file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending = []
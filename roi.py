@@ -0,0 +1,135 @@
+import numpy as np
+from handle_pool import default_pool
+from data_io import load_policy, decode_field
+from metrics import latitude_weights
+
+
+def _runs(indices):
+    """Split sorted indices into contiguous slices."""
+    if len(indices) == 0:
+        return []
+    breaks = np.nonzero(np.diff(indices) != 1)[0] + 1
+    return [slice(int(run[0]), int(run[-1]) + 1) for run in np.split(indices, breaks)]
+
+
+def box_indices(lat, lon, lat_range, lon_range):
+    """
+    Map a lat/lon box to index ranges of a grid.
+
+    Latitudes may be ascending or descending, longitudes in 0..360 or -180..180; a box
+    crossing the longitude seam yields two ranges. A box smaller than the grid spacing
+    falls back to the grid point nearest its centre.
+
+    Parameters:
+    - lat, lon: numpy.ndarray, grid coordinates
+    - lat_range, lon_range: tuple, (min, max) of the box in degrees
+
+    Returns:
+    - lat_slice: slice, rows of the box
+    - lon_slices: list of slice, columns of the box (west to east)
+    """
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    lat_lo, lat_hi = sorted(lat_range)
+    rows = np.nonzero((lat >= lat_lo) & (lat <= lat_hi))[0]
+    if len(rows) == 0:
+        rows = np.array([np.abs(lat - (lat_lo + lat_hi) / 2).argmin()])
+
+    if lon.min() >= 0:
+        lon_lo, lon_hi = (value % 360 if value != 360 else 360 for value in lon_range)
+    else:
+        lon_lo, lon_hi = (((value + 180) % 360) - 180 if value != 180 else 180 for value in lon_range)
+    if lon_lo <= lon_hi:
+        columns = np.nonzero((lon >= lon_lo) & (lon <= lon_hi))[0]
+        lon_slices = _runs(columns)
+    else:
+        lon_slices = _runs(np.nonzero(lon >= lon_lo)[0]) + _runs(np.nonzero(lon <= lon_hi)[0])
+    if not lon_slices:
+        centre = (lon_lo + (lon_hi - lon_lo) % 360 / 2) % 360
+        distance = np.abs((lon % 360) - centre)
+        column = int(np.minimum(distance, 360 - distance).argmin())
+        lon_slices = [slice(column, column + 1)]
+    return slice(int(rows.min()), int(rows.max()) + 1), lon_slices
+
+
+class RegionReader:
+    """
+    Read named lat/lon boxes from gridded NetCDF files without decoding the full field.
+
+    Each box is mapped to index ranges once per grid and read as a hyperslab, so one
+    pass over the archive yields values for any number of regions at a few KB per file.
+    """
+
+    def __init__(self, regions, pool=None):
+        """
+        Parameters:
+        - regions: dict, region name -> (lat_range, lon_range)
+        - pool: DatasetPool, pool to open files through (defaults to the shared pool)
+        """
+        self.regions = dict(regions)
+        self.names = list(self.regions)
+        self.pool = pool
+        self.layouts = {}
+
+    def layout(self, lat, lon):
+        """
+        Index ranges and cos-latitude weights of every region on a grid (cached per grid).
+
+        Returns:
+        - list of (lat_slice, lon_slices, weights) in the order of `names`
+        """
+        key = (lat.size, float(lat[0]), float(lat[-1]), lon.size, float(lon[0]), float(lon[-1]))
+        if key not in self.layouts:
+            layout = []
+            for name in self.names:
+                lat_slice, lon_slices = box_indices(lat, lon, *self.regions[name])
+                n_columns = sum(s.stop - s.start for s in lon_slices)
+                layout.append((lat_slice, lon_slices, latitude_weights(lat[lat_slice], np.empty(n_columns))))
+            self.layouts[key] = layout
+        return self.layouts[key]
+
+    def _read(self, file_path, variable_name):
+        pool = default_pool() if self.pool is None else self.pool
+        boxes = []
+        policy = load_policy(variable_name)
+        with pool.dataset(file_path, mask_and_scale=False) as dataset:
+            variable = dataset[variable_name].squeeze()
+            layout = self.layout(dataset['lat'].values, dataset['lon'].values)
+            for lat_slice, lon_slices, _ in layout:
+                parts = [decode_field(variable.isel(lat=lat_slice, lon=lon_slice), policy).values for lon_slice in lon_slices]
+                boxes.append(parts[0] if len(parts) == 1 else np.concatenate(parts, axis=-1))
+        return boxes, layout
+
+    def read(self, file_path, variable_name):
+        """
+        Values of every region in one file.
+
+        Parameters:
+        - file_path: str, path to the NetCDF file
+        - variable_name: str, variable to read
+
+        Returns:
+        - dict, region name -> numpy.ndarray (..., lat, lon) box values
+
+        Raises:
+        - FileNotFoundError, if the file does not exist
+        """
+        boxes, _ = self._read(file_path, variable_name)
+        return dict(zip(self.names, boxes))
+
+    def means(self, file_path, variable_name):
+        """
+        Area-weighted box means of every region in one file, ignoring NaNs.
+
+        Returns:
+        - numpy.ndarray, shape (region, ...) in the order of `names`
+
+        Raises:
+        - FileNotFoundError, if the file does not exist
+        """
+        boxes, layout = self._read(file_path, variable_name)
+        means = []
+        for values, (_, _, weights) in zip(boxes, layout):
+            valid = np.isfinite(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means.append((np.where(valid, values, 0.0) * weights).sum(axis=(-2, -1)) / (valid * weights).sum(axis=(-2, -1)))
+        return np.array(means)
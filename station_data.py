@@ -0,0 +1,160 @@
+import os
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+from scipy.io import loadmat
+import config
+try:
+    import h5py
+except ImportError:  # Only needed for MATLAB v7.3 files
+    h5py = None
+
+
+def read_station(file_path, mat_names):
+    """
+    Read every needed series of one station .mat file with a single open.
+
+    Legacy (v5) files are read with scipy.io.loadmat, v7.3 (HDF5) files with h5py.
+    Nested struct fields are addressed as 'struct/field'.
+
+    Parameters:
+    - file_path: str, station .mat file
+    - mat_names: dict, output name -> variable path in the file (None for unavailable)
+
+    Returns:
+    - dict, output name -> 1-D float32 array, or None where the variable is missing
+    """
+    try:
+        top_level = sorted({name.split('/')[0] for name in mat_names.values() if name is not None})
+        mat = loadmat(file_path, variable_names=top_level)
+
+        def get(path):
+            value = mat[path.split('/')[0]]
+            for field in path.split('/')[1:]:
+                value = value[0, 0][field]
+            return value
+        transpose = False
+    except NotImplementedError:
+        # MATLAB v7.3 files are HDF5
+        if h5py is None:
+            raise ImportError(f"{file_path} is a MATLAB v7.3 file; reading it needs h5py")
+        mat = h5py.File(file_path, 'r')
+
+        def get(path):
+            return mat[path][()]
+        transpose = True
+
+    series = {}
+    try:
+        for name, path in mat_names.items():
+            if path is None:
+                series[name] = None
+                continue
+            try:
+                values = get(path)
+            except (KeyError, ValueError, IndexError):
+                series[name] = None
+                continue
+            values = np.asarray(values.T if transpose else values, dtype=np.float32)
+            series[name] = values.squeeze().reshape(-1)
+    finally:
+        if transpose:
+            mat.close()
+    return series
+
+
+def _convert_one(job):
+    file_path, mat_names = job
+    try:
+        return file_path, read_station(file_path, mat_names), None
+    except Exception as error:  # A corrupt station must not stop the conversion
+        return file_path, None, str(error)
+
+
+def convert_stations(station_files, output_path, mat_names, start_date, end_date, coordinate_names=None, workers=None):
+    """
+    Convert station .mat files into one (station, time) NetCDF store.
+
+    Each file is opened once and files are read in a process pool. Series shorter or
+    longer than the date range are taken to start on `start_date`, as before. The store
+    is written uncompressed in the NetCDF-3 64-bit format so readers can memory-map it.
+
+    Parameters:
+    - station_files: list of str, .mat files
+    - output_path: str, NetCDF store to write
+    - mat_names: dict, store variable name -> variable path in the .mat files (None to fill with NaN)
+    - start_date, end_date: datetime, daily time axis of the store
+    - coordinate_names: dict, optional {'lat': path, 'lon': path} of the station location in the files
+    - workers: int, processes (defaults to config['workers'])
+
+    Returns:
+    - failed: list of (station id, error) tuples
+    """
+    workers = config.config['workers'] if workers is None else workers
+    coordinate_names = coordinate_names or {}
+    names = dict(mat_names, **{f"station_{key}": path for key, path in coordinate_names.items()})
+    jobs = [(file_path, names) for file_path in station_files]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_convert_one, jobs, chunksize=max(1, len(jobs) // (workers * 8))))
+    else:
+        results = [_convert_one(job) for job in jobs]
+
+    times = np.arange(np.datetime64(start_date.strftime('%Y-%m-%d')), np.datetime64(end_date.strftime('%Y-%m-%d')) + 1)
+    station_ids = ['gauge_' + os.path.basename(file_path)[:-4] for file_path in station_files]
+    values = {name: np.full((len(station_files), len(times)), np.nan, dtype=np.float32) for name in mat_names}
+    lat = np.full(len(station_files), np.nan, dtype=np.float32)
+    lon = np.full(len(station_files), np.nan, dtype=np.float32)
+    keep = np.ones(len(station_files), dtype=bool)
+    failed = []
+    for i, (file_path, series, error) in enumerate(results):
+        if series is None:
+            print(f"Error processing {station_ids[i]}: {error}")
+            failed.append((station_ids[i], error))
+            keep[i] = False
+            continue
+        for name in mat_names:
+            data = series[name]
+            if data is None:
+                continue
+            n = min(len(data), len(times))
+            values[name][i, :n] = data[:n]
+        for key, target in (('lat', lat), ('lon', lon)):
+            data = series.get(f"station_{key}")
+            if data is not None and data.size:
+                target[i] = data[0]
+
+    store = xr.Dataset(
+        {name: (('station', 'time'), data[keep]) for name, data in values.items()},
+        coords={'station': np.asarray(station_ids)[keep], 'time': times, 'lat': ('station', lat[keep]), 'lon': ('station', lon[keep])}
+    )
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    store.to_netcdf(output_path, format='NETCDF3_64BIT', engine='scipy')
+    print(f"Saved {keep.sum()} stations x {len(times)} days to {output_path}")
+    return failed
+
+
+def open_station_store(store_path=None):
+    """
+    Open the station store memory-mapped; nothing is read until values are used.
+
+    Parameters:
+    - store_path: str, defaults to the 'store_path' of the 'Station' reference in config.py
+
+    Returns:
+    - xarray.Dataset, (station, time) variables with station lat/lon coordinates
+    """
+    store_path = config.reference_data['Station']['store_path'] if store_path is None else store_path
+    return xr.open_dataset(store_path, engine='scipy', mmap=True)
+
+
+def load_station_series(parameter, reference_data=None):
+    """
+    Station observations of one parameter.
+
+    Returns:
+    - xarray.DataArray, (station, time) with `lat`/`lon` station coordinates
+    """
+    reference_data = config.reference_data if reference_data is None else reference_data
+    station = reference_data['Station']
+    return open_station_store(station['store_path'])[station['variable_names'][parameter]]
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import contextlib
+from datetime import datetime
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import config
+import repack
+from synthetic_archive import generate_gwpm_archive
+from ensemble import ensemble_models, run_ensemble_verification, stream_member_statistics
+from reference_cache import ReferenceCache
+
+start_date = datetime(2024, 8, 15)
+forecast_horizons = [1, 2]
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """A small synthetic archive with ensemble members, wired into config."""
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        models, reference_data = generate_gwpm_archive(str(tmp_path), ['Temp'], start_date, 2, forecast_horizons,
+                                                       n_members=4, n_lat=19, n_lon=36)
+    monkeypatch.setattr(config, 'models', models)
+    monkeypatch.setattr(config, 'reference_data', reference_data)
+    monkeypatch.setitem(config.config, 'dir_repacked', str(tmp_path / 'REPACKED'))
+    return models, reference_data
+
+
+def verify(models, reference_data, threads=1):
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        return run_ensemble_verification('Temp', 'GDAS', start_date, start_date, forecast_horizons, models=models,
+                                         reference_data=reference_data, reference_cache=ReferenceCache(reference_data=reference_data),
+                                         threads=threads)
+
+
+def test_ensemble_scores_from_store_after_daily_files_are_deleted(archive):
+    models, reference_data = archive
+    model_names = ensemble_models('Temp', models)
+    assert model_names
+    before = verify(models, reference_data)
+    before_statistics = stream_member_statistics(model_names[0], 'Temp', start_date, forecast_horizons, models=models)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        repack.repack_archive(['Temp'], model_names, workers=1)
+    for model_name in model_names:
+        shutil.rmtree(os.path.join(models[model_name]['data_path'], 'Temp'))
+
+    after = verify(models, reference_data, threads=2)
+    assert (after['members'].values == 4).all()
+    np.testing.assert_allclose(after['crps'].values, before['crps'].values, rtol=1e-6)
+    np.testing.assert_array_equal(after['rank_histogram'].values, before['rank_histogram'].values)
+
+    after_statistics = stream_member_statistics(model_names[0], 'Temp', start_date, forecast_horizons, models=models)
+    for name in ('mean', 'std', 'quantile_values', 'members'):
+        np.testing.assert_allclose(after_statistics[name].values, before_statistics[name].values, rtol=1e-6)
@@ -3,31 +3,40 @@ import numpy as np
 import xarray as xr
 import matplotlib.pyplot as plt
 import json
+from handle_pool import default_pool
+from data_io import load_policy, decode_field
+import instrument
+from metrics import latitude_weights
+from best_model import select_best
 
 def load_netcdf_data(file_path, variable_name):
     """
-    Load data from a NetCDF file.
+    Load data from a NetCDF file through the shared dataset pool.
     
     Parameters:
     - file_path: str, path to the NetCDF file
     - variable_name: str, name of the variable to extract
     
     Returns:
-    - data: xarray.DataArray, extracted data
+    - data: xarray.DataArray, extracted data, loaded in memory so the file can be closed,
+      in the dtype of the variable's load policy (see data_io.load_policy)
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
         
-    dataset = xr.open_dataset(file_path)
-    if variable_name not in dataset:
-        raise KeyError(f"Variable '{variable_name}' not found in {file_path}")
-    
-    data = dataset[variable_name]
-    return data.squeeze()  # Remove any singleton dimensions
+    with default_pool().dataset(file_path, mask_and_scale=False) as dataset:
+        if variable_name not in dataset:
+            raise KeyError(f"Variable '{variable_name}' not found in {file_path}")
+        with instrument.stage('decode'):
+            data = decode_field(dataset[variable_name].squeeze(), load_policy(variable_name))  # Remove any singleton dimensions
+    instrument.count('bytes_decoded', data.nbytes)
+    return data
 
 def calculate_rmse(forecast, actual):
     """
-    Calculate the Root Mean Square Error (RMSE) between forecast and actual data.
+    Calculate the area-weighted Root Mean Square Error (RMSE) between forecast and actual data.
+    
+    Grid points are weighted by cos(latitude); points that are NaN on either side are ignored.
     
     Parameters:
     - forecast: xarray.DataArray, forecasted values
@@ -36,7 +45,8 @@ def calculate_rmse(forecast, actual):
     Returns:
     - rmse: float, calculated RMSE
     """
-    rmse = np.sqrt(((forecast - actual) ** 2).mean(dim=['lat', 'lon']))
+    weights = xr.DataArray(latitude_weights(actual['lat'].values), coords={'lat': actual['lat']}, dims='lat')
+    rmse = np.sqrt(((forecast - actual) ** 2).weighted(weights).mean(dim=['lat', 'lon']))
     return rmse
 
 def plot_global_map(data, title, output_path, cmap='viridis'):
@@ -65,10 +75,13 @@ def find_best_model(global_abs_errors, models):
     - models: list of model names
     
     Returns:
-    - xarray.DataArray, showing which model performed best at each grid point
+    - xarray.DataArray, showing which model performed best at each grid point (-1 where every model is NaN)
     """
-    stacked_data = np.stack([global_abs_errors[model] for model in models], axis=0)
-    best_model_indices = np.nanargmin(stacked_data, axis=0)
+    first = np.asarray(global_abs_errors[models[0]])
+    stacked_data = np.empty((len(models),) + first.shape, dtype=np.float32)
+    for i, model in enumerate(models):
+        stacked_data[i] = global_abs_errors[model]
+    best_model_indices, _, _ = select_best(stacked_data)
     best_model_data = xr.DataArray(best_model_indices, dims=['lat', 'lon'])
     return best_model_data
 
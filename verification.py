@@ -0,0 +1,345 @@
+import numpy as np
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import config
+import instrument
+from data_io import model_file_path, reference_file_path, init_dates, load_policy, policy_digest
+from reference_cache import default_reference_cache
+from regrid import regrid_stack
+from accumulators import MetricAccumulator, STATE
+from metrics import MetricKernel
+from results_store import file_signature
+from repack import field_signature
+from handle_pool import default_pool
+from prefetch import Prefetcher, field_schedule
+from availability import allowed
+
+
+def plan_verification(parameter, reference_name, start_date, end_date, forecast_horizons, models=None, reference_data=None):
+    """
+    Plan every (init, lead, model, reference) combination of a verification run.
+
+    Parameters:
+    - parameter: str, parameter name
+    - reference_name: str, reference dataset to verify against
+    - start_date, end_date: datetime, first and last init date
+    - forecast_horizons: list of int, lead times in days
+    - models: dict, model config (defaults to config.models)
+    - reference_data: dict, reference config (defaults to config.reference_data)
+
+    Returns:
+    - list of dict, one task per (init, lead, model) with the file paths resolved; leads
+      beyond a model's `availability` limits in config.py are not planned
+    """
+    models = config.models if models is None else models
+    model_names = [name for name, details in models.items() if parameter in details['predictors']]
+    tasks = []
+    for init_date in init_dates(start_date, end_date):
+        for lead in forecast_horizons:
+            valid_date = init_date + timedelta(days=lead)
+            reference_path = reference_file_path(reference_name, parameter, valid_date, reference_data)
+            for model_name in model_names:
+                if not allowed(model_name, parameter, lead):
+                    continue
+                tasks.append({
+                    'init': init_date,
+                    'lead': lead,
+                    'valid': valid_date,
+                    'model': model_name,
+                    'model_path': model_file_path(model_name, parameter, init_date, valid_date, models),
+                    'reference_path': reference_path
+                })
+    return tasks
+
+
+def group_by_valid_date(tasks):
+    """
+    Group planned tasks by the day they verify on, in chronological order.
+
+    Returns:
+    - dict, valid date -> list of tasks
+    """
+    groups = {}
+    for task in sorted(tasks, key=lambda t: t['valid']):
+        groups.setdefault(task['valid'], []).append(task)
+    return groups
+
+
+def score_valid_dates(parameter, reference_name, groups, model_names, forecast_horizons, inits, climatology=None,
+                      models=None, reference_data=None, reference_cache=None, results_store=None, flush_store=True):
+    """
+    Score the tasks of a set of valid dates; the unit of work of one worker.
+
+    Parameters:
+    - groups: list of (valid date, tasks) pairs from group_by_valid_date
+    - model_names, forecast_horizons, inits: labels of the full result cube
+    - climatology: xarray.DataArray, optional day-of-year climatology (only the days
+      of these valid dates are needed)
+    - results_store: ResultsStore, optional; fields already in it are merged from the
+      store without reading any file, new fields are added to it
+    - flush_store: bool, append new store entries to disk after every valid date;
+      workers leave that to the parent process
+    - other parameters as in run_verification
+
+    Returns:
+    - accumulator: MetricAccumulator, shape (model, lead, init), empty slots where no
+      field was scored
+    - reference_found: numpy.ndarray, (lead, init) bool
+    - new_records: list of dict, store entries added by this call (empty without a store)
+    """
+    models = config.models if models is None else models
+    reference_data = config.reference_data if reference_data is None else reference_data
+    if reference_cache is None:
+        reference_cache = default_reference_cache(reference_data)
+    model_index = {name: i for i, name in enumerate(model_names)}
+    lead_index = {lead: i for i, lead in enumerate(forecast_horizons)}
+    init_index = {init: i for i, init in enumerate(inits)}
+
+    shape = (len(model_names), len(forecast_horizons), len(inits))
+    accumulator = MetricAccumulator(shape)
+    reference_found = np.zeros(shape[1:], dtype=bool)
+    regrid_method = config.variables[parameter].get('regrid_method', 'linear')
+    new_records = []
+    kernels = {}  # cos-latitude weighted metric kernel per reference grid, with its buffers
+
+    def slot(task):
+        return model_index[task['model']], lead_index[task['lead']], init_index[task['init']]
+
+    instrument.watch('reference_cache', reference_cache.stats)
+    instrument.watch('dataset_pool', default_pool().stats)
+
+    # Fields whose input files are unchanged since they were stored need no I/O at all;
+    # the lookup runs for every date first so the read-ahead gets the whole schedule
+    climatology_signature = None if climatology is None else climatology.attrs.get('signature')
+    # Scores change with the dtype and masking the fields are decoded under
+    reference_policy = load_policy(reference_data[reference_name]['variable_names'][parameter])
+    policy_digests = {model_name: policy_digest(load_policy(models[model_name]['variable_names'][parameter]), reference_policy)
+                      for model_name in model_names}
+    plan = []  # (valid date, group, tasks to score, store key per task)
+    for valid_date, group in groups:
+        reference_path = group[0]['reference_path']
+        to_score, keys = group, {}
+        if results_store is not None:
+            try:
+                reference_signature = file_signature(reference_path)
+            except FileNotFoundError:
+                print(f"Reference data not found at path: {reference_path}. Skipping date {valid_date.strftime('%Y%m%d')}.")
+                continue
+            to_score = []
+            for task in group:
+                try:
+                    key = results_store.field_key(field_signature(task['model_path']), reference_signature, regrid_method,
+                                                  climatology=climatology_signature, policy=policy_digests[task['model']])
+                except FileNotFoundError:
+                    print(f"File not found: {task['model_path']} for model '{task['model']}' on date {task['init'].strftime('%Y%m%d')}.")
+                    continue
+                cached = results_store.lookup(key)
+                if cached is None:
+                    keys[id(task)] = key
+                    to_score.append(task)
+                else:
+                    accumulator.fold(tuple(np.array([i]) for i in slot(task)), {name: [cached[name]] for name in STATE})
+        plan.append((valid_date, group, to_score, keys))
+
+    # Forecast files still to score are read ahead, in the order they are scored below
+    prefetcher = Prefetcher(field_schedule([task for _, _, to_score, _ in plan for model_name in model_names
+                                            for task in to_score if task['model'] == model_name],
+                                           models, parameter)).start()
+    instrument.watch('prefetch', prefetcher.stats)
+    for valid_date, group, to_score, keys in plan:
+        print(f"\nVerifying forecasts valid on: {valid_date.strftime('%Y%m%d')}")
+        reference_path = group[0]['reference_path']
+        if len(to_score) < len(group):
+            print(f"    {len(group) - len(to_score)} fields taken from the results store")
+
+        if to_score:
+            try:
+                with instrument.stage('reference', parameter=parameter):
+                    actual = reference_cache.get(reference_name, parameter, valid_date)
+            except FileNotFoundError:
+                print(f"Reference data not found at path: {reference_path}. Skipping this date.")
+                instrument.count('missing_reference', parameter=parameter)
+                continue
+        for task in group:
+            reference_found[lead_index[task['lead']], init_index[task['init']]] = True
+        if not to_score:
+            continue
+
+        climatology_day = None
+        if climatology is not None:
+            climatology_day = climatology.sel(dayofyear=valid_date.timetuple().tm_yday)
+            actual_values = (actual - climatology_day).values
+            climatology_day = np.asarray(climatology_day)
+        else:
+            actual_values = actual.values
+
+        for model_name in model_names:
+            model_tasks = [task for task in to_score if task['model'] == model_name]
+            fields, scored = [], []
+            for task in model_tasks:
+                try:
+                    with instrument.stage('read', model=model_name, parameter=parameter, lead=task['lead']):
+                        forecast = prefetcher.get(task['model_path'])
+                except FileNotFoundError:
+                    print(f"File not found: {task['model_path']} for model '{model_name}' on date {task['init'].strftime('%Y%m%d')}.")
+                    instrument.count('missing_forecast', model=model_name, parameter=parameter, lead=task['lead'])
+                    continue
+                fields.append(forecast)
+                scored.append(task)
+            if not fields:
+                continue
+
+            print(f"    Scoring model: {model_name} ({len(fields)} leads)")
+            stacked = np.stack([forecast.values for forecast in fields])
+            if fields[0].dims != actual.dims or fields[0].shape != actual.shape:
+                # A model keeps its grid across days, so the whole stack shares one weight matrix
+                with instrument.stage('regrid', model=model_name, parameter=parameter):
+                    stacked = regrid_stack(stacked, fields[0]['lat'].values, fields[0]['lon'].values,
+                                           actual['lat'].values, actual['lon'].values, regrid_method)
+            if climatology_day is not None:
+                stacked = stacked - climatology_day
+            grid = (actual['lat'].values.tobytes(), actual['lon'].values.tobytes())
+            if grid not in kernels:
+                kernels[grid] = MetricKernel.for_grid(actual['lat'].values, actual['lon'].values)
+            with instrument.stage('score', model=model_name, parameter=parameter):
+                field_state = kernels[grid].moments(stacked, actual_values)
+            accumulator.fold(tuple(np.array(axis) for axis in zip(*[slot(task) for task in scored])), field_state)
+
+            if results_store is not None:
+                for k, task in enumerate(scored):
+                    record = {'key': keys[id(task)], 'state': {name: float(field_state[name][k]) for name in STATE}}
+                    results_store.add(record['key'], record['state'])
+                    new_records.append(record)
+
+        if results_store is not None and flush_store:
+            results_store.flush()
+
+    prefetcher.close()
+    prefetcher.report()
+    reference_cache.report()
+    default_pool().report()
+    return accumulator, reference_found, new_records
+
+
+def _score_shard(kwargs):
+    """Process-pool entry point for score_valid_dates; also returns the worker's instrumentation."""
+    instrument.worker_reset()
+    return score_valid_dates(**kwargs), instrument.worker_snapshot()
+
+
+def shard_groups(groups, n_shards):
+    """
+    Split valid-date groups into contiguous, roughly equal shards.
+
+    Returns:
+    - list of lists of (valid date, tasks) pairs, in chronological order
+    """
+    n_shards = max(1, min(n_shards, len(groups)))
+    bounds = np.linspace(0, len(groups), n_shards + 1).round().astype(int)
+    return [groups[bounds[i]:bounds[i + 1]] for i in range(n_shards)]
+
+
+def run_verification(parameter, reference_name, start_date, end_date, forecast_horizons, climatology=None,
+                     models=None, reference_data=None, reference_cache=None, workers=None, results_store=None,
+                     availability=None):
+    """
+    Score every model forecast against the reference in one pass over the valid dates.
+
+    Each reference field is read once per valid date and all forecasts verifying on
+    that date are stacked per model and folded into a (model, lead, init) accumulator.
+    With more than one worker the valid dates are sharded across a process pool; every
+    (model, lead, init) field is scored by exactly one worker, so the merged result
+    equals the serial one.
+
+    Parameters:
+    - parameter: str, parameter name
+    - reference_name: str, reference dataset to verify against
+    - start_date, end_date: datetime, first and last init date
+    - forecast_horizons: list of int, lead times in days
+    - climatology: xarray.DataArray, optional day-of-year climatology on the reference grid;
+      when given, anomalies are scored instead of raw fields
+    - models: dict, model config (defaults to config.models)
+    - reference_data: dict, reference config (defaults to config.reference_data)
+    - reference_cache: ReferenceCache, cache to read reference fields through in serial
+      runs (defaults to one built from config.py; each worker builds its own)
+    - workers: int, number of worker processes (defaults to config['workers'])
+    - results_store: ResultsStore, optional store of per-field statistics; only fields
+      missing from it (or whose files changed) are read and scored, then appended
+    - availability: AvailabilityIndex, optional scan of the archive; combinations whose
+      forecast or reference file does not exist are dropped before any I/O
+
+    Returns:
+    - xarray.Dataset, see results_dataset
+    """
+    models = config.models if models is None else models
+    reference_data = config.reference_data if reference_data is None else reference_data
+    workers = config.config['workers'] if workers is None else workers
+    tasks = plan_verification(parameter, reference_name, start_date, end_date, forecast_horizons, models, reference_data)
+    planned = tasks
+    if availability is not None:
+        tasks, missing = availability.filter_tasks(tasks, parameter, reference_name)
+        print(f"{len(tasks)} of {len(planned)} planned fields are in the archive; {len(missing)} files missing.")
+
+    model_names = [name for name, details in models.items() if parameter in details['predictors']]
+    inits = init_dates(start_date, end_date)
+    groups = list(group_by_valid_date(tasks).items())
+    common = {'parameter': parameter, 'reference_name': reference_name, 'model_names': model_names,
+              'forecast_horizons': list(forecast_horizons), 'inits': inits, 'models': models,
+              'reference_data': reference_data}
+
+    if workers <= 1:
+        accumulator, reference_found, _ = score_valid_dates(groups=groups, climatology=climatology,
+                                                            reference_cache=reference_cache,
+                                                            results_store=results_store, **common)
+    else:
+        jobs = []
+        for shard in shard_groups(groups, workers * 4):
+            shard_climatology = None
+            if climatology is not None:
+                # Ship only the days this shard needs instead of the whole store
+                days = sorted({valid_date.timetuple().tm_yday for valid_date, _ in shard})
+                shard_climatology = climatology.sel(dayofyear=days).load()
+            jobs.append(dict(common, groups=shard, climatology=shard_climatology,
+                             results_store=results_store, flush_store=False))
+
+        accumulator = MetricAccumulator((len(model_names), len(forecast_horizons), len(inits)))
+        reference_found = np.zeros((len(forecast_horizons), len(inits)), dtype=bool)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (shard_accumulator, shard_found, shard_records), snapshot in executor.map(_score_shard, jobs):
+                instrument.merge(snapshot)
+                accumulator.merge(shard_accumulator)
+                reference_found |= shard_found
+                if results_store is not None:
+                    results_store.extend(shard_records)
+                    results_store.flush()
+
+    if availability is not None:
+        # Dates whose forecasts were all dropped still had their reference
+        lead_index = {lead: i for i, lead in enumerate(forecast_horizons)}
+        init_index = {init: i for i, init in enumerate(inits)}
+        for task in planned:
+            if availability.has_reference(reference_name, parameter, task['valid']):
+                reference_found[lead_index[task['lead']], init_index[task['init']]] = True
+
+    return results_dataset(accumulator, reference_found, model_names, forecast_horizons, inits,
+                           attrs={'parameter': parameter, 'reference': reference_name, 'weighting': 'cos(latitude)'})
+
+
+def results_dataset(accumulator, reference_found, model_names, forecast_horizons, inits, attrs=None):
+    """
+    Label per-field and pooled scores of a (model, lead, init) accumulator.
+
+    Returns:
+    - xarray.Dataset, per-field `rmse`, `correlation`, `bias`, `mae` and `weight`, the
+      summed cos(latitude) weight of the valid grid points (model x lead x init), the same metrics pooled over init dates as `*_pooled`
+      (model x lead), and `reference_found` (lead x init)
+    """
+    pooled = accumulator.reduce(axis=2)
+    field_dims, pooled_dims = ('model', 'lead', 'init'), ('model', 'lead')
+    variables = {'weight': (field_dims, accumulator.weight), 'reference_found': (('lead', 'init'), reference_found)}
+    for metric in ('rmse', 'correlation', 'bias', 'mae'):
+        variables[metric] = (field_dims, getattr(accumulator, metric)())
+        variables[f'{metric}_pooled'] = (pooled_dims, getattr(pooled, metric)())
+    coords = {'model': list(model_names), 'lead': list(forecast_horizons), 'init': np.array(inits, dtype='datetime64[ns]')}
+    return xr.Dataset(variables, coords=coords, attrs=attrs or {})